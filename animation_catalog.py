@@ -0,0 +1,121 @@
+import json
+import os
+import random
+import time
+from enum import Enum
+from typing import Dict
+from cozmo.anim import Triggers
+from config import Config
+
+# Weight of a new measurement, durations vary a little between runs of the same trigger
+SMOOTHING = 0.3
+SAVE_INTERVAL = 60
+# Picked from when nothing is known to fit the budget, so a reaction still varies
+FALLBACK_CHOICES = 2
+# Rough durations in seconds until a trigger was measured on this robot, on the long side so budgets hold
+SEED_DURATIONS = {
+    "MajorWin": 6.5,
+    "CodeLabHappy": 3.0,
+    "CodeLabYes": 2.0,
+    "CodeLabAmazed": 3.5,
+    "CodeLabCelebrate": 4.5,
+    "PopAWheelieInitial": 4.0,
+    "FeedingAteFullEnough_Normal": 5.5,
+    "DriveEndHappy": 2.0,
+    "BlockReact": 1.8,
+    "MajorFail": 6.5,
+    "CubeMovedUpset": 3.5,
+    "CodeLabUnhappy": 2.5,
+    "PounceFail": 2.5,
+    "CodeLabBored": 4.5,
+    "FrustratedByFailureMajor": 5.5,
+}
+
+
+class Emotion(Enum):
+    Positive = "positive"
+    Negative = "negative"
+
+
+EMOTIONS = {
+    Emotion.Positive: [
+        Triggers.MajorWin,
+        Triggers.CodeLabHappy,
+        Triggers.CodeLabYes,
+        Triggers.CodeLabAmazed,
+        Triggers.CodeLabCelebrate,
+        Triggers.PopAWheelieInitial,
+        Triggers.FeedingAteFullEnough_Normal,
+        Triggers.DriveEndHappy,
+        Triggers.BlockReact
+    ],
+    Emotion.Negative: [
+        Triggers.MajorFail,
+        Triggers.CubeMovedUpset,
+        Triggers.CodeLabUnhappy,
+        Triggers.PounceFail,
+        Triggers.CodeLabBored,
+        Triggers.FrustratedByFailureMajor
+    ],
+}
+
+
+class AnimationCatalog():
+    def __init__(self, config: Config) -> None:
+        self._config = config
+        # Measured on this robot, only these are saved and a first measurement replaces the seed outright
+        self._durations: Dict[str, float] = dict()
+        self._dirty = False
+        self._last_save = time.monotonic()
+        self._load()
+
+    def duration(self, trigger) -> float:
+        return self._durations.get(trigger.name, SEED_DURATIONS.get(trigger.name))
+
+    def pick(self, emotion: Emotion, budget: float = None):
+        # Unbudgeted calls try every trigger, that is where durations get measured
+        triggers = EMOTIONS[emotion]
+        if budget is None:
+            return random.choice(triggers)
+        known = [trigger for trigger in triggers if self.duration(trigger) is not None]
+        fitting = [trigger for trigger in known if self.duration(trigger) <= budget]
+        if fitting:
+            return random.choice(fitting)
+        # Cut off at the budget by the caller, the shortest ones lose the least
+        return random.choice(sorted(known, key=self.duration)[:FALLBACK_CHOICES] or triggers)
+
+    def record(self, trigger, seconds: float) -> None:
+        previous = self._durations.get(trigger.name)
+        self._durations[trigger.name] = seconds if previous is None else previous + SMOOTHING * (seconds - previous)
+        self._dirty = True
+        if time.monotonic() - self._last_save > SAVE_INTERVAL:
+            self.save()
+
+    def record_overrun(self, trigger, seconds: float) -> None:
+        # Aborted at the budget, so it runs at least this long
+        self._durations[trigger.name] = max(self._durations.get(trigger.name, seconds), seconds)
+        self._dirty = True
+
+    def save(self) -> None:
+        self._last_save = time.monotonic()
+        path = self._config.animation_catalog_file
+        if not self._dirty or path is None:
+            return
+        try:
+            with open(path + ".tmp", "w") as catalog_file:
+                json.dump({name: round(seconds, 3) for name, seconds in sorted(self._durations.items())}, catalog_file, indent=2)
+            os.replace(path + ".tmp", path)
+            self._dirty = False
+        except OSError as e:
+            print("Cannot write animation catalog {}: {}".format(path, e))
+
+    def _load(self) -> None:
+        path = self._config.animation_catalog_file
+        if path is None or not os.path.exists(path):
+            return
+        try:
+            with open(path) as catalog_file:
+                self._durations = {name: float(seconds) for name, seconds in json.load(catalog_file).items()}
+            print("Loaded {} animation durations from {}".format(len(self._durations), path))
+        except (OSError, ValueError, AttributeError) as e:
+            print("Cannot read animation catalog {}: {}".format(path, e))
@@ -1,11 +1,33 @@
 from cozmo_mqtt_program import CozmoMqttProgram
-import cozmo
+from config import Config
+from profiler import SamplingProfiler
+import argparse
+import asyncio
 
-if __name__ == '__main__':   
-    cozmo_mqqtt_app = CozmoMqttProgram()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Cozmo MQTT app")
+    parser.add_argument("--profile", type=float, metavar="SECONDS",
+                        help="Sample the event loop for SECONDS and write collapsed stacks for a flamegraph")
+    args = parser.parse_args()
+
+    config = Config()
+    if args.profile is not None:
+        config.apply_runtime({"profile_duration": args.profile})
+    cozmo_mqqtt_app = CozmoMqttProgram(config)
+    profiler = SamplingProfiler(config) if config.profile_duration else None
+
+    async def run_async() -> None:
+        if profiler is not None:
+            profiler.start(asyncio.get_event_loop())
+        try:
+            # Connects to the robot itself so a lost connection can be resumed instead of ending the program
+            await cozmo_mqqtt_app.run_async()
+        finally:
+            if profiler is not None:
+                profiler.stop()
 
     try:
-        cozmo.run_program(cozmo_mqqtt_app.run_with_robot_async)
+        asyncio.get_event_loop().run_until_complete(run_async())
     except KeyboardInterrupt:
         print("")
-        print("Exit requested by user")
\ No newline at end of file
+        print("Exit requested by user")
@@ -0,0 +1,231 @@
+import asyncio
+import sys
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List
+import cozmo
+import cozmo_client
+from behavior_priority import BehaviorPriority
+from task_supervisor import TaskSupervisor
+
+FREETIME_QUIET_PERIOD = 5.0
+BUSY_RETRY_DELAY = 0.5
+MAX_BUSY_RETRIES = 10
+FREETIME_TOGGLE_WINDOW = 60
+
+
+class Behavior():
+    def __init__(self, name: str, priority: BehaviorPriority, factory: Callable[[], Awaitable],
+                 retry_on_preempt: bool = False, max_delay: float = None, max_runtime: float = None) -> None:
+        self.name = name
+        self.priority = priority
+        self.factory = factory
+        self.retry_on_preempt = retry_on_preempt
+        self.max_runtime = max_runtime
+        self.submitted = time.monotonic()
+        self.expires = None if max_delay is None else self.submitted + max_delay
+        self.not_before = 0.0
+        self.retries = 0
+        self.done = asyncio.get_event_loop().create_future()
+
+    def __repr__(self) -> str:
+        return "{}({})".format(self.name, self.priority.name)
+
+    def finish(self, completed: bool) -> None:
+        if not self.done.done():
+            self.done.set_result(completed)
+
+
+class BehaviorArbiter():
+    def __init__(self, cozmo: cozmo_client.Cozmo, supervisor: TaskSupervisor, on_freetime: Callable[[], None] = None,
+                 quiet_period: float = FREETIME_QUIET_PERIOD) -> None:
+        self._cozmo = cozmo
+        self._supervisor = supervisor
+        self._on_freetime = on_freetime
+        self.quiet_period = quiet_period
+        self._pending: List[Behavior] = []
+        self._current: Behavior = None
+        self._current_task: asyncio.Task = None
+        self._last_active = time.monotonic()
+        self._freetime_toggles: Deque[float] = deque()
+        self._suspended = False
+        self._holds: Dict[str, BehaviorPriority] = dict()
+
+    @property
+    def current(self) -> Behavior:
+        return self._current
+
+    @property
+    def is_idle(self) -> bool:
+        return self._current is None and not self._pending
+
+    @property
+    def freetime_toggles_per_minute(self) -> int:
+        self._prune_toggles()
+        return len(self._freetime_toggles)
+
+    def is_scheduled(self, name: str) -> bool:
+        return self._find(name) is not None
+
+    def submit(self, name: str, priority: BehaviorPriority, factory: Callable[[], Awaitable],
+               retry_on_preempt: bool = False, max_delay: float = None, max_runtime: float = None) -> Behavior:
+        existing = self._find(name)
+        if existing:
+            return existing
+        behavior = Behavior(name, priority, factory, retry_on_preempt, max_delay, max_runtime)
+        self._pending.append(behavior)
+        self._dispatch()
+        return behavior
+
+    def cancel(self, name: str) -> bool:
+        for behavior in self._pending:
+            if behavior.name == name:
+                self._pending.remove(behavior)
+                behavior.finish(False)
+                return True
+        if self._current and self._current.name == name:
+            print("Cancelling behavior {}".format(self._current))
+            self._current.retry_on_preempt = False
+            self._abort_current()
+            return True
+        return False
+
+    def tick(self) -> None:
+        self._dispatch()
+        self._resume_freetime_if_quiet()
+
+    def start_freetime(self) -> None:
+        if not self._cozmo.freetime_enabled:
+            self._cozmo.start_free_time()
+            self._record_toggle()
+        if self._on_freetime:
+            self._on_freetime()
+
+    def hold(self, name: str, below: BehaviorPriority = None) -> None:
+        # While held freetime does not resume and behaviors under the given priority wait for the release
+        self._holds[name] = below
+
+    def release(self, name: str) -> None:
+        if self._holds.pop(name, False) is not False:
+            self._last_active = time.monotonic()
+            self._dispatch()
+
+    def suspend(self) -> None:
+        # The robot is gone, keep everything for the next connection instead of failing it
+        self._suspended = True
+        if self._current:
+            behavior = self._current
+            self._current = None
+            self._current_task = None
+            print("Suspending behavior {}".format(behavior))
+            self._supervisor.cancel(self._task_name(behavior))
+        self._cozmo.speech.clear()
+
+    def resume(self) -> None:
+        self._suspended = False
+        self._last_active = time.monotonic()
+        self._dispatch()
+
+    def stop(self) -> None:
+        for behavior in self._pending:
+            behavior.finish(False)
+        self._pending.clear()
+        if self._current:
+            self._current.retry_on_preempt = False
+            self._abort_current()
+
+    def _find(self, name: str) -> Behavior:
+        if self._current and self._current.name == name:
+            return self._current
+        return next((behavior for behavior in self._pending if behavior.name == name), None)
+
+    def _dispatch(self) -> None:
+        if self._suspended or not self._pending:
+            return
+        now = time.monotonic()
+        for behavior in [b for b in self._pending if b.expires is not None and b.expires < now]:
+            print("Dropping stale behavior {}".format(behavior))
+            self._pending.remove(behavior)
+            behavior.finish(False)
+        floor = max((below for below in self._holds.values() if below is not None), default=None)
+        ready = [b for b in self._pending if b.not_before <= now and (floor is None or b.priority >= floor)]
+        if not ready:
+            return
+        best = max(ready, key=lambda b: (b.priority, -b.submitted))
+        if self._current:
+            if best.priority <= self._current.priority:
+                return
+            print("Behavior {} preempts {}".format(best, self._current))
+            self._abort_current()
+        self._pending.remove(best)
+        self._start(best)
+
+    def _start(self, behavior: Behavior) -> None:
+        if self._cozmo.freetime_enabled:
+            self._cozmo.stop_free_time()
+            self._record_toggle()
+        self._current = behavior
+        self._current_task = self._supervisor.start(self._task_name(behavior), self._run_async(behavior), behavior.max_runtime)
+
+    def _abort_current(self) -> None:
+        behavior = self._current
+        self._current = None
+        self._current_task = None
+        self._supervisor.cancel(self._task_name(behavior))
+        # Whatever the aborted behavior still wanted to say is stale now
+        self._cozmo.speech.clear()
+        self._cozmo.stop()
+
+    def _task_name(self, behavior: Behavior) -> str:
+        return "behavior:{}".format(behavior.name)
+
+    async def _run_async(self, behavior: Behavior) -> None:
+        try:
+            await behavior.factory()
+            behavior.finish(True)
+        except cozmo.RobotBusy:
+            behavior.retries += 1
+            if behavior.retries > MAX_BUSY_RETRIES:
+                print("Cozmo stayed busy, giving up on {}".format(behavior))
+                behavior.finish(False)
+            else:
+                print("Cozmo is busy, retrying {} ({})".format(behavior, behavior.retries))
+                behavior.not_before = time.monotonic() + BUSY_RETRY_DELAY * behavior.retries
+                self._pending.append(behavior)
+        except asyncio.CancelledError:
+            if self._current is behavior:
+                # Cancelled from outside the arbiter, e.g. by the stuck task watchdog
+                self._cozmo.stop()
+                behavior.finish(False)
+            elif behavior.retry_on_preempt or self._suspended:
+                self._pending.append(behavior)
+            else:
+                behavior.finish(False)
+        except Exception:
+            print("Behavior {} failed: {}".format(behavior, sys.exc_info()[0]))
+            behavior.finish(False)
+        finally:
+            if self._current is behavior:
+                self._current = None
+                self._current_task = None
+            self._last_active = time.monotonic()
+        # Dispatch once this task is done so a retried behavior can reuse its task name
+        asyncio.get_event_loop().call_soon(self._dispatch)
+
+    def _resume_freetime_if_quiet(self) -> None:
+        if self._current or self._holds or self._cozmo.freetime_enabled or self._cozmo.is_sleeping:
+            return
+        now = time.monotonic()
+        if any(b.not_before <= now for b in self._pending):
+            return
+        if now - self._last_active >= self.quiet_period:
+            self.start_freetime()
+
+    def _record_toggle(self) -> None:
+        self._freetime_toggles.append(time.monotonic())
+        self._prune_toggles()
+
+    def _prune_toggles(self) -> None:
+        limit = time.monotonic() - FREETIME_TOGGLE_WINDOW
+        while self._freetime_toggles and self._freetime_toggles[0] < limit:
+            self._freetime_toggles.popleft()
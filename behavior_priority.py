@@ -0,0 +1,9 @@
+from enum import IntEnum
+
+
+class BehaviorPriority(IntEnum):
+    Ambient = 0
+    Social = 1
+    Control = 2
+    Charging = 3
+    Safety = 4
@@ -0,0 +1,160 @@
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, List
+
+
+def _report(name: str, timings: List[float]) -> None:
+    timings = sorted(timings)
+    print("{}: {} runs, mean {:.3f} ms, p50 {:.3f} ms, p95 {:.3f} ms, max {:.3f} ms".format(
+        name, len(timings), statistics.mean(timings) * 1000, timings[len(timings) // 2] * 1000,
+        timings[int(len(timings) * 0.95)] * 1000, timings[-1] * 1000))
+
+
+def _time_each(items, f: Callable) -> List[float]:
+    timings = []
+    for item in items:
+        start = time.perf_counter()
+        f(item)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+# Motion detection ----------------------------------------------------------------
+def _load_frames(path: str, synthetic: int):
+    import numpy as np
+    if path:
+        from PIL import Image
+        names = sorted(name for name in os.listdir(path) if name.lower().endswith((".png", ".jpg", ".jpeg")))
+        return [np.asarray(Image.open(os.path.join(path, name)).convert("L")) for name in names]
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(synthetic):
+        frame = rng.normal(100, 3, (240, 320)).clip(0, 255).astype(np.uint8)
+        x = (i * 7) % 280
+        frame[100:160, x:x + 40] = 220
+        frames.append(frame)
+    return frames
+
+
+def benchmark_motion(args) -> None:
+    from motion_detector import MotionDetector
+    frames = _load_frames(args.frames, args.synthetic)
+    if not frames:
+        sys.exit("No frames found")
+    detector = MotionDetector(scale=args.scale, roi=args.roi)
+    detector.process(frames[0])
+    detections = 0
+
+    def process(frame) -> None:
+        nonlocal detections
+        if detector.process(frame) is not None:
+            detections += 1
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    timings = _time_each(frames, process)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    _report("motion {}x{} scale {}".format(frames[0].shape[1], frames[0].shape[0], args.scale), timings)
+    print("detections: {} of {} frames".format(detections, len(frames)))
+    # Retained memory stays flat, the detector only works in its preallocated buffers. Frames are arrays already,
+    # in MotionStage getting one out of the PIL image allocates a frame sized temporary on top
+    print("detector buffers: {} bytes, retained after run: {} bytes, peak during run: {} bytes".format(
+        detector.nbytes, retained - before - sys.getsizeof(timings), peak - before))
+
+
+# Phrase selection ----------------------------------------------------------------
+def benchmark_phrases(args) -> None:
+    from message_manager import PhraseHistory, PhraseSelector
+    catalogs = {"category{}".format(c): ["Phrase {} of {} for {{name}} is {{good}}".format(i, c) for i in range(args.size)]
+                for c in range(args.categories)}
+    start = time.perf_counter()
+    selector = PhraseSelector(catalogs, PhraseHistory())
+    print("parsed {} phrases in {:.1f} ms".format(args.size * args.categories, (time.perf_counter() - start) * 1000))
+    people = ["person{}".format(i) for i in range(args.people)] + [None]
+    categories = list(catalogs.keys())
+    draws = [(categories[i % len(categories)], people[i % len(people)]) for i in range(args.draws)]
+    _report("phrase draw, {} per category".format(args.size), _time_each(draws, lambda draw: selector.choose(*draw)))
+
+
+# Power profiles ----------------------------------------------------------------
+async def _run_power_scenario_async(program, robot, state, hours: float) -> tuple:
+    task = asyncio.ensure_future(program.run_with_robot_async(robot))
+    while program.cozmo_state != state:
+        await asyncio.sleep(1)
+    # Settle into the profile before measuring
+    await asyncio.sleep(600)
+    cpu, streamed = time.process_time(), robot.camera.streamed_seconds
+    await asyncio.sleep(hours * 3600)
+    result = (time.process_time() - cpu, robot.camera.streamed_seconds - streamed)
+    robot.world.conn.is_connected = False
+    await asyncio.wait([task], timeout=60)
+    return result
+
+
+def benchmark_power(args) -> None:
+    from config import Config
+    from cozmo_mqtt_program import CozmoMqttProgram
+    from cozmo_states import CozmoStates
+    from soak_harness import FakeRobot, VirtualClock, VirtualTime, VirtualTimeLoop
+    scenarios = [("docked", 3.3, CozmoStates.Charging), ("idle", 3.9, CozmoStates.Freetime)]
+    stdout = sys.stdout
+    for name, voltage, state in scenarios:
+        results = dict()
+        for enabled in (False, True):
+            clock = VirtualClock()
+            loop = VirtualTimeLoop(clock)
+            asyncio.set_event_loop(loop)
+            VirtualTime.install(clock)
+            sys.stdout = open(os.devnull, "w")
+            try:
+                config = Config(os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark-config.json"),
+                                {"mqtt_broker_url": None, "camera_stream_port": None, "motion_detection_enabled": False,
+                                 "power_profiles_enabled": enabled, "animation_catalog_file": None, "event_store_file": None})
+                robot = FakeRobot(voltage)
+                results[enabled] = loop.run_until_complete(
+                    _run_power_scenario_async(CozmoMqttProgram(config), robot, state, args.hours))
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+            loop.close()
+        for enabled, (cpu, streamed) in results.items():
+            print("{} {}: host CPU {:.0f} ms per hour, camera stream {:.1f} MB per hour".format(
+                name, "with power profiles" if enabled else "always active", cpu * 1000 / args.hours,
+                streamed * args.camera_fps * args.frame_bytes / 1024 / 1024 / args.hours))
+        (cpu_off, streamed_off), (cpu_on, streamed_on) = results[False], results[True]
+        print("{} saves {:.0f}% host CPU and {:.0f}% camera radio bandwidth".format(
+            name, 100 * (1 - cpu_on / max(cpu_off, 1e-9)), 100 * (1 - streamed_on / max(streamed_off, 1e-9))))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Micro benchmarks for the Cozmo app")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    motion = subparsers.add_parser("motion", help="Frame differencing on recorded camera frames")
+    motion.add_argument("--frames", help="Directory with recorded frames, synthetic frames if omitted")
+    motion.add_argument("--synthetic", type=int, default=500)
+    motion.add_argument("--scale", type=int, default=4)
+    motion.add_argument("--roi", default=None)
+    motion.set_defaults(run=benchmark_motion)
+
+    phrases = subparsers.add_parser("phrases", help="Phrase selection from very large catalogs")
+    phrases.add_argument("--size", type=int, default=100000, help="Phrases per category")
+    phrases.add_argument("--categories", type=int, default=5)
+    phrases.add_argument("--people", type=int, default=10)
+    phrases.add_argument("--draws", type=int, default=100000)
+    phrases.set_defaults(run=benchmark_phrases)
+
+    power = subparsers.add_parser("power", help="Host CPU and camera bandwidth per power profile on a simulated robot")
+    power.add_argument("--hours", type=float, default=2, help="Simulated hours per scenario")
+    power.add_argument("--camera-fps", type=float, default=15, help="Frame rate of the SDK camera stream")
+    power.add_argument("--frame-bytes", type=int, default=6000, help="Average size of one streamed camera frame")
+    power.set_defaults(run=benchmark_power)
+
+    args = parser.parse_args()
+    args.run(args)
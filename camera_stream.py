@@ -0,0 +1,153 @@
+import asyncio
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import cozmo
+from cozmo.world import World
+from config import Config
+
+try:
+    from PIL import Image
+except ImportError:
+    sys.exit("Cannot import from PIL: Do `pip3 install --user Pillow` to install")
+
+BOUNDARY = "cozmoframe"
+CLIENT_WRITE_BUFFER = 256 * 1024
+SNAPSHOT_TIMEOUT = 5
+
+
+class CameraStreamServer():
+    def __init__(self, config: Config) -> None:
+        self._config = config
+        self._executor = ThreadPoolExecutor(max_workers=config.camera_stream_workers, thread_name_prefix="jpeg")
+        self._server: asyncio.AbstractServer = None
+        self._world: World = None
+        self._clients = 0
+        self._frame_id = 0
+        self._frame: bytes = None
+        self._frame_time = 0.0
+        self._new_frame = asyncio.Event()
+        self._pending_image: Image.Image = None
+        self._encoding = False
+        self._last_encoded = 0.0
+        self.encoded_frames = 0
+        self.skipped_frames = 0
+
+    @property
+    def clients(self) -> int:
+        return self._clients
+
+    def attach(self, world: World) -> None:
+        # Called again with the new world after a reconnect, clients stay connected in between
+        self._world = world
+        world.add_event_handler(cozmo.world.EvtNewCameraImage, self._on_new_camera_image)
+
+    async def start_async(self) -> None:
+        self._server = await asyncio.start_server(self._handle_client_async, port=self._config.camera_stream_port)
+        print("Camera stream on http://0.0.0.0:{}/stream".format(self._config.camera_stream_port))
+
+    async def stop_async(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+        self._executor.shutdown(wait=False)
+
+    def _on_new_camera_image(self, evt, image: cozmo.world.CameraImage = None, **kwargs) -> None:
+        if self._clients == 0 or image is None:
+            return
+        if self._pending_image is not None:
+            self.skipped_frames += 1
+        # Only the newest frame is kept, older ones are never encoded
+        self._pending_image = image.raw_image
+        if not self._encoding:
+            self._encoding = True
+            asyncio.ensure_future(self._encode_pending_async())
+
+    async def _encode_pending_async(self) -> None:
+        loop = asyncio.get_event_loop()
+        try:
+            while self._pending_image is not None:
+                wait = self._last_encoded + 1 / self._config.camera_stream_fps - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                image, self._pending_image = self._pending_image, None
+                self._last_encoded = time.monotonic()
+                frame = await loop.run_in_executor(self._executor, self._encode, image, self._config.camera_stream_quality)
+                self._publish_frame(frame)
+        finally:
+            self._encoding = False
+
+    def _encode(self, image: Image.Image, quality: int) -> bytes:
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=quality)
+        return buffer.getvalue()
+
+    def _publish_frame(self, frame: bytes) -> None:
+        self._frame = frame
+        self._frame_time = time.monotonic()
+        self._frame_id += 1
+        self.encoded_frames += 1
+        new_frame, self._new_frame = self._new_frame, asyncio.Event()
+        new_frame.set()
+
+    async def _handle_client_async(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        writer.transport.set_write_buffer_limits(high=CLIENT_WRITE_BUFFER)
+        try:
+            request = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.decode("latin-1").split()
+            path = parts[1] if len(parts) > 1 else "/"
+            if path in ("/", "/stream"):
+                await self._stream_async(writer)
+            elif path == "/snapshot":
+                await self._snapshot_async(writer)
+            else:
+                writer.write(b"HTTP/1.0 404 Not Found\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _next_frame_async(self, last_id: int) -> bytes:
+        while self._frame_id == last_id or self._frame is None:
+            await self._new_frame.wait()
+        return self._frame
+
+    async def _snapshot_async(self, writer: asyncio.StreamWriter) -> None:
+        self._clients += 1
+        try:
+            # Frames are only encoded while someone watches, so the cached one can be from long ago
+            fresh = time.monotonic() - self._frame_time <= 1 / self._config.camera_stream_fps
+            frame = await asyncio.wait_for(self._next_frame_async(self._frame_id if not fresh else 0), SNAPSHOT_TIMEOUT)
+        except asyncio.TimeoutError:
+            writer.write(b"HTTP/1.0 503 Service Unavailable\r\nContent-Length: 0\r\n\r\n")
+            await writer.drain()
+            return
+        finally:
+            self._clients -= 1
+        writer.write("HTTP/1.0 200 OK\r\nContent-Type: image/jpeg\r\nContent-Length: {}\r\n\r\n".format(len(frame)).encode())
+        writer.write(frame)
+        await writer.drain()
+
+    async def _stream_async(self, writer: asyncio.StreamWriter) -> None:
+        self._clients += 1
+        print("Camera stream client connected ({} watching)".format(self._clients))
+        try:
+            writer.write("HTTP/1.0 200 OK\r\nCache-Control: no-cache\r\n"
+                         "Content-Type: multipart/x-mixed-replace; boundary={}\r\n\r\n".format(BOUNDARY).encode())
+            last_id = 0
+            while True:
+                frame = await self._next_frame_async(last_id)
+                last_id = self._frame_id
+                writer.write("--{}\r\nContent-Type: image/jpeg\r\nContent-Length: {}\r\n\r\n".format(BOUNDARY, len(frame)).encode())
+                writer.write(frame)
+                writer.write(b"\r\n")
+                # A slow viewer only holds itself up, and skips to the newest frame once it caught up
+                await writer.drain()
+        finally:
+            self._clients -= 1
+            print("Camera stream client left ({} watching)".format(self._clients))
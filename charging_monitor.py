@@ -0,0 +1,107 @@
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque
+from cozmo.robot import Robot
+from robot_state_watcher import RobotStateWatcher
+
+SNORE_INTERVAL = (30, 60)
+CHARGE_SESSION_HISTORY = 50
+# Voltage that has not risen this much within the window is treated as full
+CHARGE_PLATEAU_WINDOW = 600
+CHARGE_PLATEAU_DELTA = 0.01
+
+
+class ChargeSession():
+    def __init__(self, start_voltage: float) -> None:
+        self.started = time.time()
+        self.start_voltage = start_voltage
+        self.ended: float = None
+        self.end_voltage: float = None
+        self.completed = False
+        self.end_reason: str = None
+
+    @property
+    def duration(self) -> float:
+        return (self.ended or time.time()) - self.started
+
+    @property
+    def charge_rate(self) -> float:
+        # Volts per hour
+        if self.end_voltage is None or self.duration <= 0:
+            return 0.0
+        return (self.end_voltage - self.start_voltage) / (self.duration / 3600)
+
+    def finish(self, end_voltage: float, completed: bool, end_reason: str) -> None:
+        self.ended = time.time()
+        self.end_voltage = end_voltage
+        self.completed = completed
+        self.end_reason = end_reason
+
+    def as_dict(self) -> dict:
+        return {
+            "start_voltage": round(self.start_voltage, 2),
+            "end_voltage": round(self.end_voltage, 2) if self.end_voltage is not None else None,
+            "duration": round(self.duration),
+            "charge_rate": round(self.charge_rate, 3),
+            "completed": self.completed,
+            "end_reason": self.end_reason
+        }
+
+
+class ChargingMonitor():
+    def __init__(self, watcher: RobotStateWatcher, snore: Callable[[], Awaitable], stop_actions: Callable[[], None],
+                 full_voltage: float) -> None:
+        self._watcher = watcher
+        self._full_voltage = full_voltage
+        self._snore = snore
+        self._stop_actions = stop_actions
+        self._snore_task: asyncio.Task = None
+        self.sessions: Deque[ChargeSession] = deque(maxlen=CHARGE_SESSION_HISTORY)
+
+    @property
+    def last_session(self) -> ChargeSession:
+        return self.sessions[-1] if self.sessions else None
+
+    async def charge_until_full_async(self, robot: Robot) -> ChargeSession:
+        session = ChargeSession(robot.battery_voltage)
+        self.sessions.append(session)
+        self.start_snoring()
+        end_reason = "cancelled"
+        try:
+            end_reason = await self._wait_for_end_async(robot)
+        finally:
+            self.stop_snoring()
+            session.finish(robot.battery_voltage, end_reason in ("full", "charged", "plateau"), end_reason)
+        print("Charging session ended: {}".format(session.as_dict()))
+        return session
+
+    async def _wait_for_end_async(self, robot: Robot) -> str:
+        while True:
+            plateau_voltage = robot.battery_voltage
+            # Ends when charging completes, when Cozmo gets knocked off the charger and when the battery is full
+            ended = await self._watcher.wait_for_async(
+                lambda robot: not robot.is_on_charger or not robot.is_charging or robot.battery_voltage >= self._full_voltage,
+                CHARGE_PLATEAU_WINDOW)
+            if not robot.is_on_charger:
+                return "off_charger"
+            if ended:
+                return "full" if robot.battery_voltage >= self._full_voltage else "charged"
+            if robot.battery_voltage - plateau_voltage < CHARGE_PLATEAU_DELTA:
+                return "plateau"
+
+    def start_snoring(self) -> None:
+        if self._snore_task is None or self._snore_task.done():
+            self._snore_task = asyncio.ensure_future(self._snore_loop_async())
+
+    def stop_snoring(self) -> None:
+        if self._snore_task is not None and not self._snore_task.done():
+            self._snore_task.cancel()
+            self._stop_actions()
+        self._snore_task = None
+
+    async def _snore_loop_async(self) -> None:
+        while True:
+            await self._snore()
+            await asyncio.sleep(random.randint(*SNORE_INTERVAL))
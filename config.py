@@ -0,0 +1,229 @@
+import asyncio
+import json
+import os
+import sys
+import typing
+from typing import Any, Callable, Dict, List, Set, Tuple
+
+CONFIG_FILE_ENV = "COZMO_CONFIG"
+DEFAULT_CONFIG_FILE = "cozmo_config.json"
+ENV_PREFIX = "COZMO_"
+FILE_WATCH_INTERVAL = 2
+# Range checks by field name suffix, a zero period or timeout would spin or fail every action
+POSITIVE_SUFFIXES = ("_period", "_interval", "_timeout", "_fps", "_port", "_size", "_queue", "_workers", "_scale",
+                     "_retention", "_half_life", "_max_age", "_max_delay", "_slo")
+NON_NEGATIVE_SUFFIXES = ("_retries", "_attempts", "_cooldown", "_duration", "_after", "_tolerance",
+                         "_speed", "_sensitivity", "_area")
+# On by default but null turns them off
+NULLABLE = {"event_store_file", "animation_catalog_file"}
+# Read once when the app starts, later changes wait for the next start and the config topic can not set them
+START_ONLY = {"mqtt_broker_url", "mqtt_broker_port", "mqtt_username", "mqtt_password", "camera_stream_port", "websocket_port",
+              "event_store_file", "animation_catalog_file", "phrase_locale_file", "profile_output", "motion_detection_enabled"}
+CHOICES = {"held_queue_policy": ("process", "defer")}
+RANGES = {"camera_stream_quality": (1, 100), "robot_volume": (0.0, 1.0)}
+
+Listener = Callable[[Dict[str, Any]], None]
+
+
+class Config():
+    # Values come from these defaults, then the json config file, then COZMO_<NAME> environment
+    # variables, then overrides given by the caller and finally from runtime updates published on the mqtt config topic.
+    mqtt_broker_url: str = None
+    mqtt_broker_port: int = 1883
+    mqtt_username: str = None
+    mqtt_password: str = None
+    mqtt_weather_topic: str = "home-assistant/cozmo/notification"
+    mqtt_control_topic: str = "home-assistant/cozmo/control"
+    mqtt_config_topic: str = "home-assistant/cozmo/config"
+    mqtt_query_topic: str = "home-assistant/cozmo/query"
+    status_topic: str = "cozmo/status"
+    stats_topic: str = "cozmo/stats"
+    charging_topic: str = "cozmo/charging"
+    history_topic: str = "cozmo/history"
+    alert_topic: str = "cozmo/alert"
+    ha_discovery_prefix: str = "homeassistant"
+    ha_node_id: str = "cozmo"
+    ha_base_topic: str = "cozmo"
+    low_battery_voltage: float = 3.4
+    loop_period: float = 0.1
+    power_profiles_enabled: bool = True
+    idle_after: float = 120
+    idle_loop_period: float = 0.5
+    idle_motion_fps: float = 0.5
+    idle_camera_interval: float = 2
+    resting_loop_period: float = 2
+    face_cooldown: float = 60
+    object_cooldown: float = 60 * 5
+    freetime_quiet_period: float = 5.0
+    held_queue_policy: str = "process"
+    notification_max_delay: float = 60 * 10
+    reflex_latency_slo: float = 0.2
+    cliff_back_off_speed: float = 40
+    cliff_back_off_duration: float = 1
+    robot_volume: float = 0.2
+    action_timeout: float = 30
+    action_retries: int = 1
+    animation_catalog_file: str = "cozmo-animations.json"
+    cube_idle_while_charging: bool = True
+    cube_reconnect_interval: float = 5
+    reconnect_interval: float = 2
+    reconnect_max_interval: float = 60
+    reconnect_max_attempts: int = None
+    docking_distance_tolerance: float = 10
+    docking_angle_tolerance: float = 5
+    spatial_cell_size: float = 250
+    spatial_max_age: float = 60 * 10
+    phrase_locale_file: str = None
+    phrase_history_half_life: float = 60 * 60
+    camera_stream_port: int = None
+    camera_stream_fps: float = 10
+    camera_stream_quality: int = 70
+    camera_stream_workers: int = 1
+    websocket_port: int = None
+    websocket_client_queue: int = 100
+    event_store_file: str = "cozmo-events.db"
+    event_flush_interval: float = 5
+    event_batch_size: int = 500
+    event_battery_interval: float = 60
+    event_raw_retention: float = 60 * 60 * 24 * 14
+    event_rollup_period: float = 60 * 60
+    event_rollup_retention: float = 60 * 60 * 24 * 365
+    motion_detection_enabled: bool = False
+    motion_topic: str = "cozmo/motion"
+    motion_fps: float = 2
+    motion_scale: int = 4
+    motion_sensitivity: float = 3.0
+    motion_min_area: float = 0.01
+    motion_roi: str = None
+    motion_event_interval: float = 30
+    motion_clear_after: float = 60
+    profile_duration: float = None
+    profile_interval: float = 0.01
+    profile_output: str = "cozmo-profile.folded"
+    slow_callback_duration: float = 0.1
+
+    def __init__(self, path: str = None, overrides: Dict[str, Any] = None) -> None:
+        self._path = path or os.environ.get(CONFIG_FILE_ENV, DEFAULT_CONFIG_FILE)
+        self._file_values: Dict[str, Any] = dict()
+        self._env_values: Dict[str, Any] = dict()
+        self._override_values = self._validate(overrides or dict(), "overrides")
+        self._runtime_values: Dict[str, Any] = dict()
+        self._listeners: List[Tuple[Set[str], Listener]] = []
+        self._file_mtime: float = None
+        self._load_env()
+        self._load_file()
+        self._apply()
+
+    @classmethod
+    def fields(cls) -> Dict[str, type]:
+        return typing.get_type_hints(cls)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.fields() if "password" not in name}
+
+    def subscribe(self, listener: Listener, *names: str) -> None:
+        self._listeners.append((set(names), listener))
+
+    def apply_runtime(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        start_only = [name for name in values if name in START_ONLY]
+        if start_only:
+            print("Ignoring config values {} from runtime update, they are only read on start".format(start_only))
+        values = {name: value for name, value in values.items() if name not in START_ONLY}
+        self._runtime_values.update(self._validate(values, "runtime update"))
+        return self._apply()
+
+    def reload_file(self) -> Dict[str, Any]:
+        self._load_file()
+        return self._apply()
+
+    async def watch_file_async(self) -> None:
+        while True:
+            await asyncio.sleep(FILE_WATCH_INTERVAL)
+            if self._read_mtime() != self._file_mtime:
+                print("Config file {} changed, reloading".format(self._path))
+                self.reload_file()
+
+    def _read_mtime(self) -> float:
+        try:
+            return os.stat(self._path).st_mtime
+        except OSError:
+            return None
+
+    def _load_file(self) -> None:
+        self._file_mtime = self._read_mtime()
+        if self._file_mtime is None:
+            self._file_values = dict()
+            return
+        try:
+            with open(self._path) as config_file:
+                self._file_values = self._validate(json.load(config_file), self._path)
+        except (OSError, ValueError):
+            print("Cannot read config file {}: {}".format(self._path, sys.exc_info()[1]))
+
+    def _load_env(self) -> None:
+        values = dict()
+        for name in self.fields():
+            env_name = ENV_PREFIX + name.upper()
+            if env_name in os.environ:
+                values[name] = os.environ[env_name]
+        self._env_values = self._validate(values, "environment")
+
+    def _validate(self, values: Dict[str, Any], source: str) -> Dict[str, Any]:
+        fields = self.fields()
+        valid = dict()
+        for name, value in values.items():
+            if name not in fields:
+                print("Ignoring unknown config value {} from {}".format(name, source))
+                continue
+            try:
+                valid[name] = self._coerce(name, fields[name], value)
+            except (TypeError, ValueError):
+                print("Ignoring invalid config value {}={!r} from {}".format(name, value, source))
+        return valid
+
+    def _coerce(self, name: str, field_type: type, value: Any) -> Any:
+        if value is None:
+            # Only fields that are off by default can be switched off again
+            if getattr(type(self), name) is not None and name not in NULLABLE:
+                raise ValueError("{} can not be null".format(name))
+            return None
+        if field_type is bool and isinstance(value, str):
+            return value.strip().lower() in ("1", "true", "yes", "on")
+        if field_type in (int, float) and isinstance(value, (dict, list)):
+            raise TypeError("{} must be a number".format(name))
+        value = field_type(value)
+        if name in CHOICES and value not in CHOICES[name]:
+            raise ValueError("{} must be one of {}".format(name, CHOICES[name]))
+        if name in RANGES and not RANGES[name][0] <= value <= RANGES[name][1]:
+            raise ValueError("{} must be between {} and {}".format(name, *RANGES[name]))
+        if field_type in (int, float):
+            if name.endswith(POSITIVE_SUFFIXES) and not value > 0:
+                raise ValueError("{} must be positive".format(name))
+            if name.endswith(NON_NEGATIVE_SUFFIXES) and not value >= 0:
+                raise ValueError("{} must not be negative".format(name))
+        return value
+
+    def _apply(self) -> Dict[str, Any]:
+        merged = dict()
+        for layer in (self._file_values, self._env_values, self._override_values, self._runtime_values):
+            merged.update(layer)
+        changed = dict()
+        for name in self.fields():
+            value = merged.get(name, getattr(type(self), name))
+            if name in self.__dict__ and getattr(self, name) != value:
+                if name in START_ONLY:
+                    if "password" not in name:
+                        print("Config value {} changed, it will be used on the next start".format(name))
+                    continue
+                changed[name] = value
+            setattr(self, name, value)
+        if changed:
+            print("Config changed: {}".format({k: v for k, v in changed.items() if "password" not in k}))
+            self._notify(changed)
+        return changed
+
+    def _notify(self, changed: Dict[str, Any]) -> None:
+        for names, listener in self._listeners:
+            relevant = {name: value for name, value in changed.items() if not names or name in names}
+            if relevant:
+                listener(relevant)
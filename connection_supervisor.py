@@ -0,0 +1,87 @@
+import asyncio
+import functools
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque
+import cozmo
+from cozmo.robot import Robot
+from config import Config
+
+DISCONNECT_HISTORY = 100
+DAY = 24 * 60 * 60
+
+Session = Callable[[Robot], Awaitable]
+
+
+class ConnectionSupervisor():
+    def __init__(self, config: Config, connector: cozmo.run.DeviceConnector = None) -> None:
+        self._config = config
+        self._connector = connector
+        self._lost_at: float = None
+        self.disconnects: Deque[float] = deque(maxlen=DISCONNECT_HISTORY)
+        self.recovery_times: Deque[float] = deque(maxlen=DISCONNECT_HISTORY)
+        self.connect_failures = 0
+        self._stopping = False
+
+    async def connect_async(self) -> Robot:
+        # Same as cozmo.run.connect_on_loop, but on the already running loop
+        loop = asyncio.get_event_loop()
+        connector = self._connector or cozmo.run.FirstAvailableConnector()
+        factory = functools.partial(cozmo.conn.CozmoConnection, loop=loop)
+
+        async def conn_check(sdk_conn: cozmo.conn.CozmoConnection) -> None:
+            await sdk_conn.wait_for(cozmo.conn.EvtConnected, timeout=5)
+
+        _, sdk_conn = await connector.connect(loop, factory, conn_check)
+        return await sdk_conn.wait_for_robot()
+
+    async def run_async(self, session: Session) -> None:
+        backoff = self._config.reconnect_interval
+        attempts = 0
+        while not self._stopping:
+            try:
+                robot = await self.connect_async()
+            except cozmo.exceptions.SDKVersionMismatch:
+                raise
+            except Exception as e:
+                attempts += 1
+                self.connect_failures += 1
+                if self._config.reconnect_max_attempts and attempts >= self._config.reconnect_max_attempts:
+                    raise
+                print("Cannot connect to Cozmo ({}), retrying in {:.0f}s".format(e, backoff))
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, self._config.reconnect_max_interval)
+                continue
+            backoff = self._config.reconnect_interval
+            attempts = 0
+            if self._lost_at is not None:
+                self.recovery_times.append(time.monotonic() - self._lost_at)
+                print("Reconnected to Cozmo after {:.1f}s".format(self.recovery_times[-1]))
+                self._lost_at = None
+
+            sdk_conn = robot.world.conn
+            try:
+                await session(robot)
+            finally:
+                if not sdk_conn.is_connected:
+                    self._lost_at = time.monotonic()
+                    self.disconnects.append(time.time())
+                await sdk_conn.shutdown()
+            if self._lost_at is None or self._stopping:
+                # The session ended while still connected, the program is done
+                return
+            print("Connection to Cozmo lost, reconnecting")
+
+    def stop(self) -> None:
+        self._stopping = True
+
+    def stats(self) -> dict:
+        recent = [disconnected for disconnected in self.disconnects if time.time() - disconnected < DAY]
+        recovery_times = list(self.recovery_times)
+        return {
+            "disconnects": len(self.disconnects),
+            "disconnects_last_day": len(recent),
+            "recovery_time_last": round(recovery_times[-1], 1) if recovery_times else None,
+            "recovery_time_mean": round(sum(recovery_times) / len(recovery_times), 1) if recovery_times else None,
+            "connect_failures": self.connect_failures
+        }
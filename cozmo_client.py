@@ -3,7 +3,7 @@ from cozmo.anim import Triggers
 from cozmo.faces import Face
 from cozmo.lights import Light
 from cozmo.robot import Robot
-from cozmo.objects import LightCube1Id, LightCube2Id, LightCube3Id, LightCube, ObservableObject, Charger
+from cozmo.objects import LightCube, ObservableObject, Charger
 from cozmo.util import degrees, radians, distance_mm, speed_mmps, Pose
 from cozmo.behavior import BehaviorTypes
 from cozmo.world import World
@@ -12,46 +12,128 @@ import sys
 import io
 import base64
 from urllib.request import urlopen
-from typing import List
+from typing import Callable, List
 import asyncio
 import random
+import time
+from robot_state_watcher import RobotStateWatcher
+from charging_monitor import ChargeSession, ChargingMonitor
+from config import Config
+from speech_queue import SpeechQueue
+from cube_manager import CubeManager
+from world_snapshot import WorldSnapshot
+from power_manager import PowerManager
+from animation_catalog import AnimationCatalog, Emotion
+from safety_reflex import SafetyReflex
+from behavior_priority import BehaviorPriority
+from spatial_memory import CHARGER, CUBE, SpatialMemory
 
 try:
     from PIL import Image
 except ImportError:
     sys.exit("Cannot import from PIL: Do `pip3 install --user Pillow` to install")
 
+BATTERY_EMPTY_VOLTAGE = 3.5
+BATTERY_FULL_VOLTAGE = 4.05
+MAX_DOCKING_ATTEMPTS = 5
+MAX_CHARGER_SEARCHES = 3
+MAX_ALIGN_ADJUSTMENTS = 10
+
+
+def battery_level(voltage: float) -> int:
+    level = (voltage - BATTERY_EMPTY_VOLTAGE) / (BATTERY_FULL_VOLTAGE - BATTERY_EMPTY_VOLTAGE)
+    return round(min(max(level, 0), 1) * 100)
+
 
 class Cozmo():
-    def __init__(self) -> None:
+    def __init__(self, config: Config = None) -> None:
+        self._config = config or Config()
+        self._config.subscribe(self._on_volume_changed, "robot_volume")
         self._robot: Robot = None
         Robot.drive_off_charger_on_connect = False
         cozmo.setup_basic_logging()
         self.PI: float = 3.14159265359
-        self._cubes_connected = False
         self._freetime = False
         self._sleeping = False
+        self._state_watcher = RobotStateWatcher()
+        self._charging_monitor = ChargingMonitor(self._state_watcher, self.snore_anim_async, self._abort_actions, BATTERY_FULL_VOLTAGE)
+        self._speech = SpeechQueue(self._start_say, lambda: self._config.action_timeout)
+        self._cube_manager = CubeManager(self._config)
+        self._power = PowerManager(self._config)
+        self._animations = AnimationCatalog(self._config)
+        self._reflex = SafetyReflex(self._config, self._reflex_stop)
+        self._spatial = SpatialMemory(self._config)
+        # Set by the program to record docking attempts and other robot side events
+        self.on_event: Callable[[str, str, float, dict], None] = None
 
     def set_robot(self, robot: Robot):
+        # Also called again after a reconnect, the new connection starts without freeplay
         self._robot = robot
+        self._freetime = False
         self._robot.enable_stop_on_cliff(True)
-        self._robot.set_robot_volume(0.2)
+        # Registered first so it sees every state update before anything else does
+        self._reflex.attach(robot)
+        self._robot.set_robot_volume(self._config.robot_volume)
         self._robot.camera.enable_auto_exposure()
-        self._robot.enable_facial_expression_estimation(True)
-        self._robot.camera.image_stream_enabled = True
         self._robot.camera.color_image_enabled = False
+        # Camera stream and expression estimation follow the power profile
+        self._power.attach(robot)
         #reactions to surroundings
         self._robot.enable_all_reaction_triggers(False)
+        self._state_watcher.attach(robot)
+        self._cube_manager.attach(robot.world)
+        self._spatial.attach(robot)
+        self._speech.start()
         print("Battery voltage: {}".format(self.battery_voltage))
 
+    def _on_volume_changed(self, changed: dict) -> None:
+        if self._robot:
+            self._robot.set_robot_volume(changed["robot_volume"])
+
     @property
     def freetime_enabled(self) -> bool:
         return self._freetime
 
+    @property
+    def state_watcher(self) -> RobotStateWatcher:
+        return self._state_watcher
+
+    @property
+    def speech(self) -> SpeechQueue:
+        return self._speech
+
+    @property
+    def cube_manager(self) -> CubeManager:
+        return self._cube_manager
+
+    @property
+    def power(self) -> PowerManager:
+        return self._power
+
+    @property
+    def animations(self) -> AnimationCatalog:
+        return self._animations
+
+    @property
+    def reflex(self) -> SafetyReflex:
+        return self._reflex
+
+    @property
+    def spatial(self) -> SpatialMemory:
+        return self._spatial
+
+    @property
+    def charging_monitor(self) -> ChargingMonitor:
+        return self._charging_monitor
+
     @property
     def battery_voltage(self) -> float:
         return self._robot.battery_voltage
 
+    @property
+    def battery_level(self) -> int:
+        return battery_level(self.battery_voltage)
+
     @property
     def world(self) -> World:
         return self._robot.world
@@ -62,15 +144,14 @@ class Cozmo():
 
     @property
     def cubes(self) -> List[LightCube]:
-        return [self.get_cube_by_id(LightCube1Id), self.get_cube_by_id(LightCube2Id), self.get_cube_by_id(LightCube3Id)]
+        return self._cube_manager.cubes
 
     def back_to_normal(self) -> None:
         print("Seting Cozmo back to normal")
         if self._freetime:
             self.stop_free_time()
         self.turn_backpack_light_off()
-        if self._cubes_connected:
-            self._disconnect_from_cubes()
+        self._cube_manager.disconnect()
         self._robot.clear_idle_animation()
 
     async def stop_all_actions_async(self) -> None:
@@ -79,7 +160,29 @@ class Cozmo():
             self.stop_free_time()
         self._robot.abort_all_actions(log_abort_messages=True)
         self._robot.stop_all_motors()
-        await self._robot.wait_for_all_actions_completed()
+        await asyncio.wait_for(self._robot.wait_for_all_actions_completed(), self._config.action_timeout)
+
+    async def _run_action_async(self, start_action: Callable[[], cozmo.action.Action],
+                                timeout: float = None, retries: int = None) -> cozmo.action.Action:
+        timeout = timeout or self._config.action_timeout
+        retries = self._config.action_retries if retries is None else retries
+        for attempt in range(retries + 1):
+            action = start_action()
+            try:
+                await action.wait_for_completed(timeout=timeout)
+            except asyncio.TimeoutError:
+                print("Action {} timed out after {}s".format(action, timeout))
+                action.abort()
+                if attempt == retries:
+                    raise
+                continue
+            if not action.has_failed:
+                break
+            code, reason = action.failure_reason
+            print("Action {} failed ({}): {}".format(action, code, reason))
+            if code == "cancelled":
+                break
+        return action
 
     # Charging / Sleeping ----------------------------------------------------------------
     @property
@@ -90,42 +193,49 @@ class Cozmo():
     def is_sleeping(self) -> bool:
         return self._sleeping
 
-    def needs_charging(self) -> bool:
-        return self.battery_voltage <= 3.4 and not self.is_charging
+    def needs_charging(self, snapshot: WorldSnapshot = None) -> bool:
+        if snapshot is not None:
+            return snapshot.battery_voltage <= self._config.low_battery_voltage and not snapshot.is_charging
+        return self.battery_voltage <= self._config.low_battery_voltage and not self.is_charging
     
     def is_charged(self) -> bool:
         return not self._robot.is_charging
 
     async def start_charging_routine_async(self) -> None:
         print("Starting charging routine")
-        if self._cubes_connected:
-            self._disconnect_from_cubes()
+        self._cube_manager.release()
         await self.stop_all_actions_async()
         await self.go_to_sleep_anim_async()
         await self.get_on_charger_async()
 
-    async def charge_to_full_async(self) -> None:
+    async def charge_to_full_async(self) -> ChargeSession:
         print("Charging...")
         await self.go_to_sleep_off_anim_async()
-        while not self.is_charged():
-            await self.snore_anim_async()
-            await asyncio.sleep(random.randint(30, 60)) 
-        self.update_needs_level(1)     
+        session = await self._charging_monitor.charge_until_full_async(self._robot)
+        if session.completed:
+            self.update_needs_level(1)
         await self.get_off_charger_async()
-    
+        return session
+
     async def sleep_async(self) -> None:
         await self.start_charging_routine_async()
         print("Sleeping...")
         self._sleeping = True
         await self.go_to_sleep_off_anim_async()
-        while self.is_sleeping:
-            print("Battery voltage: {}".format(self.battery_voltage))
-            await self.snore_anim_async()
-            await asyncio.sleep(random.randint(30, 60)) 
-            if self.needs_charging():
-                await self._robot.backup_onto_charger(max_drive_time=5)
-            elif self.is_charged():
-                await self._robot.drive_off_charger_contacts(self._robot).wait_for_completed()
+        self._charging_monitor.start_snoring()
+        try:
+            while self.is_sleeping:
+                print("Battery voltage: {}".format(self.battery_voltage))
+                if self.needs_charging():
+                    await asyncio.wait_for(self._robot.backup_onto_charger(max_drive_time=5), self._config.action_timeout)
+                elif self._robot.is_on_charger and self.is_charged():
+                    await self._run_action_async(lambda: self._robot.drive_off_charger_contacts(self._robot))
+                await self._state_watcher.wait_for_change_async(self._sleep_state)
+        finally:
+            self._charging_monitor.stop_snoring()
+
+    def _sleep_state(self, robot: Robot) -> tuple:
+        return (robot.is_charging, robot.is_on_charger, self.needs_charging(), self.is_sleeping)
 
     async def wake_up_async(self) -> None:
         self._sleeping = False
@@ -144,42 +254,46 @@ class Cozmo():
         self._robot.set_needs_levels(repair_value=needs_level, energy_value=needs_level, play_value=needs_level)
 
     # Speak ----------------------------------------------------------------
-    async def say_async(self, message: str) -> None:
-        print("Cozmo will speak: " + message)
-        await self._robot.say_text(message).wait_for_completed()
+    def say(self, message: str, priority: BehaviorPriority = BehaviorPriority.Social) -> None:
+        # Queue without waiting, lines queued back to back are spoken as one
+        self._speech.say(message, priority)
+
+    async def say_async(self, message: str, priority: BehaviorPriority = BehaviorPriority.Social) -> bool:
+        return await self._speech.say_async(message, priority)
+
+    def _start_say(self, message: str) -> cozmo.action.Action:
+        return self._robot.say_text(message)
 
     # Display Images ----------------------------------------------------------------
     async def show_image_from_bytes_async(self, imageToShow: str) -> None:
         print("Cozmo will show and image: " + imageToShow)
         data = imageToShow.encode("utf-8")
-        image = Image.open(io.BytesIO(base64.b64decode(data)))
-        await self._show_image_async(image)
+        with Image.open(io.BytesIO(base64.b64decode(data))) as image:
+            await self._show_image_async(image)
 
     async def show_image_from_url_async(self, imageUrl: str) -> None:
         print("Cozmo will show and image: " + imageUrl)
-        image = Image.open(urlopen(imageUrl))
-        await self._show_image_async(image)
+        with urlopen(imageUrl) as response, Image.open(response) as image:
+            await self._show_image_async(image)
 
     async def _show_image_async(self, image: Image) -> None:
         print("Getting ready to show image")
         await self._show_face_async()
         # image.show()
-        resized_image = image.resize(cozmo.oled_face.dimensions(), Image.NEAREST)
-        face_image = cozmo.oled_face.convert_image_to_screen_data(resized_image, invert_image=True)
+        with image.resize(cozmo.oled_face.dimensions(), Image.NEAREST) as resized_image:
+            face_image = cozmo.oled_face.convert_image_to_screen_data(resized_image, invert_image=True)
         print("Showing image:{}".format(image))
-        await self._robot.display_oled_face_image(face_image, 5 * 1000.0).wait_for_completed()
+        await self._run_action_async(lambda: self._robot.display_oled_face_image(face_image, 5 * 1000.0))
 
     async def _show_face_async(self) -> None:
         if (self._robot.lift_height.distance_mm > 45) or (self._robot.head_angle.degrees < 40):
-            lift_action = self._robot.set_lift_height(0.0, in_parallel=True)
-            head_action = self._robot.set_head_angle(cozmo.robot.MAX_HEAD_ANGLE, in_parallel=True)
-            await lift_action.wait_for_completed()
-            await head_action.wait_for_completed()
+            await asyncio.gather(
+                self._run_action_async(lambda: self._robot.set_lift_height(0.0, in_parallel=True)),
+                self._run_action_async(lambda: self._robot.set_head_angle(cozmo.robot.MAX_HEAD_ANGLE, in_parallel=True)))
     
     async def display_camera_image_async(self) -> None:
-        image = self.get_camera_image()
-        image = image.transpose(Image.FLIP_LEFT_RIGHT)
-        await self._show_image_async(image)
+        with self.get_camera_image().transpose(Image.FLIP_LEFT_RIGHT) as image:
+            await self._show_image_async(image)
 
     # Vision --------------------------------------------------------------------------
     def head_lights(self, on: bool) -> None:
@@ -197,67 +311,68 @@ class Cozmo():
     def clear_current_animations(self) -> None:
         self._robot.clear_idle_animation()
 
-    async def random_positive_anim_async(self) -> None:
-        triggers = [
-            Triggers.MajorWin,
-            Triggers.CodeLabHappy,
-            Triggers.CodeLabYes,
-            Triggers.CodeLabAmazed,
-            Triggers.CodeLabCelebrate,
-            Triggers.PopAWheelieInitial,
-            Triggers.FeedingAteFullEnough_Normal,
-            Triggers.DriveEndHappy,
-            Triggers.BlockReact
-        ]
-        trigger = random.choice(triggers)
-        print("Animating positive emotions: {}".format(trigger))
-        await self._robot.play_anim_trigger(trigger).wait_for_completed()
-    
-    async def random_negative_anim_async(self) -> None:
-        triggers = [
-            Triggers.MajorFail,
-            Triggers.CubeMovedUpset,
-            Triggers.CodeLabUnhappy,
-            Triggers.PounceFail,
-            Triggers.CodeLabBored,
-            Triggers.FrustratedByFailureMajor
-        ]
-        trigger = random.choice(triggers)
-        print("Animating negative emotions: {}".format(trigger))
-        await self._robot.play_anim_trigger(trigger).wait_for_completed()
+    async def random_positive_anim_async(self, budget: float = None) -> None:
+        await self.random_emotion_anim_async(Emotion.Positive, budget)
+
+    async def random_negative_anim_async(self, budget: float = None) -> None:
+        await self.random_emotion_anim_async(Emotion.Negative, budget)
+
+    async def random_emotion_anim_async(self, emotion: Emotion, budget: float = None) -> None:
+        # The budget limits the pick to triggers known to finish within it and aborts the animation at the budget
+        trigger = self._animations.pick(emotion, budget)
+        print("Animating {} emotions: {}".format(emotion.value, trigger))
+        started = time.monotonic()
+        try:
+            action = await self._run_action_async(lambda: self._robot.play_anim_trigger(trigger), timeout=budget,
+                                                  retries=0 if budget is not None else None)
+        except asyncio.TimeoutError:
+            self._animations.record_overrun(trigger, time.monotonic() - started)
+            return
+        if not action.has_failed:
+            self._animations.record(trigger, time.monotonic() - started)
 
     async def go_to_sleep_anim_async(self) -> None:
         trigger = Triggers.GoToSleepGetIn
-        await self._robot.play_anim_trigger(trigger).wait_for_completed()
+        await self._run_action_async(lambda: self._robot.play_anim_trigger(trigger))
 
     async def go_to_sleep_off_anim_async(self) -> None:
         trigger = Triggers.GoToSleepOff
-        await self._robot.play_anim_trigger(trigger).wait_for_completed()
+        await self._run_action_async(lambda: self._robot.play_anim_trigger(trigger))
 
     async def snore_anim_async(self) -> None:
         trigger = Triggers.Sleeping
-        await self._robot.play_anim_trigger(trigger).wait_for_completed()
+        await self._run_action_async(lambda: self._robot.play_anim_trigger(trigger))
     
     async def wake_up_anim_async(self) -> None:
         trigger = Triggers.ConnectWakeUp
-        await self._robot.play_anim_trigger(trigger).wait_for_completed()
+        await self._run_action_async(lambda: self._robot.play_anim_trigger(trigger))
     # Movement ----------------------------------------------------------------
     async def move_straight_async(self, distance: float, speed: float) -> None:
-	    await self._robot.drive_straight(distance_mm(distance), speed_mmps(speed)).wait_for_completed()
+        await self._run_action_async(lambda: self._robot.drive_straight(distance_mm(distance), speed_mmps(speed)), retries=0)
 		#self.robot.go_to_pose(Pose(Distance, 0, 0, angle_z=degrees(0)), relative_to_robot=True)
 
     async def drive_wheels_async(self, distance: float, duration: float) -> None:
-        await self._robot.drive_wheels(distance, distance, duration=duration)
+        await asyncio.wait_for(self._robot.drive_wheels(distance, distance, duration=duration), duration + self._config.action_timeout)
 
     async def turn_async(self, angle: float) -> None:
-        await self._robot.turn_in_place(degrees(angle)).wait_for_completed() 
+        await self._run_action_async(lambda: self._robot.turn_in_place(degrees(angle)), retries=0)
 
     async def turn_around_async(self) -> None:
-        await self._robot.turn_in_place(degrees(-180)).wait_for_completed()
+        await self._run_action_async(lambda: self._robot.turn_in_place(degrees(-180)), retries=0)
     
     def stop(self) -> None:  
         print("Stopping!")
         self._robot.stop_all_motors()
+        self._abort_actions()
+
+    def _reflex_stop(self) -> None:
+        # Freeplay would drive on right away, so it goes first
+        if self._freetime:
+            self.stop_free_time()
+        self._robot.stop_all_motors()
+        self._abort_actions()
+
+    def _abort_actions(self) -> None:
         self._robot.abort_all_actions(log_abort_messages=False)
 
     def move_head(self, radians: int) -> None:
@@ -286,10 +401,11 @@ class Cozmo():
 
     async def turn_toward_face_async(self, face_to_follow: Face) -> None:
         print("Turning towards face")
-        turn_action = self._robot.turn_towards_face(face_to_follow)
         if not (face_to_follow and face_to_follow.is_visible):
-            await self.try_find_face_async()
-        await turn_action.wait_for_completed()
+            face_to_follow = await self.try_find_face_async() or face_to_follow
+        if face_to_follow is None:
+            return
+        await self._run_action_async(lambda: self._robot.turn_towards_face(face_to_follow))
 
     # Lights --------------------------------------------------------------
     def turn_cubes_lights_off(self) -> None:
@@ -323,21 +439,20 @@ class Cozmo():
 
     # Objects ------------------------------------------------------------
     async def place_on_object_async(self, obj: ObservableObject) -> None:
-        await self._robot.place_on_object(obj, num_retries=3).wait_for_completed()
+        await self._run_action_async(lambda: self._robot.place_on_object(obj, num_retries=3))
     
     async def place_object_on_ground_async(self, obj: ObservableObject) -> None:
-        await self._robot.place_object_on_ground_here(obj).wait_for_completed()
+        await self._run_action_async(lambda: self._robot.place_object_on_ground_here(obj))
     # Cube ----------------------------------------------------------------
-    async def connect_to_cubes_async(self) -> None:
-        self._cubes_connected = await self._robot.world.connect_to_cubes()
-    
-    def _disconnect_from_cubes(self) -> None:
-        print("Disconecting from cubes")
-        self.turn_cubes_lights_off()
-        self._robot.world.disconnect_from_cubes() 
-        self._cubes_connected = False
+    async def connect_to_cubes_async(self) -> bool:
+        return await self._cube_manager.connect_async()
 
     async def try_to_find_cube_async(self) -> LightCube:
+        known = self._spatial.nearest(CUBE)
+        if known is not None:
+            print("Cozmo remembers where cube {} is".format(known.obj))
+            self._spatial.searches_avoided += 1
+            return known.obj
         print("Trying to find cube")
         await self._show_face_async()
         look_around = self._robot.start_behavior(BehaviorTypes.LookAroundInPlace)
@@ -353,6 +468,11 @@ class Cozmo():
         return cube
 
     async def try_to_find_cubes_async(self, no_cubes: int) -> List[LightCube]:
+        known = [landmark.obj for landmark in self._spatial.known(CUBE)]
+        if len(known) >= no_cubes:
+            print("Cozmo remembers where {} cubes are".format(len(known)))
+            self._spatial.searches_avoided += 1
+            return known[:no_cubes]
         print("Trying to find cubes")
         lookaround = self._robot.start_behavior(BehaviorTypes.LookAroundInPlace)
         cubes = await self._robot.world.wait_until_observe_num_objects(num=2, object_type=LightCube, timeout=10)
@@ -365,28 +485,48 @@ class Cozmo():
         return cubes
 
     def get_cube_by_id(self, cube_id) -> LightCube:
-        return self._robot.world.get_light_cube(cube_id)
+        return self._cube_manager.get_cube(cube_id)
 
     async def get_in_distance_to_cube_async(self, cube: LightCube, distance: float) -> None:
         print("Moving within {} mm of cube {}".format(distance, cube))
-        await self._robot.go_to_object(cube, distance_mm(distance)).wait_for_completed()
+        await self._locate_cube_async(cube)
+        await self._run_action_async(lambda: self._robot.go_to_object(cube, distance_mm(distance)))
     
     async def dock_with_cube_async(self, cube: LightCube) -> None:
         print("Docking with cube {}".format(cube))
-        await self._robot.dock_with_cube(cube, approach_angle=cozmo.util.degrees(90), num_retries=3).wait_for_completed()
+        await self._locate_cube_async(cube)
+        await self._run_action_async(lambda: self._robot.dock_with_cube(cube, approach_angle=cozmo.util.degrees(90), num_retries=3))
     
     async def pick_up_cube_async(self, cube: LightCube) -> None:
         print("Picking up cube {}".format(cube))
-        await self._robot.pickup_object(cube, num_retries=3).wait_for_completed()
+        await self._locate_cube_async(cube)
+        await self._run_action_async(lambda: self._robot.pickup_object(cube, num_retries=3))
 
     async def roll_cube_async(self, cube: LightCube) -> None:
         print("Rolling cube {}".format(cube))
-        await self._robot.roll_cube(cube, check_for_object_on_top=True, num_retries=3).wait_for_completed()
+        await self._locate_cube_async(cube)
+        await self._run_action_async(lambda: self._robot.roll_cube(cube, check_for_object_on_top=True, num_retries=3))
     
     async def pop_a_wheelie_async(self, cube: LightCube) -> None:
         print("Poping a wheelie on cube {}".format(cube))
-        await self._robot.pop_a_wheelie(cube, num_retries=3).wait_for_completed()
+        await self._locate_cube_async(cube)
+        await self._run_action_async(lambda: self._robot.pop_a_wheelie(cube, num_retries=3))
     
+    async def _locate_cube_async(self, cube: LightCube) -> None:
+        # Actions on a cube fail when its pose is not in the robot's origin, only then is it worth looking around
+        if self._spatial.pose_of(cube) is not None:
+            return
+        if cube.pose is not None and cube.pose.is_comparable(self._robot.pose):
+            return
+        print("Looking around for cube {}".format(cube))
+        look_around = self._robot.start_behavior(BehaviorTypes.LookAroundInPlace)
+        try:
+            await cube.wait_for(cozmo.objects.EvtObjectObserved, timeout=self._config.action_timeout)
+        except asyncio.TimeoutError:
+            print("Didn't see cube {}".format(cube))
+        finally:
+            look_around.stop()
+
     # Free time ----------------------------------------------------------------
     def start_free_time(self) -> None:
         print("Starting freetime")
@@ -405,38 +545,59 @@ class Cozmo():
     async def get_off_charger_async(self):
         print("Getting off charger")
         if self._robot.is_on_charger:
-            await self._robot.drive_off_charger_contacts(self._robot).wait_for_completed()
-            await self._robot.drive_straight(distance_mm(100), speed_mmps(100)).wait_for_completed()
+            await self._run_action_async(lambda: self._robot.drive_off_charger_contacts(self._robot))
+            await self._run_action_async(lambda: self._robot.drive_straight(distance_mm(100), speed_mmps(100)), retries=0)
 
     async def get_on_charger_async(self):
         if self._robot.is_on_charger:
             return
 
         print("Getting on charger")
-        await self._robot.set_head_angle(degrees(0), in_parallel=False).wait_for_completed()
+        for attempt in range(1, MAX_DOCKING_ATTEMPTS + 1):
+            print("Docking attempt {} of {}".format(attempt, MAX_DOCKING_ATTEMPTS))
+            charger = await self._try_get_on_charger_async()
+            if charger is None:
+                print("Could not find the charger")
+                self._record_event("docking", "charger_not_found", attempt)
+                return
+            if(self._robot.is_on_charger):
+                print('PROCEDURE SUCCEEDED')
+                self._record_event("docking", "docked", attempt)
+                return
+            await self._restart_get_on_charger_async(charger)
+        print("Could not get on charger after {} attempts".format(MAX_DOCKING_ATTEMPTS))
+        self._record_event("docking", "failed", MAX_DOCKING_ATTEMPTS)
+
+    def _record_event(self, type: str, name: str, value: float = None, data: dict = None) -> None:
+        if self.on_event is not None:
+            self.on_event(type, name, value, data)
+
+    async def _try_get_on_charger_async(self) -> Charger:
+        await self._run_action_async(lambda: self._robot.set_head_angle(degrees(0), in_parallel=False))
         pitch_threshold = math.fabs(self._robot.pose_pitch.degrees)
         pitch_threshold += 1  # Add 1 degree to threshold
         print('Pitch threshold: ' + str(pitch_threshold))
         # Drive towards charger
         charger = await self._go_to_charger_async()
+        if charger is None:
+            return None
         # Adjust position in front of the charger
         await self._final_adjust_async(charger, critical=True)
         # Turn around and start going backward
         await self.turn_around_async()
-        await self._robot.set_lift_height(height=0.5, max_speed=10, in_parallel=True).wait_for_completed()
-        await self._robot.set_head_angle(degrees(0), in_parallel=True).wait_for_completed()
-        await self._robot.backup_onto_charger(max_drive_time=5)
-        if(self._robot.is_on_charger):
-            print('PROCEDURE SUCCEEDED')
-        else:
-            await self._restart_get_on_charger_async(charger)
-            return
-        return
+        await self._run_action_async(lambda: self._robot.set_lift_height(height=0.5, max_speed=10, in_parallel=True))
+        await self._run_action_async(lambda: self._robot.set_head_angle(degrees(0), in_parallel=True))
+        await asyncio.wait_for(self._robot.backup_onto_charger(max_drive_time=5), self._config.action_timeout)
+        return charger
 
     async def _find_charger_async(self) -> Charger:
         max_tries = 5
         counter = 0
         while counter < max_tries:
+            known = self._spatial.nearest(CHARGER)
+            if known is not None:
+                self._spatial.searches_avoided += 1
+                return known.obj
             print("Looking around for charger for {} time".format(counter))
             behavior = self._robot.start_behavior(cozmo.behavior.BehaviorTypes.LookAroundInPlace)
             try:
@@ -459,13 +620,14 @@ class Cozmo():
             await self.random_negative_anim_async()
             counter += 1
     
-    async def _look_for_charger_untill_found(self) -> Charger:
+    async def _look_for_charger_async(self) -> Charger:
         print("Looking for charger")
-        while True:
+        for _ in range(MAX_CHARGER_SEARCHES):
             charger = await self._find_charger_async()
             if charger:
                 await self.random_positive_anim_async()
                 return charger
+        return None
 
     async def _go_to_random_position_async(self) -> None:
         print("Going to random position")
@@ -476,7 +638,7 @@ class Cozmo():
         if random.choice((True, False)):
             y = 150
         z= random.randrange(-40, 41, 80)
-        await self._robot.go_to_pose(Pose(x, y, 0, angle_z=degrees(z)), relative_to_robot=True).wait_for_completed()
+        await self._run_action_async(lambda: self._robot.go_to_pose(Pose(x, y, 0, angle_z=degrees(z)), relative_to_robot=True), retries=0)
     
     async def _check_for_charger_async(self) -> Charger:
         print("Checking for charger")
@@ -485,15 +647,23 @@ class Cozmo():
         self.head_lights(True)
         await asyncio.sleep(0.25)
         self.head_lights(False)
+        known = self._spatial.nearest(CHARGER)
+        if known is not None:
+            print("Found charger")
+            return known.obj
         if self._robot.world.charger and self._robot.world.charger.pose.is_comparable(self._robot.pose):
             print("Found charger")
             return self._robot.world.charger
         return None
 
-    async def _go_to_charger_async(self) -> None:
+    async def _go_to_charger_async(self) -> Charger:
         print("Going to charger")
         charger = None
-        if self._robot.world.charger:
+        known = self._spatial.nearest(CHARGER)
+        if known is not None:
+            print("Cozmo remembers where the charger is")
+            charger = known.obj
+        elif self._robot.world.charger:
             # make sure Cozmo was not delocalised after observing the charger
             if self._robot.world.charger.pose.is_comparable(self._robot.pose):
                 print("Cozmo already knows where the charger is!")
@@ -504,9 +674,11 @@ class Cozmo():
                 # the charger) so try to look for the charger first
                 pass
         if not charger:
-            charger = await self._look_for_charger_untill_found()
+            charger = await self._look_for_charger_async()
+            if not charger:
+                return None
 
-        await self._robot.go_to_object(charger, distance_from_object=distance_mm(80), in_parallel=False, num_retries=5).wait_for_completed()
+        await self._run_action_async(lambda: self._robot.go_to_object(charger, distance_from_object=distance_mm(80), in_parallel=False, num_retries=5))
         return charger
 
     async def _final_adjust_async(self, charger: Charger, dist_charger=40, speed=40, critical=False) -> None:
@@ -514,7 +686,7 @@ class Cozmo():
         # The position can be adjusted several times if
         # the precision is critical, i.e. when climbing
         # back onto the charger.
-        while(True):
+        for _ in range(MAX_ALIGN_ADJUSTMENTS):
             # Calculate positions
             r_coord = [0, 0, 0]
             c_coord = [0, 0, 0]
@@ -543,12 +715,12 @@ class Cozmo():
             print('CHECK: Adjusting position')
             # Face the target position
             angle = self._clip_angle(theta_t-r_zRot)
-            await self._robot.turn_in_place(radians(angle)).wait_for_completed()
+            await self._run_action_async(lambda: self._robot.turn_in_place(radians(angle)), retries=0)
             # Drive toward the target position
-            await self._robot.drive_straight(distance_mm(distance), speed_mmps(speed)).wait_for_completed()
+            await self._run_action_async(lambda: self._robot.drive_straight(distance_mm(distance), speed_mmps(speed)), retries=0)
             # Face the charger
             angle = self._clip_angle(c_zRot-theta_t)
-            await self._robot.turn_in_place(radians(angle)).wait_for_completed()
+            await self._run_action_async(lambda: self._robot.turn_in_place(radians(angle)), retries=0)
 
             # In case the robot does not need to climb onto the charger
             if not critical:
@@ -561,22 +733,19 @@ class Cozmo():
     async def _restart_get_on_charger_async(self, charger: Charger) -> None:
         print("Restarting get on charger")
         self._robot.stop_all_motors()
-        await self._robot.set_lift_height(height=0.5, max_speed=10, in_parallel=True).wait_for_completed()
+        await self._run_action_async(lambda: self._robot.set_lift_height(height=0.5, max_speed=10, in_parallel=True))
         self._robot.pose.invalidate()
         charger.pose.invalidate()
         print('ABORT: Driving away')
         # robot.drive_straight(distance_mm(150),speed_mmps(80),in_parallel=False).wait_for_completed()
-        await self._robot.drive_wheels(80, 80, duration=2)
+        await asyncio.wait_for(self._robot.drive_wheels(80, 80, duration=2), self._config.action_timeout)
         await self.turn_around_async()
-        await self._robot.set_lift_height(height=0, max_speed=10, in_parallel=True).wait_for_completed()
-        # Restart procedure
-        await self.get_on_charger_async()
-        return
+        await self._run_action_async(lambda: self._robot.set_lift_height(height=0, max_speed=10, in_parallel=True))
 
     async def _check_tol_async(self, charger: Charger, dist_charger=40):
         # Check if the position tolerance in front of the charger is respected
-        distance_tol = 10  # mm, tolerance for placement error
-        angle_tol = 5*self.PI/180  # rad, tolerance for orientation error
+        distance_tol = self._config.docking_distance_tolerance  # mm, tolerance for placement error
+        angle_tol = self._config.docking_angle_tolerance*self.PI/180  # rad, tolerance for orientation error
         try:
             charger = await self._robot.world.wait_for_observed_charger(timeout=2, include_existing=True)
         except:
@@ -1,4 +1,4 @@
-from typing import Awaitable, Dict, Union, Tuple
+from typing import Awaitable, Dict, Hashable, List, Union, Tuple
 import mqtt_client
 import cozmo_client
 import json
@@ -13,119 +13,267 @@ from multiprocessing import SimpleQueue
 import functools
 import types
 from message_manager import MessageManager
-from datetime import datetime
-from cozmo_states import CozmoStates
-
-#Provide MQTT broker data if want mqtt
-MQTT_BROKER_URL = None 
-MQTT_BROKER_PORT = None
-MQTT_USERNAME = None
-MQTT_PASSWORD = None
-MQTT_WEATHER_TOPIC = "home-assistant/cozmo/notification"
-MQTT_CONTROL_TOPIC = "home-assistant/cozmo/control"
-COZMO_MQTT_PUBLISHING_TOPIC = "cozmo/status"
-MQTT_TOPICS = [MQTT_WEATHER_TOPIC, MQTT_CONTROL_TOPIC]
+import time
+from cozmo_states import CozmoStates, CozmoStateMachine
+from behavior_arbiter import Behavior, BehaviorArbiter, BehaviorPriority
+from task_supervisor import TaskSupervisor
+from config import Config
+from camera_stream import CameraStreamServer
+from connection_supervisor import ConnectionSupervisor
+from motion_detector import MotionEvent, MotionStage
+from world_snapshot import WorldSnapshot
+from home_assistant import HomeAssistantPublisher, availability_topic, OFFLINE
+from websocket_api import WebSocketApi
+from event_store import EventStore
+
 YELLOW = (255, 255, 0)
 SLATE_GRAY = (119, 136, 153)
+CHARGE_BEHAVIOR = "charge"
+SLEEP_BEHAVIOR = "sleep"
+REACTION_MAX_DELAY = 5
+REACTION_MAX_RUNTIME = 120
+MESSAGE_MAX_RUNTIME = 300
+# Docking plus a full charge from empty
+CHARGE_MAX_RUNTIME = 3 * 3600
+COOLDOWN_PRUNE_INTERVAL = 60
+MAX_DRIVE_SPEED = 200
+MAX_DRIVE_DURATION = 10
+# Hold started by each safety reflex
+REFLEX_HOLDS = {
+    "cliff": "cliff_detected",
+    "picked_up": "picked_up",
+}
+# Robot flag that ends each hold and what is printed then
+HOLDS = {
+    "picked_up": ("is_picked_up", "Cozmo was put down"),
+    "cliff_detected": ("is_cliff_detected", "Cozmo away from cliff"),
+}
+DEFER_WHILE_HELD = "defer"
+# Longest animation a reaction plays, safety reactions get the shortest ones
+ANIMATION_BUDGETS = {
+    "saw_face": 4.0,
+    "picked_up": 3.0,
+    "cliff_detected": 3.0,
+}
 
 
 class CozmoMqttProgram():
-    def __init__(self) -> None:
-        self._cozmo = cozmo_client.Cozmo()
+    def __init__(self, config: Config = None) -> None:
+        self._config = config or Config()
+        self._cozmo = cozmo_client.Cozmo(self._config)
         self._queue = SimpleQueue()
         self._mqtt_client = None
-        if MQTT_BROKER_URL is not None:
+        self._home_assistant = None
+        #Provide MQTT broker data in the config if want mqtt
+        if self._config.mqtt_broker_url is not None:
             self._mqtt_client = mqtt_client.MqttClient(
-                MQTT_BROKER_URL,
-                MQTT_BROKER_PORT,
-                MQTT_USERNAME,
-                MQTT_PASSWORD,
-                MQTT_TOPICS, self._on_mqtt_message)
+                self._config.mqtt_broker_url,
+                self._config.mqtt_broker_port,
+                self._config.mqtt_username,
+                self._config.mqtt_password,
+                self._mqtt_topics(), self._on_mqtt_message,
+                will_topic=availability_topic(self._config), will_payload=OFFLINE,
+                on_connected=self._on_mqtt_connected)
+            self._home_assistant = HomeAssistantPublisher(self._mqtt_client, self._config)
         self.sdk_conn: CozmoConnection = None
-        self._faces: Dict[Face, datetime] = dict()
-        self._visible_objects: Dict[ObservableObject, datetime] = dict()
-        self._message_manager = MessageManager()
-        self._cozmo_state = CozmoStates.Disconnected
+        self._connection: ConnectionSupervisor = None
+        self._stopping = False
+        # Keyed by name or id, the SDK objects are new after a reconnect
+        self._faces: Dict[Hashable, float] = dict()
+        self._visible_objects: Dict[Hashable, float] = dict()
+        self._last_prune = 0.0
+        self._snapshot: WorldSnapshot = None
+        self._message_manager = MessageManager(self._config.phrase_locale_file, self._config.phrase_history_half_life)
+        self._state_machine = CozmoStateMachine(CozmoStates.Disconnected, on_transition=self._on_state_transition)
+        self._state_machine.on_exit(CozmoStates.GoingToCharge, self._on_left_going_to_charge)
+        self._supervisor = TaskSupervisor()
+        self._arbiter = BehaviorArbiter(self._cozmo, self._supervisor, on_freetime=self._on_freetime_started,
+                                        quiet_period=self._config.freetime_quiet_period)
+        self._config.subscribe(self._on_config_changed)
+        self._message_count = 0
+        # Name of the latest notification behavior per topic
+        self._notifications: Dict[str, str] = dict()
+        self._camera_stream = None
+        if self._config.camera_stream_port is not None:
+            self._camera_stream = CameraStreamServer(self._config)
+        self._commands = {
+            "say": self._say_command_async,
+            "image": self._image_command_async,
+            "lights": self._lights_command_async,
+            "sleep": self._sleep_command_async,
+            "freetime": self._freetime_command_async,
+            "drive": self._drive_command_async,
+        }
+        self._events = None
+        if self._config.event_store_file is not None:
+            self._events = EventStore(self._config)
+            self._cozmo.on_event = self._record_event
+        self._last_battery_sample = 0.0
+        self._cozmo.reflex.on_reflex = self._on_reflex
+        self._cozmo.reflex.on_breach = self._on_reflex_breach
+        self._websocket = None
+        if self._config.websocket_port is not None:
+            self._websocket = WebSocketApi(self._config, self.submit_command, self.query_history_async)
+        self._motion_stage = None
+        if self._config.motion_detection_enabled:
+            self._motion_stage = MotionStage(self._config, self._on_motion_detected, lambda: self._cozmo.power.motion_fps)
     
     @property
     def cozmo_state(self) -> CozmoStates:
-        return self._cozmo_state
+        return self._state_machine.state
 
     @cozmo_state.setter
     def cozmo_state(self, state: CozmoStates) -> None:
-        self._cozmo_state = state
-        self._publish_cozmo_state()
+        self._state_machine.transition(state)
+
+    def _mqtt_topics(self) -> List[str]:
+        return [self._config.mqtt_weather_topic, self._config.mqtt_control_topic, self._config.mqtt_config_topic,
+                self._config.mqtt_query_topic]
+
+    def _on_config_changed(self, changed: dict) -> None:
+        if "freetime_quiet_period" in changed:
+            self._arbiter.quiet_period = changed["freetime_quiet_period"]
+        if self._mqtt_client is not None and any(name.endswith("_topic") for name in changed):
+            self._mqtt_client.set_topics(self._mqtt_topics())
+
+    async def run_async(self, connection: ConnectionSupervisor = None) -> None:
+        # Owns the robot connection, a lost connection is resumed with the state kept in this process
+        self._connection = connection or ConnectionSupervisor(self._config)
+        await self._start_async()
+        try:
+            await self._connection.run_async(self._run_session_async)
+        finally:
+            await self.terminate_async()
 
     async def run_with_robot_async(self, robot: cozmo.robot.Robot) -> None:
-        self.sdk_conn = robot.world.conn
-        await self._run_async(robot)    
+        # A single session on a connection made by the caller, the program ends with it
+        await self._start_async()
+        try:
+            await self._run_session_async(robot)
+        finally:
+            await self.terminate_async()
+
+    def stop(self) -> None:
+        self._stopping = True
+        if self._connection is not None:
+            self._connection.stop()
 
-    async def _run_async(self, robot: cozmo.robot.Robot) -> None:
+    async def _start_async(self) -> None:
+        self._supervisor.start("config-watcher", self._config.watch_file_async())
+        if self._events is not None:
+            await self._events.start_async()
+        if self._mqtt_client is not None:
+            await self._mqtt_client.connect_async()
+        if self._camera_stream is not None:
+            await self._camera_stream.start_async()
+        if self._websocket is not None:
+            await self._websocket.start_async()
+
+    async def _run_session_async(self, robot: cozmo.robot.Robot) -> None:
+        self.sdk_conn = robot.world.conn
         await self._initialize_async(robot)
         try:
-            while self.sdk_conn.is_connected:
+            while self.sdk_conn.is_connected and not self._stopping:
+                snapshot = self._snapshot = WorldSnapshot.capture(robot)
                 self._cozmo.update_needs_level()
-                if self._cozmo.needs_charging() and not self._cozmo.is_sleeping:
-                    await self._charge_cycle()
-                    await self._cozmo.wake_up_async()
-                    self._cozmo_freetime()
+                if self._cozmo.needs_charging(snapshot) and not self._cozmo.is_sleeping and not self._arbiter.is_scheduled(CHARGE_BEHAVIOR):
+                    self._arbiter.submit(CHARGE_BEHAVIOR, BehaviorPriority.Charging, self._charge_cycle_async, max_runtime=CHARGE_MAX_RUNTIME)
 
                 if not self._queue.empty():
-                    await self._handel_queue_async()
-
-                if self._cozmo.world.visible_face_count() > 0:
-                    face = self._get_visible_face()
-                    if face:
-                        if face in self._faces:
-                            last_seen = self._faces[face]
-                            if (datetime.now() - last_seen).total_seconds() > 60:
-                                await self._cozmo_do_async(self._on_saw_face(face))
-                        else:
-                            await self._cozmo_do_async(self._on_saw_face(face))
-
-                if self._cozmo.robot.is_picked_up:
-                    await self._cozmo_do_async(self._on_picked_up_async()) 
-  
-                if self._cozmo.robot.is_cliff_detected:                   
-                    await self._cozmo_do_async(self._on_cliff_detected_async()) 
-                
-                if self._cozmo.world.visible_object_count(object_type=ObservableObject) > 0:
-                    visible_object = self._get_visible_object()
-                    if visible_object:
-                        if visible_object in self._visible_objects:
-                            last_seen = self._visible_objects[visible_object]
-                            if (datetime.now() - last_seen).total_seconds() > 60 * 5:
-                                await self._cozmo_do_async(self._on_new_object_appeared_async(visible_object))
-                        else:
-                            await self._cozmo_do_async(self._on_new_object_appeared_async(visible_object))
-
-                await asyncio.sleep(0.1)
+                    self._handel_queue()
+
+                face = snapshot.face
+                if face:
+                    last_seen = self._faces.get(self._cooldown_key(face))
+                    if last_seen is None or snapshot.timestamp - last_seen > self._config.face_cooldown:
+                        self._react("saw_face", BehaviorPriority.Social, functools.partial(self._on_saw_face, face))
+
+                if snapshot.is_picked_up:
+                    self._start_hold("picked_up", snapshot, self._on_picked_up_async)
+
+                if snapshot.is_cliff_detected:
+                    self._start_hold("cliff_detected", snapshot, self._on_cliff_detected_async)
+
+                visible_object = snapshot.visible_object
+                if visible_object:
+                    last_seen = self._visible_objects.get(self._cooldown_key(visible_object))
+                    if last_seen is None or snapshot.timestamp - last_seen > self._config.object_cooldown:
+                        self._react("object_appeared", BehaviorPriority.Ambient,
+                                    functools.partial(self._on_new_object_appeared_async, visible_object, snapshot))
+
+                self._prune_cooldowns(snapshot.timestamp)
+                self._sample_battery(snapshot)
+                resting = self._cozmo.is_sleeping or (snapshot.is_charging and not self._cozmo.freetime_enabled)
+                self._cozmo.power.update(snapshot, resting, self._arbiter.current is not None)
+                self._cozmo.cube_manager.maintain()
+                self._publish_sensors()
+                self._arbiter.tick()
+                self._supervisor.check()
+                await asyncio.sleep(self._cozmo.power.loop_period)
         except:
             print("Unexpected error:", sys.exc_info()[0])
-        
-        await self.terminate_async()
+
+        if not self.sdk_conn.is_connected:
+            # Behaviors, queued messages and cooldowns wait here for the next connection
+            self._arbiter.suspend()
+            self._cancel_session_tasks()
+        else:
+            # Still connected, so the program is ending, dock before the connection gets closed
+            await self._park_async()
+
+    def _cancel_session_tasks(self) -> None:
+        self._supervisor.cancel("motion-detector")
+        for name in HOLDS:
+            self._supervisor.cancel(self._hold_task_name(name))
+
+    async def _park_async(self) -> None:
+        self._arbiter.stop()
+        self._cancel_session_tasks()
+        self._cozmo.speech.stop()
+        print("Sending cozmo back to charger")
+        await self._cozmo.stop_all_actions_async()
+        self._cozmo.back_to_normal()
+        await self._cozmo.get_on_charger_async()
 
     async def _initialize_async(self, robot: cozmo.robot.Robot) -> None:
         self._observe_connection_lost(self.sdk_conn, self._on_connection_lost)
+        self._record_event("connection", "connected")
         self._cozmo.set_robot(robot)
-        await asyncio.gather(
-            self._cozmo.connect_to_cubes_async(),
-            self._cozmo.get_off_charger_async()
-        )
-        if self._mqtt_client is not None:
-            await self._mqtt_client.connect_async()
+        if self._arbiter.is_idle:
+            await asyncio.gather(
+                self._cozmo.connect_to_cubes_async(),
+                self._cozmo.get_off_charger_async()
+            )
+        else:
+            # Resuming, the interrupted behavior decides where the robot should be
+            await self._cozmo.connect_to_cubes_async()
+        if self._camera_stream is not None:
+            self._camera_stream.attach(robot.world)
+        if self._motion_stage is not None:
+            self._supervisor.start("motion-detector", self._motion_stage.run_async(robot))
         self.cozmo_state = CozmoStates.Connected
-        self._cozmo_freetime()
-    
+        self._arbiter.resume()
+        if self._arbiter.current is None:
+            self._arbiter.start_freetime()
+
     async def terminate_async(self) -> None:
         print("Terminating")
+        self._arbiter.stop()
+        self._supervisor.cancel_all()
+        self._cozmo.speech.stop()
+        self._cozmo.cube_manager.stop()
+        self._cozmo.animations.save()
+        if self._camera_stream is not None:
+            await self._camera_stream.stop_async()
+        if self._websocket is not None:
+            await self._websocket.stop_async()
         if self._mqtt_client is not None:
+            self._home_assistant.publish_offline()
             await self._mqtt_client.disconnect_async()
-        if self.sdk_conn.is_connected:
-            print("Sending cozmo back to charger")
-            await self._cozmo.stop_all_actions_async()
-            self._cozmo.back_to_normal()
-            await self._cozmo.get_on_charger_async()
+        if self._events is not None:
+            await self._events.stop_async()
+        if self._motion_stage is not None:
+            self._motion_stage.close()
 
     def _observe_connection_lost(self, connection: CozmoConnection, cb):
         meth = connection.connection_lost
@@ -137,104 +285,227 @@ class CozmoMqttProgram():
 
     def _on_connection_lost(self) -> None:
         print("Captured connection lost")
+        self._record_event("connection", "lost")
         self.cozmo_state = CozmoStates.ConnectionLost
 
+    def _on_state_transition(self, previous: CozmoStates, state: CozmoStates, dwell: float) -> None:
+        print("Cozmo state {} -> {} after {:.1f}s".format(previous.value, state.value, dwell))
+        self._record_event("state", state.value, dwell, {"previous": previous.value})
+        if self._websocket is not None:
+            self._websocket.publish("state", {"state": state.value, "previous": previous.value, "dwell": round(dwell, 1)})
+        self._publish_cozmo_state()
+        if self._mqtt_client is not None:
+            self._mqtt_client.publish(self._config.stats_topic, self._state_machine.stats())
+
+    def _on_left_going_to_charge(self, previous: CozmoStates, state: CozmoStates, dwell: float) -> None:
+        print("Getting to the charger took {:.0f}s".format(dwell))
+
+    def _on_mqtt_connected(self) -> None:
+        self._home_assistant.on_connected()
+        self._publish_sensors()
+
+    def _publish_sensors(self) -> None:
+        snapshot = self._snapshot
+        if self._websocket is not None and snapshot is not None:
+            self._websocket.publish("battery", {"voltage": round(snapshot.battery_voltage, 1),
+                                                "level": cozmo_client.battery_level(snapshot.battery_voltage),
+                                                "charging": snapshot.is_charging}, only_changes=True)
+        if self._home_assistant is None:
+            return
+        self._home_assistant.update("state", self.cozmo_state.value)
+        if snapshot is not None:
+            # Voltage readings are noisy, only publish changes that matter
+            self._home_assistant.update("battery_voltage", round(snapshot.battery_voltage, 2), deadband=0.03)
+            self._home_assistant.update("battery_level", cozmo_client.battery_level(snapshot.battery_voltage))
+            self._home_assistant.update("charging", snapshot.is_charging)
+        if self._motion_stage is not None:
+            self._home_assistant.update("motion", self._motion_stage.motion_active)
+
+    def _on_motion_detected(self, event: MotionEvent) -> None:
+        print("Motion detected: {}".format(event.as_dict()))
+        self._publish_perception("motion", event.as_dict())
+        if self._mqtt_client is not None:
+            self._mqtt_client.publish(self._config.motion_topic, event.as_dict())
+        self._publish_sensors()
+
+    def _publish_perception(self, event: str, payload: dict = None) -> None:
+        self._record_event("perception", event, data=payload)
+        if self._websocket is not None:
+            self._websocket.publish("perception", dict(payload or {}, event=event))
+
     def _publish_cozmo_state(self) -> None:
+        self._publish_sensors()
         if self._mqtt_client is not None:
             payload = dict()
             payload["status"] = self.cozmo_state.value
             attributes = dict()
+            if self._snapshot is not None:
+                attributes["battery_voltage"] = self._snapshot.battery_voltage
+            attributes["freetime_toggles_per_minute"] = self._arbiter.freetime_toggles_per_minute
+            attributes["stuck_tasks"] = self._supervisor.stuck_count
+            attributes["leaked_tasks"] = self._supervisor.leaked_count
+            attributes["speech"] = self._cozmo.speech.stats()
+            if self._events is not None:
+                attributes["events"] = self._events.stats()
+            if self._websocket is not None:
+                attributes["websocket"] = self._websocket.stats()
+            if self._connection is not None:
+                attributes["connection"] = self._connection.stats()
             if self._cozmo.robot:
-                attributes["battery_voltage"] = self._cozmo.battery_voltage
+                attributes["power"] = self._cozmo.power.stats()
+                attributes["reflex"] = self._cozmo.reflex.stats()
+                attributes["spatial"] = self._cozmo.spatial.stats()
+                attributes["cubes"] = self._cozmo.cube_manager.stats()
             payload["attributes"] = attributes
-            self._mqtt_client.publish(COZMO_MQTT_PUBLISHING_TOPIC, payload)
+            self._mqtt_client.publish(self._config.status_topic, payload)
     
     async def _on_saw_face(self, face: Face) -> None:
-        self._faces[face] = datetime.now()
+        self._faces[self._cooldown_key(face)] = time.monotonic()
         self.cozmo_state = CozmoStates.SawFace
         print("An face appeared: {}".format(face))
+        self._publish_perception("face", {"name": face.name, "face_id": face.face_id, "expression": face.known_expression})
+        if self._home_assistant is not None:
+            self._home_assistant.update("last_face", face.name or "Unknown")
         if face.name:
             await self._cozmo.turn_toward_face_async(face)
             message = self._message_manager.get_hello_message(face)
-            await self._cozmo.random_positive_anim_async()
-            await self._cozmo.say_async(message)
+            await self._cozmo.random_positive_anim_async(ANIMATION_BUDGETS["saw_face"])
             if face.known_expression:
+                self._cozmo.say(message, BehaviorPriority.Social)
                 message = self._message_manager.get_fece_expression_message(face.known_expression, face)
-                await self._cozmo.say_async(message)
+            await self._cozmo.say_async(message, BehaviorPriority.Social)
         else:
             message = self._message_manager.get_non_recognized_message(face)
-            await self._cozmo.say_async(message)
+            await self._cozmo.say_async(message, BehaviorPriority.Social)
 
-    async def _on_picked_up_async(self) -> None:
+    async def _on_picked_up_async(self, snapshot: WorldSnapshot) -> None:
         print("Cozmo was picked up")
+        self._publish_perception("picked_up")
         self.cozmo_state = CozmoStates.PickedUp
-        face = self._get_visible_face()
+        face = snapshot.face
         message = self._message_manager.get_picked_up_message(face)
-        await self._cozmo.random_positive_anim_async() 
+        await self._cozmo.random_positive_anim_async(ANIMATION_BUDGETS["picked_up"])
         if face:
             await self._cozmo.display_camera_image_async()        
-        await self._cozmo.say_async(message)
-        while self._cozmo.robot.is_picked_up:
-            await asyncio.sleep(0.1)
-        print("Cozmo was put down")
-        
-    async def _on_cliff_detected_async(self) -> None:
+        await self._cozmo.say_async(message, BehaviorPriority.Safety)
+
+    async def _on_cliff_detected_async(self, snapshot: WorldSnapshot) -> None:
         print("Cozmo detected a cliff")
+        self._publish_perception("cliff")
         self.cozmo_state = CozmoStates.OnCliff
-        self._cozmo.stop()
         self._cozmo.clear_current_animations()
-        await self._cozmo.drive_wheels_async(-40, 1)
-        face = self._get_visible_face()
+        # The reflex already stopped the motors, the reaction starts once it backed off
+        await self._cozmo.reflex.wait_settled_async()
+        face = snapshot.face
         message = self._message_manager.get_cliff_detected_message(face)      
-        await self._cozmo.random_negative_anim_async()      
-        await self._cozmo.say_async(message)
-        while self._cozmo.robot.is_cliff_detected:
-            await asyncio.sleep(0.1)
-        print("Cozmo away from cliff")
+        await self._cozmo.random_negative_anim_async(ANIMATION_BUDGETS["cliff_detected"])
+        await self._cozmo.say_async(message, BehaviorPriority.Safety)
     
-    async def _on_new_object_appeared_async(self, visible_object:ObservableObject ) -> None:
-        self._visible_objects[visible_object] = datetime.now()
+    async def _on_new_object_appeared_async(self, visible_object: ObservableObject, snapshot: WorldSnapshot) -> None:
+        self._visible_objects[self._cooldown_key(visible_object)] = time.monotonic()
         print("An obbject appeared: {}".format(visible_object))
-        face = self._get_visible_face()
+        self._publish_perception("object", {"object_id": visible_object.object_id, "cube_id": getattr(visible_object, "cube_id", None)})
+        face = snapshot.face
         message = self._message_manager.get_object_appeared_message(visible_object, face)
-        await self._cozmo.say_async(message)
+        await self._cozmo.say_async(message, BehaviorPriority.Ambient)
 
-    def _get_visible_face(self) -> Face:
-        if self._cozmo.world.visible_face_count() == 0:
-            print("Found no visibile faces")
-            return None
+    def _cooldown_key(self, seen: Union[Face, ObservableObject]) -> Hashable:
+        if hasattr(seen, "face_id"):
+            return ("face", seen.name or seen.face_id)
+        return ("object", getattr(seen, "cube_id", None) or seen.object_id)
 
-        visible_face = next((face for face in self._cozmo.world.visible_faces), None)
-        return visible_face
-    
-    def _get_visible_object(self) -> ObservableObject:
-        if self._cozmo.world.visible_object_count(object_type=ObservableObject) == 0:
-            print("Found no visibile objects")
-            return None
+    def _prune_cooldowns(self, now: float) -> None:
+        # Faces and objects past their cooldown count as unseen anyway, forgetting them keeps both dicts bounded
+        if now - self._last_prune < COOLDOWN_PRUNE_INTERVAL:
+            return
+        self._last_prune = now
+        for seen, cooldown in ((self._faces, self._config.face_cooldown), (self._visible_objects, self._config.object_cooldown)):
+            for key in [key for key, last_seen in seen.items() if now - last_seen > cooldown]:
+                del seen[key]
 
-        visible_obj = next((obj for obj in self._cozmo.world.visible_objects), None)
-        return visible_obj
+    def _record_event(self, type: str, name: str = None, value: float = None, data: dict = None) -> None:
+        if self._events is not None:
+            self._events.record(type, name, value, data)
+
+    def _sample_battery(self, snapshot: WorldSnapshot) -> None:
+        if self._events is None or snapshot.timestamp - self._last_battery_sample < self._config.event_battery_interval:
+            return
+        self._last_battery_sample = snapshot.timestamp
+        self._events.record("battery", "charging" if snapshot.is_charging else "discharging", snapshot.battery_voltage)
+
+    async def query_history_async(self, query: dict) -> List[dict]:
+        # {"type", "since", "until", "limit"} with epoch seconds, "rollup" for the downsampled history
+        if self._events is None:
+            raise ValueError("event store is disabled")
+        query_async = self._events.rollups_async if query.get("rollup") else self._events.query_async
+        return await query_async(query.get("type"), query.get("since"), query.get("until"), query.get("limit"))
+
+    async def _answer_query_async(self, query: dict) -> None:
+        payload = {"id": query.get("id")}
+        try:
+            payload["rows"] = await self.query_history_async(query)
+        except Exception as e:
+            payload["error"] = str(e)
+        self._mqtt_client.publish(self._config.history_topic, payload)
 
-    def _cozmo_freetime(self) -> None:
-        self._cozmo.start_free_time()
+    def _on_freetime_started(self) -> None:
         self.cozmo_state = CozmoStates.Freetime
 
-    async def _cozmo_do_async(self, async_f: Awaitable) -> None:
-        if self._cozmo.freetime_enabled:
-            self._cozmo.stop_free_time()
+    def _on_reflex(self, reflex: str) -> None:
+        # Straight from the state update, the reaction preempts whatever behavior runs without waiting for the loop
+        name = REFLEX_HOLDS[reflex]
+        reaction = self._on_cliff_detected_async if name == "cliff_detected" else self._on_picked_up_async
+        self._start_hold(name, WorldSnapshot.capture(self._cozmo.robot), reaction)
+
+    def _on_reflex_breach(self, reflex: str, latency: float) -> None:
+        self._record_event("reflex_breach", reflex, latency)
+        if self._mqtt_client is not None:
+            self._mqtt_client.publish(self._config.alert_topic, {
+                "alert": "reflex_latency", "reflex": reflex, "latency_ms": round(latency * 1000),
+                "objective_ms": round(self._config.reflex_latency_slo * 1000)})
+
+    def _start_hold(self, name: str, snapshot: WorldSnapshot, reaction) -> None:
+        # The reaction runs once per hold, waiting for the hold to end does not take the behavior slot
+        if self._supervisor.is_running(self._hold_task_name(name)):
+            return
+        below = None
+        if name == "cliff_detected" or self._config.held_queue_policy == DEFER_WHILE_HELD:
+            # Anything queued could move the robot, at a cliff that always waits
+            below = BehaviorPriority.Safety
+        self._arbiter.hold(name, below)
+        self._react(name, BehaviorPriority.Safety, functools.partial(reaction, snapshot))
+        self._supervisor.start(self._hold_task_name(name), self._await_hold_released_async(name))
+
+    async def _await_hold_released_async(self, name: str) -> None:
+        flag, message = HOLDS[name]
+        started = time.monotonic()
         try:
-            await async_f
-            self._cozmo_freetime()
-        except cozmo.RobotBusy:
-            print("Task Exception...cozmo is Busy")
+            await self._cozmo.state_watcher.wait_for_async(lambda robot: not getattr(robot, flag))
+            print(message)
+            self._record_event("hold", name, time.monotonic() - started)
+        finally:
+            self._arbiter.release(name)
 
-    async def _charge_cycle(self) -> None:
+    def _hold_task_name(self, name: str) -> str:
+        return "hold:{}".format(name)
+
+    def _react(self, name: str, priority: BehaviorPriority, factory) -> None:
+        # Reactions are only worth doing while they are fresh
+        if not self._arbiter.is_scheduled(name):
+            self._record_event("reaction", name)
+        self._arbiter.submit(name, priority, factory, max_delay=REACTION_MAX_DELAY, max_runtime=REACTION_MAX_RUNTIME)
+
+    async def _charge_cycle_async(self) -> None:
         self.cozmo_state = CozmoStates.GoingToCharge
         print("Cozmo needs charging. Battery level {}".format(self._cozmo.battery_voltage))
         await self._cozmo.start_charging_routine_async()
         self.cozmo_state = CozmoStates.Charging
-        await self._cozmo.charge_to_full_async()
+        session = await self._cozmo.charge_to_full_async()
         print("Cozmo charged")
+        self._record_event("charge", "session", session.charge_rate, session.as_dict())
+        if self._mqtt_client is not None:
+            self._mqtt_client.publish(self._config.charging_topic, session.as_dict())
+        await self._cozmo.wake_up_async()
 
     # MQTT Queue Related-------------------------------------------------------------------------------------------------------------------
     def _on_mqtt_message(self, client, topic, payload, qos, properties) -> None:
@@ -242,33 +513,110 @@ class CozmoMqttProgram():
             json_data = json.loads(payload.decode('utf-8'))
             print("Topic: {}".format(topic))
             print("Data: {}".format(json_data))
+            if not isinstance(json_data, dict):
+                # Everything downstream reads fields, a bare string or list would fail in the main loop
+                print("Ignoring message on {} that is not a JSON object".format(topic))
+                return
+            if topic == self._config.mqtt_config_topic:
+                # Config changes apply right away instead of waiting behind robot behaviors
+                self._config.apply_runtime(json_data)
+                return
+            if topic == self._config.mqtt_query_topic:
+                # History queries do not need the robot, they are answered right away
+                asyncio.ensure_future(self._answer_query_async(json_data))
+                return
             topic_data_tuple = (topic, json_data)
             self._queue.put(topic_data_tuple)
         except:
             print("Unexpected error:", sys.exc_info()[0])
 
-    async def _handel_queue_async(self) -> None:
-        if not self._queue.empty():
-            print("Cozmo processing queue")
-            await self._cozmo_do_async(self._process_message_async(self._queue.get()))
-            await self._handel_queue_async()
+    def _handel_queue(self) -> None:
+        print("Cozmo processing queue")
+        while not self._queue.empty():
+            topic_data_tuple = self._queue.get()
+            self._message_count += 1
+            name = "mqtt-{}".format(self._message_count)
+            factory = functools.partial(self._process_message_async, topic_data_tuple)
+            if topic_data_tuple[0] == self._config.mqtt_control_topic:
+                self._prepare_command(topic_data_tuple[1].get("msg"))
+                self._record_event("command", topic_data_tuple[1].get("msg"), data={"source": "mqtt"})
+                self._arbiter.submit(name, BehaviorPriority.Control, factory, retry_on_preempt=True, max_runtime=MESSAGE_MAX_RUNTIME)
+            else:
+                self._submit_notification(topic_data_tuple[0], name, factory)
+
+    def _submit_notification(self, topic: str, name: str, factory) -> None:
+        # A newer notification on the same topic replaces one still waiting, stale ones expire instead of replaying later
+        waiting = self._notifications.get(topic)
+        if waiting is not None and (self._arbiter.current is None or self._arbiter.current.name != waiting):
+            self._arbiter.cancel(waiting)
+        self._notifications[topic] = name
+        self._arbiter.submit(name, BehaviorPriority.Social, factory,
+                             max_delay=self._config.notification_max_delay, max_runtime=MESSAGE_MAX_RUNTIME)
 
     async def _process_message_async(self, topic_data_tuple: tuple) -> None:
         topic = topic_data_tuple[0]
         json_data = topic_data_tuple[1]
-        if topic == MQTT_WEATHER_TOPIC:
+        if topic == self._config.mqtt_weather_topic:
             await self._process_weather_notification_async(json_data)
-        elif topic == MQTT_CONTROL_TOPIC:
+        elif topic == self._config.mqtt_control_topic:
             await self._process_control_msg_async(json_data)
     
+    def submit_command(self, command: str, args: dict) -> Behavior:
+        # Same handlers as the MQTT control topic, the returned behavior tells when the command is done
+        if command not in self._commands:
+            return None
+        self._prepare_command(command)
+        self._record_event("command", command, data={"source": "websocket"})
+        self._message_count += 1
+        return self._arbiter.submit("command-{}".format(self._message_count), BehaviorPriority.Control,
+                                    functools.partial(self._run_command_async, command, args),
+                                    retry_on_preempt=True, max_runtime=MESSAGE_MAX_RUNTIME)
+
+    def _prepare_command(self, command: str) -> None:
+        if command == 'freetime':
+            # Sleeping holds the control slot, so wake up has to cancel it right away
+            self._arbiter.cancel(SLEEP_BEHAVIOR)
+
     async def _process_control_msg_async(self, json_data: dict) -> None:
         if "msg" in json_data:
-            msg = json_data["msg"]
-            if msg == 'sleep':
-                asyncio.create_task(self._cozmo.sleep_async())
-            if msg == 'freetime':
-                await self._cozmo.wake_up_async()
-                self._cozmo_freetime()
+            await self._run_command_async(json_data["msg"], json_data)
+
+    async def _run_command_async(self, command: str, args: dict) -> None:
+        handler = self._commands.get(command)
+        if handler is None:
+            print("Unknown command {}".format(command))
+            return
+        await handler(args)
+
+    async def _say_command_async(self, args: dict) -> None:
+        await self._cozmo.say_async(args["text"], BehaviorPriority.Control)
+
+    async def _image_command_async(self, args: dict) -> None:
+        await self._cozmo.show_image_from_url_async(args["url"])
+
+    async def _lights_command_async(self, args: dict) -> None:
+        if args.get("rgb"):
+            light = Light(Color(rgb=tuple(args["rgb"])))
+            self._cozmo.cubes_change_lights(light)
+            self._cozmo.backpack_change_light(light)
+        else:
+            self._cozmo.turn_cubes_lights_off()
+            self._cozmo.turn_backpack_light_off()
+
+    async def _sleep_command_async(self, args: dict) -> None:
+        self._arbiter.submit(SLEEP_BEHAVIOR, BehaviorPriority.Control, self._sleep_async, retry_on_preempt=True)
+
+    async def _freetime_command_async(self, args: dict) -> None:
+        await self._cozmo.wake_up_async()
+
+    async def _drive_command_async(self, args: dict) -> None:
+        speed = min(max(float(args.get("speed", 50)), -MAX_DRIVE_SPEED), MAX_DRIVE_SPEED)
+        duration = min(max(float(args.get("duration", 1)), 0), MAX_DRIVE_DURATION)
+        await self._cozmo.drive_wheels_async(speed, duration)
+
+    async def _sleep_async(self) -> None:
+        self.cozmo_state = CozmoStates.Sleeping
+        await self._cozmo.sleep_async()
 
     async def _process_weather_notification_async(self, json_data: dict) -> None:
         if "msg" in json_data:
@@ -293,8 +641,8 @@ class CozmoMqttProgram():
             self._cozmo.cubes_change_lights(light)
             self._cozmo.backpack_change_light(light)
         await self._cozmo.random_positive_anim_async()
-        await self._cozmo.say_async(title)
-        await self._cozmo.say_async(msg)
+        self._cozmo.say(title, BehaviorPriority.Social)
+        await self._cozmo.say_async(msg, BehaviorPriority.Social)
         if image_url:
             await self._cozmo.show_image_from_url_async(image_url)
         if rgb:
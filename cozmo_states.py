@@ -1,4 +1,8 @@
+import bisect
+import time
+from collections import Counter
 from enum import Enum
+from typing import Callable, Dict, List
 
 class CozmoStates(Enum):
     ConnectionLost = "Connection lost"
@@ -11,4 +15,120 @@ class CozmoStates(Enum):
     PickedUp = "Picked up"
     OnCliff = "On cliff"
     SawFace = "Saw face"
-    Anouncing = "Anouncing"
\ No newline at end of file
+    Anouncing = "Anouncing"
+
+
+_REACTIONS = {CozmoStates.PickedUp, CozmoStates.OnCliff, CozmoStates.SawFace, CozmoStates.Anouncing}
+_ACTIVE = _REACTIONS | {CozmoStates.Freetime, CozmoStates.GoingToCharge, CozmoStates.Sleeping}
+
+# Connection states can be entered from anywhere, everything else has to be declared here
+TRANSITIONS: Dict[CozmoStates, set] = {
+    CozmoStates.Disconnected: {CozmoStates.Connected},
+    CozmoStates.ConnectionLost: {CozmoStates.Connected},
+    CozmoStates.Connected: _ACTIVE,
+    CozmoStates.Freetime: _ACTIVE,
+    CozmoStates.SawFace: _ACTIVE,
+    CozmoStates.Anouncing: _ACTIVE,
+    CozmoStates.PickedUp: _ACTIVE | {CozmoStates.Charging},
+    CozmoStates.OnCliff: _ACTIVE,
+    CozmoStates.GoingToCharge: {CozmoStates.Charging, CozmoStates.Sleeping, CozmoStates.Freetime,
+                                CozmoStates.PickedUp, CozmoStates.OnCliff},
+    # Freeplay, announcements and reactions all run straight from the charger
+    CozmoStates.Charging: _ACTIVE,
+    CozmoStates.Sleeping: _ACTIVE | {CozmoStates.Charging},
+}
+ALWAYS_ALLOWED = {CozmoStates.ConnectionLost, CozmoStates.Disconnected}
+DWELL_BUCKETS = [1, 5, 15, 60, 300, 900, 3600, 4 * 3600]
+
+Hook = Callable[[CozmoStates, CozmoStates, float], None]
+
+
+class DwellHistogram():
+    def __init__(self, buckets: List[float] = DWELL_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def as_dict(self) -> dict:
+        labels = ["<={}".format(bucket) for bucket in self.buckets] + [">{}".format(self.buckets[-1])]
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 1) if self.count else 0,
+            "max": round(self.max, 1),
+            "buckets": dict(zip(labels, self.counts))
+        }
+
+
+class CozmoStateMachine():
+    def __init__(self, initial: CozmoStates = CozmoStates.Disconnected, on_transition: Hook = None) -> None:
+        self._state = initial
+        self._entered = time.monotonic()
+        self._on_transition = on_transition
+        self._guards: Dict[CozmoStates, List[Callable[[], bool]]] = dict()
+        self._enter_hooks: Dict[CozmoStates, List[Hook]] = dict()
+        self._exit_hooks: Dict[CozmoStates, List[Hook]] = dict()
+        self.dwell_times: Dict[CozmoStates, DwellHistogram] = dict()
+        self.transition_counts: Counter = Counter()
+        self.illegal_transitions: Counter = Counter()
+
+    @property
+    def state(self) -> CozmoStates:
+        return self._state
+
+    @property
+    def time_in_state(self) -> float:
+        return time.monotonic() - self._entered
+
+    def add_guard(self, state: CozmoStates, guard: Callable[[], bool]) -> None:
+        self._guards.setdefault(state, []).append(guard)
+
+    def on_enter(self, state: CozmoStates, hook: Hook) -> None:
+        self._enter_hooks.setdefault(state, []).append(hook)
+
+    def on_exit(self, state: CozmoStates, hook: Hook) -> None:
+        self._exit_hooks.setdefault(state, []).append(hook)
+
+    def is_allowed(self, state: CozmoStates) -> bool:
+        if state not in ALWAYS_ALLOWED and state not in TRANSITIONS.get(self._state, ()):
+            return False
+        return all(guard() for guard in self._guards.get(state, []))
+
+    def transition(self, state: CozmoStates) -> bool:
+        if state == self._state:
+            return False
+        previous = self._state
+        if not self.is_allowed(state):
+            self.illegal_transitions[(previous, state)] += 1
+            print("Illegal state transition {} -> {}".format(previous.value, state.value))
+            return False
+
+        dwell = self.time_in_state
+        self.dwell_times.setdefault(previous, DwellHistogram()).add(dwell)
+        self.transition_counts[(previous, state)] += 1
+        for hook in self._exit_hooks.get(previous, []):
+            hook(previous, state, dwell)
+        self._state = state
+        self._entered = time.monotonic()
+        for hook in self._enter_hooks.get(state, []):
+            hook(previous, state, dwell)
+        if self._on_transition:
+            self._on_transition(previous, state, dwell)
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "dwell_times": {state.value: histogram.as_dict() for state, histogram in self.dwell_times.items()},
+            "transitions": self._format_counts(self.transition_counts),
+            "illegal_transitions": self._format_counts(self.illegal_transitions)
+        }
+
+    def _format_counts(self, counts: Counter) -> Dict[str, int]:
+        return {"{} -> {}".format(a.value, b.value): count for (a, b), count in counts.items()}
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, List
+import cozmo
+from cozmo.objects import LightCube, LightCube1Id, LightCube2Id, LightCube3Id
+from cozmo.world import World
+from config import Config
+
+CUBE_IDS = (LightCube1Id, LightCube2Id, LightCube3Id)
+MAX_RECONNECT_BACKOFF = 60 * 10
+METRICS_WINDOW = 50
+
+
+class CubeManager():
+    def __init__(self, config: Config) -> None:
+        self._config = config
+        self._world: World = None
+        self._cubes: Dict[int, LightCube] = dict()
+        self._wanted = False
+        self._idle = False
+        self._connect_task: asyncio.Task = None
+        self._backoff = config.cube_reconnect_interval
+        self._next_attempt = 0.0
+        self.connect_latencies: Deque[float] = deque(maxlen=METRICS_WINDOW)
+        self.connect_attempts = 0
+        self.connect_failures = 0
+        self.link_drops = 0
+
+    def attach(self, world: World) -> None:
+        self._world = world
+        self._cubes.clear()
+        world.add_event_handler(cozmo.objects.EvtObjectConnectChanged, self._on_connect_changed)
+
+    @property
+    def cubes(self) -> List[LightCube]:
+        return [cube for cube in (self.get_cube(cube_id) for cube_id in CUBE_IDS) if cube is not None]
+
+    @property
+    def missing(self) -> List[int]:
+        return [cube_id for cube_id in CUBE_IDS if not self._is_connected(cube_id)]
+
+    @property
+    def is_idle(self) -> bool:
+        return self._idle
+
+    def get_cube(self, cube_id: int) -> LightCube:
+        # Cached, only cubes the world did not know about yet are looked up again
+        cube = self._cubes.get(cube_id)
+        if cube is None:
+            cube = self._cubes[cube_id] = self._world.get_light_cube(cube_id)
+        return cube
+
+    async def connect_async(self) -> bool:
+        self._wanted = True
+        self._idle = False
+        if not self.missing:
+            return True
+        if self._connect_task is None or self._connect_task.done():
+            self._connect_task = asyncio.ensure_future(self._connect_missing_async())
+        # Several callers can wait for the same pairing attempt
+        return await asyncio.shield(self._connect_task)
+
+    def maintain(self) -> None:
+        # Called every tick, reconnects cubes that dropped their link once the backoff allows it
+        if not self._wanted or self._idle or self._world is None:
+            return
+        if self._connect_task is not None and not self._connect_task.done():
+            return
+        if time.monotonic() < self._next_attempt or not self.missing:
+            return
+        self._connect_task = asyncio.ensure_future(self._connect_missing_async())
+
+    def release(self) -> None:
+        # While charging the cubes are either idled or disconnected, idling keeps the BLE link for wake up
+        if self._config.cube_idle_while_charging:
+            print("Idling cubes")
+            self._idle = True
+            self._lights_off()
+        else:
+            self.disconnect()
+
+    def disconnect(self) -> None:
+        print("Disconecting from cubes")
+        self._wanted = False
+        self._idle = False
+        self._cancel_connect()
+        self._lights_off()
+        self._world.disconnect_from_cubes()
+
+    def stop(self) -> None:
+        self._wanted = False
+        self._cancel_connect()
+
+    def stats(self) -> dict:
+        latencies = list(self.connect_latencies)
+        return {
+            "connected": len(CUBE_IDS) - len(self.missing) if self._world is not None else 0,
+            "idle": self._idle,
+            "connect_latency_last": round(latencies[-1], 2) if latencies else None,
+            "connect_latency_mean": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            "connect_attempts": self.connect_attempts,
+            "connect_failures": self.connect_failures,
+            "link_drops": self.link_drops
+        }
+
+    async def _connect_missing_async(self) -> bool:
+        missing = self.missing
+        print("Connecting to cubes {}".format(missing))
+        self.connect_attempts += 1
+        started = time.monotonic()
+        try:
+            # The SDK pairs all cubes in one request, it leaves already connected cubes alone
+            await self._world.connect_to_cubes()
+        except Exception as e:
+            print("Connecting to cubes failed: {}".format(e))
+        connected = not self.missing
+        if connected:
+            self.connect_latencies.append(time.monotonic() - started)
+            self._backoff = self._config.cube_reconnect_interval
+            print("Cubes connected in {:.1f}s".format(self.connect_latencies[-1]))
+        else:
+            self.connect_failures += 1
+            print("Cubes {} still missing, retrying in {:.0f}s".format(self.missing, self._backoff))
+            self._next_attempt = time.monotonic() + self._backoff
+            self._backoff = min(self._backoff * 2, MAX_RECONNECT_BACKOFF)
+        return connected
+
+    def _cancel_connect(self) -> None:
+        if self._connect_task is not None and not self._connect_task.done():
+            self._connect_task.cancel()
+        self._connect_task = None
+
+    def _is_connected(self, cube_id: int) -> bool:
+        cube = self.get_cube(cube_id)
+        return cube is not None and cube.is_connected
+
+    def _lights_off(self) -> None:
+        print("Turning cubes color off")
+        for cube in self.cubes:
+            if cube.is_connected:
+                cube.set_lights_off()
+
+    def _on_connect_changed(self, evt, obj=None, connected: bool = None, **kwargs) -> None:
+        # Disconnects we asked for are not link drops, maintain reconnects the others
+        if isinstance(obj, LightCube) and not connected and self._wanted:
+            self.link_drops += 1
+            print("Lost connection to cube {}".format(obj.cube_id))
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Deque, List, Tuple
+from config import Config
+
+MAX_BUFFERED = 10000
+MAINTENANCE_INTERVAL = 60 * 60
+QUERY_LIMIT = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (ts REAL NOT NULL, type TEXT NOT NULL, name TEXT, value REAL, data TEXT);
+CREATE INDEX IF NOT EXISTS events_type_ts ON events (type, ts);
+CREATE INDEX IF NOT EXISTS events_ts ON events (ts);
+CREATE TABLE IF NOT EXISTS rollups (
+    bucket REAL NOT NULL, type TEXT NOT NULL, name TEXT NOT NULL DEFAULT '',
+    count INTEGER NOT NULL, total REAL, minimum REAL, maximum REAL,
+    PRIMARY KEY (type, name, bucket));
+CREATE INDEX IF NOT EXISTS rollups_bucket ON rollups (bucket);
+"""
+
+# Raw events older than the cutoff are folded into per bucket rows, a bucket split over two passes just adds up
+ROLLUP = """
+INSERT INTO rollups (bucket, type, name, count, total, minimum, maximum)
+SELECT CAST(ts / :period AS INTEGER) * :period, type, COALESCE(name, ''), COUNT(*), SUM(value), MIN(value), MAX(value)
+FROM events WHERE ts < :cutoff GROUP BY 1, 2, 3
+ON CONFLICT (type, name, bucket) DO UPDATE SET
+    count = count + excluded.count,
+    total = COALESCE(total, 0) + COALESCE(excluded.total, 0),
+    minimum = MIN(COALESCE(minimum, excluded.minimum), COALESCE(excluded.minimum, minimum)),
+    maximum = MAX(COALESCE(maximum, excluded.maximum), COALESCE(excluded.maximum, maximum))
+"""
+
+Event = Tuple[float, str, str, float, str]
+
+
+class EventStore():
+    # All SQLite work happens on one executor thread, the event loop only appends to a buffer
+    def __init__(self, config: Config) -> None:
+        self._config = config
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="events")
+        self._db: sqlite3.Connection = None
+        self._buffer: Deque[Event] = deque(maxlen=MAX_BUFFERED)
+        self._full = asyncio.Event()
+        self._task: asyncio.Task = None
+        self._last_maintenance = 0.0
+        self.written_count = 0
+        self.dropped_count = 0
+        self.flush_count = 0
+
+    def record(self, type: str, name: str = None, value: float = None, data: dict = None) -> None:
+        # Everything is made bindable here, one bad row in a batch would fail the whole write
+        try:
+            event = (time.time(), str(type), None if name is None else str(name), None if value is None else float(value),
+                     None if data is None else json.dumps(data))
+        except (TypeError, ValueError) as e:
+            print("Dropping {} event that can not be stored: {}".format(type, e))
+            self.dropped_count += 1
+            return
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped_count += 1
+        self._buffer.append(event)
+        if len(self._buffer) >= self._config.event_batch_size:
+            self._full.set()
+
+    async def start_async(self) -> None:
+        await self._run_in_executor(self._open)
+        self._task = asyncio.ensure_future(self._run_async())
+        print("Recording events to {}".format(self._config.event_store_file))
+
+    async def stop_async(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._db is not None:
+            try:
+                await self.flush_async()
+            except Exception as e:
+                print("Event store lost {} events on close: {}".format(len(self._buffer), e))
+                self.dropped_count += len(self._buffer)
+                self._buffer.clear()
+            await self._run_in_executor(self._db.close)
+            self._db = None
+        self._executor.shutdown(wait=False)
+
+    async def flush_async(self) -> None:
+        if not self._buffer or self._db is None:
+            return
+        batch = list(self._buffer)
+        self._buffer.clear()
+        self._full.clear()
+        try:
+            await self._run_in_executor(self._write, batch)
+        except Exception:
+            # Kept for the next flush ahead of anything recorded meanwhile, overflow drops the newest
+            overflow = max(len(batch) + len(self._buffer) - MAX_BUFFERED, 0)
+            self._buffer.extendleft(reversed(batch))
+            self.dropped_count += overflow
+            raise
+        self.written_count += len(batch)
+        self.flush_count += 1
+
+    async def query_async(self, type: str = None, since: float = None, until: float = None, limit: int = QUERY_LIMIT) -> List[dict]:
+        await self.flush_async()
+        return await self._run_in_executor(self._query, type, since, until, min(limit or QUERY_LIMIT, QUERY_LIMIT))
+
+    async def rollups_async(self, type: str = None, since: float = None, until: float = None, limit: int = QUERY_LIMIT) -> List[dict]:
+        return await self._run_in_executor(self._query_rollups, type, since, until, min(limit or QUERY_LIMIT, QUERY_LIMIT))
+
+    def stats(self) -> dict:
+        return {
+            "written": self.written_count,
+            "buffered": len(self._buffer),
+            "dropped": self.dropped_count,
+            "flushes": self.flush_count
+        }
+
+    async def _run_async(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._full.wait(), self._config.event_flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush_async()
+                if time.time() - self._last_maintenance > MAINTENANCE_INTERVAL:
+                    self._last_maintenance = time.time()
+                    await self._run_in_executor(self._maintain, self._last_maintenance)
+            except Exception as e:
+                print("Event store error: {}".format(e))
+
+    def _run_in_executor(self, func, *args) -> asyncio.Future:
+        return asyncio.get_event_loop().run_in_executor(self._executor, func, *args)
+
+    # Executor thread ----------------------------------------------------------------
+    def _open(self) -> None:
+        self._db = sqlite3.connect(self._config.event_store_file, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # WAL keeps the database consistent with NORMAL, a crash only loses the last flushes
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    def _write(self, batch: List[Event]) -> None:
+        with self._db:
+            self._db.executemany("INSERT INTO events (ts, type, name, value, data) VALUES (?, ?, ?, ?, ?)", batch)
+
+    def _maintain(self, now: float) -> None:
+        cutoff = now - self._config.event_raw_retention
+        with self._db:
+            self._db.execute(ROLLUP, {"period": self._config.event_rollup_period, "cutoff": cutoff})
+            rolled_up = self._db.execute("DELETE FROM events WHERE ts < ?", (cutoff,)).rowcount
+            expired = self._db.execute("DELETE FROM rollups WHERE bucket < ?", (now - self._config.event_rollup_retention,)).rowcount
+        if rolled_up or expired:
+            print("Event store rolled up {} events and expired {} rollups".format(rolled_up, expired))
+
+    def _where(self, column: str, type: str, since: float, until: float) -> Tuple[str, list]:
+        clauses, params = [], []
+        if type is not None:
+            clauses.append("type = ?")
+            params.append(type)
+        if since is not None:
+            clauses.append("{} >= ?".format(column))
+            params.append(since)
+        if until is not None:
+            clauses.append("{} < ?".format(column))
+            params.append(until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _query(self, type: str, since: float, until: float, limit: int) -> List[dict]:
+        where, params = self._where("ts", type, since, until)
+        rows = self._db.execute("SELECT ts, type, name, value, data FROM events{} ORDER BY ts DESC LIMIT ?".format(where),
+                                params + [limit]).fetchall()
+        return [{"ts": ts, "type": type, "name": name, "value": value, "data": json.loads(data) if data else None}
+                for ts, type, name, value, data in rows]
+
+    def _query_rollups(self, type: str, since: float, until: float, limit: int) -> List[dict]:
+        where, params = self._where("bucket", type, since, until)
+        rows = self._db.execute("SELECT bucket, type, name, count, total, minimum, maximum FROM rollups{} ORDER BY bucket DESC LIMIT ?"
+                                .format(where), params + [limit]).fetchall()
+        return [{"bucket": bucket, "type": type, "name": name or None, "count": count,
+                 "mean": total / count if total is not None and count else None, "min": minimum, "max": maximum}
+                for bucket, type, name, count, total, minimum, maximum in rows]
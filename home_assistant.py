@@ -0,0 +1,70 @@
+import json
+from typing import Any, Dict
+from config import Config
+from mqtt_client import MqttClient
+
+ONLINE = "online"
+OFFLINE = "offline"
+
+# entity id -> (component, discovery settings)
+ENTITIES = {
+    "state": ("sensor", {"name": "State", "icon": "mdi:robot"}),
+    "battery_voltage": ("sensor", {"name": "Battery voltage", "device_class": "voltage",
+                                   "unit_of_measurement": "V", "state_class": "measurement"}),
+    "battery_level": ("sensor", {"name": "Battery", "device_class": "battery",
+                                 "unit_of_measurement": "%", "state_class": "measurement"}),
+    "charging": ("binary_sensor", {"name": "Charging", "device_class": "battery_charging",
+                                   "payload_on": "ON", "payload_off": "OFF"}),
+    "last_face": ("sensor", {"name": "Last seen face", "icon": "mdi:face-recognition"}),
+    "motion": ("binary_sensor", {"name": "Motion", "device_class": "motion",
+                                 "payload_on": "ON", "payload_off": "OFF"}),
+}
+
+
+def availability_topic(config: Config) -> str:
+    return "{}/availability".format(config.ha_base_topic)
+
+
+class HomeAssistantPublisher():
+    def __init__(self, mqtt_client: MqttClient, config: Config) -> None:
+        self._mqtt_client = mqtt_client
+        self._config = config
+        self._values: Dict[str, str] = dict()
+
+    def entity_topic(self, entity: str) -> str:
+        return "{}/{}".format(self._config.ha_base_topic, entity)
+
+    def on_connected(self) -> None:
+        # Also called after the client reconnected, in case the broker lost its retained messages
+        self._publish_discovery()
+        self._mqtt_client.publish(availability_topic(self._config), ONLINE, retain=True)
+        for entity, value in self._values.items():
+            self._mqtt_client.publish(self.entity_topic(entity), value, retain=True)
+
+    def publish_offline(self) -> None:
+        self._mqtt_client.publish(availability_topic(self._config), OFFLINE, retain=True)
+
+    def update(self, entity: str, value: Any, deadband: float = 0) -> None:
+        if isinstance(value, bool):
+            value = "ON" if value else "OFF"
+        elif deadband and entity in self._values and abs(float(self._values[entity]) - value) < deadband:
+            return
+        value = str(value)
+        if self._values.get(entity) == value:
+            return
+        self._values[entity] = value
+        self._mqtt_client.publish(self.entity_topic(entity), value, retain=True)
+
+    def _publish_discovery(self) -> None:
+        node_id = self._config.ha_node_id
+        device = {"identifiers": [node_id], "name": "Cozmo", "manufacturer": "Anki", "model": "Cozmo"}
+        for entity, (component, settings) in ENTITIES.items():
+            payload = dict(settings)
+            payload.update({
+                "unique_id": "{}_{}".format(node_id, entity),
+                "state_topic": self.entity_topic(entity),
+                "availability_topic": availability_topic(self._config),
+                "device": device
+            })
+            topic = "{}/{}/{}/{}/config".format(self._config.ha_discovery_prefix, component, node_id, entity)
+            self._mqtt_client.publish(topic, json.dumps(payload), retain=True)
@@ -1,131 +1,123 @@
+import json
+import os
 import random
-from typing import List
+import string
+import time
+from collections import OrderedDict
+from typing import Dict, List, Set
 from cozmo.faces import Face, FACIAL_EXPRESSION_HAPPY, FACIAL_EXPRESSION_SURPRISED, FACIAL_EXPRESSION_ANGRY, FACIAL_EXPRESSION_SAD
 from cozmo.objects import ObservableObject, Charger, LightCube
 
-HELLO = [
-    "Hello {name}",
-    "Hi {name}, how are you?",
-    "Hello {name}, it's so {good} to see you!",
-    "Hello {name}, it's {good} to see you",
-    "Hey {name}, what's up?",
-    "{name}, there you are. It's {good} to see you!",
-    "Hey {name}, what are you up to today?",
-    "{name}, I'm really happy to see you",
-    "Hey {name}, how are you doing?",
-    "What are you up to today {name}?",
-    "There you are {name}. I missed you",
-    "{name}, I enjoy spending time with you",
-    "I sure like seeing your face {name}",
-    "I see you {name}. Are you having a nice day?",
-    "I love you {name}. You are my favorite human"
-]
-HAPPY = [
-    "You look {happy}, I will be {happy} too!",
-    "{happy} {name}, how cute!",
-    "Your face looks {happy}",
-    "Do I see a {happy} smile on {name} face?"
-]
-SURPRISED = [
-    "You look {surprised}, are you {happy} to see me too?",
-    "{surprised}, why?",
-    "Are you {surprised}?"
-]
-ANGRY = [
-    "You look {angry}, I'd bether run away!",
-    "{angry} {name}, I'd better hide!",
-    "You seem {angry}, did I do something?"
-]
-SAD = [
-    "You look {sad}, why is that? You want to talk about it?",
-    "{sad} {name}, I might cry as well",
-    "You seem {sad}, is there anything I can do to help you?"
-]
-NATURAL = [
-    "You don't seem neither happy, nor sad, nor angry, nor surprised",
-    "What's this facial expression?",
-    "Your face tells me nothing"
-]
-NOT_RECOGNIZED = [
-    "Hello, I don't think I recognize you.",
-    "Do we know eachother?",
-    "Your face doesn't seem familiar",
-    "And who are You?",
-    "Don't think we were introduced, my name is Cozmo, and you are?"
-]
-PICKED_UP = [
-    "Don't drop me",
-    "Don't let me fall",
-    "Please be careful {name}",
-    "Don't let go please",
-    "Weeeee",
-    "I'm in the air",
-    "You are strong {name}",
-    "It's nice to be held",
-    "I like to be held",
-    "Your hands are warm",
-    "Put me down please {name}",
-    "I am flying",
-    "{name}. You are my human",
-    "This is like a cuddle",
-    "I love you"
-]
-CLIFF_DETECTED = [
-    "Wow",
-    "That was {scary}",
-    "Well, that was a little {scary}",
-    "That was super scary {name}",
-    "I thought I was going to fall",
-    "I'm sure glad that I didn't fall {name}",
-    "Wow {name}, that was very scary",
-    "Holy smokes, I was very scared",
-    "I thought I was going to fall",
-    "Holy smokes, that was kind of intense"
-]
-FACE_APPEARED = [
-    "I see a face!",
-    "A face appeared!",
-    "I wonder who's face it that?"
-]
-CUBE_APPEARED = [
-    "I see my cube",
-    "Oh, there's my cube",
-    "That's my cube in front of me",
-    "Hey, I see my cube",
-    "There's my cube",
-    "My cube is over there",
-    "I love looking at my cube",
-    "My cube makes me happy",
-    "Look at my cool cube. Do you see it?",
-    "Hey, look! That's my cube right there! I love it so much"
-]
-CHARGER_APPEARED = [
-    "This is my charger",
-    "I like my charger {name}",
-    "Yummy! I love my charger {name}!",
-    "I found my charger",
-    "ooooo power source!"
-]
-SOMETHING_APPEARED = [
-    "What is this?",
-    "Hey, what is this thing?",
-    "What is this thing in my path?",
-    "I wonder what this thing is.",
-    "This thing in my way is very strange.",
-    "This thing is {weird}.",
-    "Could you move this thing?",
-    "I see something, it's blocking my way.",
-    "There is something blocking my path.",
-    "What is this {weird} thing?",
-    "Hey, what is this thing blocking me?",
-    "The thing in front of me is {weird}.",
-    "I can see that there is something in front of me.",
-    "My proximity sensor detected an obstacle.",
-    "This thing I see in front of me is very {weird}."
-]
+DEFAULT_LOCALE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "locales", "en.json")
+HISTORY_HALF_LIFE = 60 * 60
+MAX_REDRAWS = 3
+MAX_PEOPLE = 100
+MAX_HISTORY_PER_PERSON = 200
+
+HELLO = "hello"
+HAPPY = "happy"
+SURPRISED = "surprised"
+ANGRY = "angry"
+SAD = "sad"
+NATURAL = "natural"
+NOT_RECOGNIZED = "not_recognized"
+PICKED_UP = "picked_up"
+CLIFF_DETECTED = "cliff_detected"
+FACE_APPEARED = "face_appeared"
+CUBE_APPEARED = "cube_appeared"
+CHARGER_APPEARED = "charger_appeared"
+SOMETHING_APPEARED = "something_appeared"
+
+
+class Phrase():
+    __slots__ = ("text", "fields")
+
+    def __init__(self, text: str) -> None:
+        self.text = text
+        self.fields: Set[str] = {field for _, field, _, _ in string.Formatter().parse(text) if field}
+
+
+class ShuffleBag():
+    # Every phrase is used once before any phrase repeats, drawing is O(1)
+    def __init__(self, items: List[Phrase]) -> None:
+        self._items = list(items)
+        self._remaining = 0
+        self._last: Phrase = None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def draw(self) -> Phrase:
+        low = 0
+        if self._remaining == 0:
+            self._remaining = len(self._items)
+            # The phrase that ended the last round is at the front, don't start the new round with it
+            if self._last is not None and len(self._items) > 1:
+                low = 1
+        # Incremental Fisher-Yates, so no draw ever pays for shuffling the whole catalog
+        index = random.randrange(low, self._remaining)
+        self._remaining -= 1
+        self._items[index], self._items[self._remaining] = self._items[self._remaining], self._items[index]
+        self._last = self._items[self._remaining]
+        return self._last
+
+    def put_back(self) -> None:
+        index = random.randint(0, self._remaining)
+        self._items[index], self._items[self._remaining] = self._items[self._remaining], self._items[index]
+        self._remaining += 1
+
+
+class PhraseHistory():
+    def __init__(self, half_life: float = HISTORY_HALF_LIFE) -> None:
+        self.half_life = half_life
+        self._people: Dict[str, Dict[str, float]] = OrderedDict()
+
+    def weight(self, person: str, phrase: Phrase) -> float:
+        # 0 right after the phrase was said to this person, back to 1 as it gets forgotten
+        last_used = self._people.get(person, {}).get(phrase.text)
+        if last_used is None:
+            return 1.0
+        return 1 - 0.5 ** ((time.monotonic() - last_used) / self.half_life)
+
+    def record(self, person: str, phrase: Phrase) -> None:
+        history = self._people.pop(person, None) or OrderedDict()
+        self._people[person] = history
+        if len(self._people) > MAX_PEOPLE:
+            self._people.popitem(last=False)
+        history.pop(phrase.text, None)
+        history[phrase.text] = time.monotonic()
+        if len(history) > MAX_HISTORY_PER_PERSON:
+            history.popitem(last=False)
+
+
+class PhraseSelector():
+    def __init__(self, catalogs: Dict[str, List[str]], history: PhraseHistory) -> None:
+        self._bags = {category: ShuffleBag([Phrase(text) for text in texts]) for category, texts in catalogs.items()}
+        self._history = history
+
+    def choose(self, category: str, person: str = None) -> Phrase:
+        bag = self._bags[category]
+        for attempt in range(MAX_REDRAWS):
+            phrase = bag.draw()
+            # The last draw is used whatever its weight, so it stays out of the bag like any accepted phrase
+            if person is None or attempt == MAX_REDRAWS - 1 or random.random() < self._history.weight(person, phrase):
+                break
+            bag.put_back()
+        if person is not None:
+            self._history.record(person, phrase)
+        return phrase
+
+
+def load_locale(path: str) -> dict:
+    with open(path, encoding="utf-8") as locale_file:
+        return json.load(locale_file)
 
 
 class MessageManager():
+    def __init__(self, locale_file: str = None, history_half_life: float = HISTORY_HALF_LIFE) -> None:
+        locale = load_locale(locale_file or DEFAULT_LOCALE_FILE)
+        self._words: Dict[str, List[str]] = locale["words"]
+        self._selector = PhraseSelector(locale["phrases"], PhraseHistory(history_half_life))
 
     def get_hello_message(self, face: Face = None) -> str:
         return self._message_randomizer(HELLO, face)
@@ -163,38 +155,10 @@ class MessageManager():
             messages = NATURAL
         return self._message_randomizer(messages, face)
 
-    def _message_randomizer(self, messages: List[str], face: Face = None) -> str:
-        message = random.choice(messages)
-        if face and face.name:
-            message = message.replace("{name}", face.name)
-        else:
-            message = message.replace("{name}", "")
-
-        surprised = ["astonished", "bewildered", "dazed", "frightened", "shocked",
-                     "startled", "stunned", "alarmed", "astounded", "confounded", "stupefied"]
-        angry = ["annoyed", "bitter", "enraged", "exasperated", "furious", "heated",
-                 "impassioned", "indignant", "irate", "irritable", "irritated", "offended", "outraged"]
-        sad = ["bitter", "dismal", "heartbroken", "melancholy", "mournful",
-               "pessimistic", "somber", "sorrowful", "sorry", "wistful", "bereaved", "blue"]
-        happy = ["cheerful", "contented", "delighted", "ecstatic", "elated",
-                 "glad", "joyful", "joyous", "jubilant", "merry", "overjoyed", "jolly"]
-        good = ["good", "great", "very good", "wonderful", "lovely", "charming", "nice",
-                "enjoyable", "incredible", "remarkable", "fabulous", "pleasant", "fantastic"]
-        weird = ["weird", "odd", "strange", "very weird", "crazy", "bizarre",
-                 "remarkable", "outlandish", "different", "random", "curious", "freaky"]
-        scary = ["scary", "frightening", "very scary", "terrifying",
-                 "alarming", "daunting", "frightful", "grim", "harrowing", "shocking"]
-        interesting = ["interesting", "weird", "strange", "curious", "fascinating",
-                       "intriguing", "provocative", "thought-provoking", "unusual", "captivating", "amazing"]
-        message = message.format(
-            good=random.choice(good),
-            scary=random.choice(scary),
-            weird=random.choice(weird),
-            interesting=random.choice(interesting),
-            happy=random.choice(happy),
-            sad=random.choice(sad),
-            angry=random.choice(angry),
-            surprised=random.choice(surprised)
-        )
+    def _message_randomizer(self, category: str, face: Face = None) -> str:
+        name = face.name if face and face.name else ""
+        phrase = self._selector.choose(category, name or None)
+        values = {field: random.choice(self._words[field]) for field in phrase.fields if field != "name"}
+        message = phrase.text.format(name=name, **values)
         print("Randomized message: {}".format(message))
         return message
@@ -0,0 +1,184 @@
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Tuple
+from cozmo.robot import Robot
+from config import Config
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+BACKGROUND_RATE = 0.05
+WARMUP_FRAMES = 5
+INITIAL_VARIANCE = 25.0
+THRESHOLD_FLOOR = 8.0
+
+
+class MotionEvent():
+    def __init__(self, area: float, centroid: Tuple[float, float]) -> None:
+        self.timestamp = time.time()
+        self.area = area
+        self.centroid = centroid
+
+    def as_dict(self) -> dict:
+        return {
+            "timestamp": self.timestamp,
+            "area": round(self.area, 3),
+            "centroid": [round(self.centroid[0], 2), round(self.centroid[1], 2)]
+        }
+
+
+def parse_roi(roi: str) -> List[Tuple[float, float, float, float]]:
+    # "x0,y0,x1,y1;x0,y0,x1,y1" in fractions of the frame, empty means the whole frame
+    regions = []
+    for region in (roi or "").split(";"):
+        if region.strip():
+            x0, y0, x1, y1 = (float(value) for value in region.split(","))
+            regions.append((x0, y0, x1, y1))
+    return regions
+
+
+class MotionDetector():
+    def __init__(self, scale: int = 4, sensitivity: float = 3.0, min_area: float = 0.01, roi: str = None) -> None:
+        self.scale = scale
+        self.sensitivity = sensitivity
+        self.min_area = min_area
+        self._regions = parse_roi(roi)
+        self._shape: Tuple[int, int] = None
+        self._relearn = True
+        self._warmup = WARMUP_FRAMES
+
+    @property
+    def nbytes(self) -> int:
+        if self._shape is None:
+            return 0
+        return sum(buffer.nbytes for buffer in (self._small, self._background, self._variance, self._diff,
+                                                 self._scratch, self._mask, self._roi, self._rows, self._cols,
+                                                 self._row_counts, self._col_counts))
+
+    def reset(self) -> None:
+        # The view changed (e.g. Cozmo moved), learn the background again
+        self._relearn = True
+        self._warmup = WARMUP_FRAMES
+
+    def process(self, frame: "np.ndarray") -> MotionEvent:
+        small = frame[::self.scale, ::self.scale]
+        if self._shape != small.shape:
+            self._allocate(small.shape)
+        np.copyto(self._small, small)
+        if self._relearn:
+            self._background[...] = self._small
+            self._variance.fill(INITIAL_VARIANCE)
+            self._relearn = False
+
+        # Adaptive threshold from the per pixel running variance
+        np.sqrt(self._variance, out=self._scratch)
+        self._scratch *= self.sensitivity
+        self._scratch += THRESHOLD_FLOOR
+
+        np.subtract(self._small, self._background, out=self._diff)
+        # The frame itself is not needed any more, reuse its buffer for the absolute difference
+        np.abs(self._diff, out=self._small)
+        np.greater(self._small, self._scratch, out=self._mask)
+        self._mask &= self._roi
+
+        # Running mean and variance, diff still holds the signed difference
+        np.multiply(self._diff, BACKGROUND_RATE, out=self._scratch)
+        self._background += self._scratch
+        np.multiply(self._diff, self._diff, out=self._scratch)
+        self._scratch *= BACKGROUND_RATE
+        self._variance *= 1 - BACKGROUND_RATE
+        self._variance += self._scratch
+
+        if self._warmup > 0:
+            self._warmup -= 1
+            return None
+        changed = int(np.count_nonzero(self._mask))
+        area = changed / self._roi_pixels
+        if area < self.min_area:
+            return None
+        np.sum(self._mask, axis=1, out=self._row_counts)
+        np.sum(self._mask, axis=0, out=self._col_counts)
+        centroid_y = float(np.dot(self._row_counts, self._rows)) / changed
+        centroid_x = float(np.dot(self._col_counts, self._cols)) / changed
+        return MotionEvent(area, (centroid_x, centroid_y))
+
+    def _allocate(self, shape: Tuple[int, int]) -> None:
+        self._shape = shape
+        height, width = shape
+        self._small = np.zeros(shape, dtype=np.float32)
+        self._background = np.zeros(shape, dtype=np.float32)
+        self._variance = np.full(shape, INITIAL_VARIANCE, dtype=np.float32)
+        self._diff = np.zeros(shape, dtype=np.float32)
+        self._scratch = np.zeros(shape, dtype=np.float32)
+        self._mask = np.zeros(shape, dtype=bool)
+        self._roi = np.zeros(shape, dtype=bool)
+        if not self._regions:
+            self._roi.fill(True)
+        for x0, y0, x1, y1 in self._regions:
+            self._roi[int(y0 * height):int(y1 * height), int(x0 * width):int(x1 * width)] = True
+        self._roi_pixels = max(int(np.count_nonzero(self._roi)), 1)
+        # Normalised coordinates for the centroid
+        self._rows = np.linspace(0, 1, height, dtype=np.float32)
+        self._cols = np.linspace(0, 1, width, dtype=np.float32)
+        self._row_counts = np.zeros(height, dtype=np.float32)
+        self._col_counts = np.zeros(width, dtype=np.float32)
+        self.reset()
+
+
+class MotionStage():
+    def __init__(self, config: Config, on_motion: Callable[[MotionEvent], None], fps: Callable[[], float] = None) -> None:
+        if np is None:
+            sys.exit("Cannot import numpy: Do `pip3 install --user numpy` to install")
+        self._config = config
+        self._on_motion = on_motion
+        self._fps = fps or (lambda: config.motion_fps)
+        self._detector = MotionDetector(config.motion_scale, config.motion_sensitivity,
+                                        config.motion_min_area, config.motion_roi)
+        # Outlives run_async, which is cancelled on every lost connection and started again after the reconnect
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="motion")
+        self._last_image_number: int = None
+        self._last_event = 0.0
+        self._was_moving = False
+        self.processed_frames = 0
+
+    @property
+    def motion_active(self) -> bool:
+        return time.monotonic() - self._last_event < self._config.motion_clear_after
+
+    async def run_async(self, robot: Robot) -> None:
+        loop = asyncio.get_event_loop()
+        # A new connection starts from a different view
+        self._was_moving = True
+        while True:
+            await asyncio.sleep(1 / self._fps())
+            if robot.is_moving:
+                self._was_moving = True
+                continue
+            image = robot.world.latest_image
+            if image is None or image.image_number == self._last_image_number:
+                continue
+            self._last_image_number = image.image_number
+            reset, self._was_moving = self._was_moving, False
+            event = await loop.run_in_executor(self._executor, self._process, image.raw_image, reset)
+            self.processed_frames += 1
+            if event is not None:
+                # Continuous motion is a single event until it has been quiet for a while
+                if time.monotonic() - self._last_event > self._config.motion_event_interval:
+                    self._on_motion(event)
+                self._last_event = time.monotonic()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+
+    def _process(self, image, reset: bool) -> MotionEvent:
+        if reset:
+            self._detector.reset()
+        # PIL hands out a new array per frame, only the detector's own buffers are fixed. Cozmo sends
+        # grayscale unless color images are enabled, then the conversion is one more temporary frame.
+        if image.mode != "L":
+            image = image.convert("L")
+        return self._detector.process(np.asarray(image))
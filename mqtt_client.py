@@ -6,14 +6,19 @@ except ImportError:
 
 class MqttClient():
 
-    def __init__(self, broker_url, port, user_name, password, topics, on_message):
+    def __init__(self, broker_url, port, user_name, password, topics, on_message,
+                 will_topic: str = None, will_payload: str = None, on_connected=None):
         self._broker_url = broker_url
         self._port = port
-        self._client = gmqtt.Client("mqtt-client")
+        will_message = None
+        if will_topic is not None:
+            will_message = gmqtt.Message(will_topic, will_payload, retain=True)
+        self._client = gmqtt.Client("mqtt-client", will_message=will_message)
         self._client.set_auth_credentials(user_name, password)
         self._client.on_connect = self._on_connect
         self._client.on_message = on_message
         self._topics = topics
+        self._on_connected = on_connected
 
     async def connect_async(self) -> None:
         await self._client.connect(self._broker_url, self._port)
@@ -21,15 +26,30 @@ class MqttClient():
     async def disconnect_async(self) -> None:
         await self._client.disconnect()
 
-    def publish(self, topic: str, payload: dict) -> None:
+    def set_topics(self, topics) -> None:
+        removed = [topic for topic in self._topics if topic not in topics]
+        added = [topic for topic in topics if topic not in self._topics]
+        self._topics = list(topics)
+        if not self._client.is_connected:
+            return
+        for topic in removed:
+            print("Unsubscribing from {}".format(topic))
+            self._client.unsubscribe(topic)
+        for topic in added:
+            print("Subscribing to {}".format(topic))
+            self._client.subscribe(topic, qos=0)
+
+    def publish(self, topic: str, payload: dict, retain: bool = False) -> None:
         print("Published {} to {}".format(payload, topic))
-        self._client.publish(topic, payload)
+        self._client.publish(topic, payload, retain=retain)
 
     def _on_connect(self, client, flags, rc, properties) -> None:
         print("Connected with result code {}".format(str(rc)))
         for topic in self._topics:
             print("Subscribing to {}".format(topic))
             client.subscribe(topic, qos=0)
+        if self._on_connected is not None:
+            self._on_connected()
 
   
 
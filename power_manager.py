@@ -0,0 +1,106 @@
+import time
+from enum import Enum
+from typing import Dict
+from cozmo.robot import Robot
+from config import Config
+from world_snapshot import WorldSnapshot
+
+
+class PowerProfile(Enum):
+    Active = "active"
+    Idle = "idle"
+    Resting = "resting"
+
+
+# Camera image stream, facial expression estimation, idle pauses the stream between bursts
+SENSING = {
+    PowerProfile.Active: (True, True),
+    PowerProfile.Idle: (True, False),
+    PowerProfile.Resting: (False, False),
+}
+
+
+class PowerManager():
+    def __init__(self, config: Config) -> None:
+        self._config = config
+        self._robot: Robot = None
+        self._profile: PowerProfile = None
+        self._entered = time.monotonic()
+        self._last_activity = time.monotonic()
+        self._camera: bool = None
+        self.seconds_in: Dict[PowerProfile, float] = {profile: 0.0 for profile in PowerProfile}
+        self.switch_count = 0
+
+    @property
+    def profile(self) -> PowerProfile:
+        return self._profile
+
+    @property
+    def loop_period(self) -> float:
+        if self._profile == PowerProfile.Resting:
+            return self._config.resting_loop_period
+        if self._profile == PowerProfile.Idle:
+            return self._config.idle_loop_period
+        return self._config.loop_period
+
+    @property
+    def motion_fps(self) -> float:
+        if self._profile == PowerProfile.Idle:
+            return min(self._config.idle_motion_fps, self._config.motion_fps)
+        return self._config.motion_fps
+
+    def attach(self, robot: Robot) -> None:
+        self._robot = robot
+        self._profile = None
+        self._camera = None
+        self._last_activity = time.monotonic()
+        self.apply(PowerProfile.Active)
+
+    def update(self, snapshot: WorldSnapshot, resting: bool, busy: bool) -> PowerProfile:
+        if busy or snapshot.faces or snapshot.objects or snapshot.is_picked_up or snapshot.is_moving:
+            self._last_activity = snapshot.timestamp
+        if not self._config.power_profiles_enabled:
+            profile = PowerProfile.Active
+        elif resting:
+            profile = PowerProfile.Resting
+        elif snapshot.timestamp - self._last_activity < self._config.idle_after:
+            profile = PowerProfile.Active
+        else:
+            profile = PowerProfile.Idle
+        self.apply(profile)
+        if profile == PowerProfile.Idle:
+            self._set_camera(self._idle_camera_on(snapshot.timestamp))
+        return profile
+
+    def apply(self, profile: PowerProfile) -> None:
+        if profile == self._profile:
+            return
+        now = time.monotonic()
+        if self._profile is not None:
+            self.seconds_in[self._profile] += now - self._entered
+            self.switch_count += 1
+            print("Power profile {} -> {}".format(self._profile.value, profile.value))
+        self._profile = profile
+        self._entered = now
+        camera, expressions = SENSING[profile]
+        self._set_camera(camera)
+        self._robot.enable_facial_expression_estimation(expressions)
+
+    def _idle_camera_on(self, now: float) -> bool:
+        # On for one loop every idle_camera_interval, enough to notice someone coming into view
+        return (now - self._entered) % self._config.idle_camera_interval < self._config.idle_loop_period
+
+    def _set_camera(self, enabled: bool) -> None:
+        if enabled != self._camera:
+            self._camera = enabled
+            self._robot.camera.image_stream_enabled = enabled
+
+    def stats(self) -> dict:
+        seconds = dict(self.seconds_in)
+        if self._profile is not None:
+            seconds[self._profile] += time.monotonic() - self._entered
+        return {
+            "profile": self._profile.value if self._profile is not None else None,
+            "switches": self.switch_count,
+            "seconds": {profile.value: round(value) for profile, value in seconds.items()}
+        }
@@ -0,0 +1,110 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Counter as CounterType, List
+from config import Config
+
+OUTSIDE_TASKS = "loop"
+
+
+def task_name(task: asyncio.Task) -> str:
+    name = task.get_name() if hasattr(task, "get_name") else None
+    if name and not name.startswith("Task-"):
+        return name
+    coro = task.get_coro() if hasattr(task, "get_coro") else getattr(task, "_coro", None)
+    return getattr(coro, "__qualname__", None) or name or "task"
+
+
+class SamplingProfiler():
+    # Samples the event loop thread from a separate thread, cheap enough to leave on for a while on a live robot
+    def __init__(self, config: Config) -> None:
+        self._config = config
+        self._loop: asyncio.AbstractEventLoop = None
+        self._thread_id: int = None
+        self._thread: threading.Thread = None
+        self._stopped = threading.Event()
+        self._stacks: CounterType[str] = Counter()
+        self._beat_at: float = None
+        self._beat_handle: asyncio.Handle = None
+        # Beat the loop missed, longest delay seen and the stack it was running meanwhile
+        self._slow: List = None
+        self.sample_count = 0
+        self.slow_callback_count = 0
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        # Has to be called from the event loop thread
+        self._loop = loop
+        self._thread_id = threading.get_ident()
+        if self._config.slow_callback_duration:
+            # A beat the loop can not run on time means a callback is keeping it busy, no debug mode needed
+            self._beat()
+        print("Profiling for {}s, sampling every {}s".format(self._config.profile_duration, self._config.profile_interval))
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._stop_beat()
+
+    def write(self) -> None:
+        path = self._config.profile_output
+        with open(path, "w") as output:
+            for stack, count in self._stacks.most_common():
+                output.write("{} {}\n".format(stack, count))
+        print("Wrote {} samples to {}, render with flamegraph.pl {} > profile.svg".format(self.sample_count, path, path))
+
+    def _run(self) -> None:
+        deadline = time.monotonic() + self._config.profile_duration
+        while not self._stopped.wait(self._config.profile_interval) and time.monotonic() < deadline:
+            self._sample()
+        self.write()
+        if not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._stop_beat)
+
+    def _beat(self) -> None:
+        self._beat_at = time.monotonic()
+        self._beat_handle = self._loop.call_later(self._config.profile_interval, self._beat)
+
+    def _stop_beat(self) -> None:
+        if self._beat_handle is not None:
+            self._beat_handle.cancel()
+            self._beat_handle = None
+
+    def _check_slow(self, stack: str) -> None:
+        beat_at = self._beat_at
+        if beat_at is None:
+            return
+        if self._slow is not None and beat_at != self._slow[0]:
+            self.slow_callback_count += 1
+            print("Slow callback blocked the loop for at least {:.3f}s in {}".format(self._slow[1], self._slow[2]))
+            self._slow = None
+        delay = time.monotonic() - beat_at - self._config.profile_interval
+        if delay > self._config.slow_callback_duration:
+            if self._slow is None:
+                self._slow = [beat_at, delay, stack]
+            self._slow[1] = delay
+
+    def _sample(self) -> None:
+        frame = sys._current_frames().get(self._thread_id)
+        if frame is None:
+            return
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append("{}:{}".format(os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        frames.reverse()
+        # Reading the current task from another thread is only a dict lookup
+        task = asyncio.current_task(self._loop)
+        frames.insert(0, task_name(task) if task is not None else OUTSIDE_TASKS)
+        stack = ";".join(frames)
+        self._stacks[stack] += 1
+        self.sample_count += 1
+        if self._config.slow_callback_duration:
+            self._check_slow(stack)
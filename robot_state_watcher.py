@@ -0,0 +1,39 @@
+import asyncio
+from typing import Any, Callable, List, Tuple
+import cozmo
+from cozmo.robot import Robot
+
+Predicate = Callable[[Robot], bool]
+
+
+class RobotStateWatcher():
+    def __init__(self) -> None:
+        self._robot: Robot = None
+        self._waiters: List[Tuple[Predicate, asyncio.Future]] = []
+
+    def attach(self, robot: Robot) -> None:
+        self._robot = robot
+        robot.add_event_handler(cozmo.robot.EvtRobotStateUpdated, self._on_robot_state_updated)
+
+    async def wait_for_async(self, predicate: Predicate, timeout: float = None) -> bool:
+        if predicate(self._robot):
+            return True
+        waiter = (predicate, asyncio.get_event_loop().create_future())
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter[1], timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    async def wait_for_change_async(self, key: Callable[[Robot], Any], timeout: float = None) -> bool:
+        current = key(self._robot)
+        return await self.wait_for_async(lambda robot: key(robot) != current, timeout)
+
+    def _on_robot_state_updated(self, evt, robot: Robot = None, **kwargs) -> None:
+        for predicate, future in list(self._waiters):
+            if not future.done() and predicate(self._robot):
+                future.set_result(True)
@@ -0,0 +1,120 @@
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List
+import cozmo
+from cozmo.robot import Robot
+from config import Config
+
+# Robot flag for every reflex
+REFLEXES = {
+    "cliff": "is_cliff_detected",
+    "picked_up": "is_picked_up",
+}
+LATENCY_BUCKETS = [0.025, 0.05, 0.1, 0.25, 0.5, 1.0]
+STOP_CONFIRM_TIMEOUT = 1.0
+LATENCY_WINDOW = 200
+
+
+def _percentile(values: Deque[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * percentile), len(ordered) - 1)]
+
+
+class SafetyReflex():
+    # Runs straight from robot state updates, nothing here waits for the behavior layer or the main loop
+    def __init__(self, config: Config, stop: Callable[[], None]) -> None:
+        self._config = config
+        self._stop = stop
+        # Set by the program, called right after the motors were told to stop and on objective breaches
+        self.on_reflex: Callable[[str], None] = None
+        self.on_breach: Callable[[str, float], None] = None
+        self._robot: Robot = None
+        self._active: Dict[str, bool] = {name: False for name in REFLEXES}
+        # Reflex waiting for the robot to report its motors stopped, and when it was detected
+        self._stopping: str = None
+        self._detected = 0.0
+        self._back_off: asyncio.Task = None
+        self._settled = asyncio.Event()
+        self._settled.set()
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.bucket_counts: List[int] = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.trigger_count = 0
+        self.breach_count = 0
+
+    def attach(self, robot: Robot) -> None:
+        self._robot = robot
+        self._active = {name: getattr(robot, flag) for name, flag in REFLEXES.items()}
+        self._stopping = None
+        self._settled.set()
+        robot.add_event_handler(cozmo.robot.EvtRobotStateUpdated, self._on_robot_state_updated)
+
+    async def wait_settled_async(self) -> None:
+        # Until the robot stopped and backed off, whatever a reaction plays would fight the reflex
+        await self._settled.wait()
+
+    def _on_robot_state_updated(self, evt, robot: Robot = None, **kwargs) -> None:
+        now = time.monotonic()
+        for name, flag in REFLEXES.items():
+            active = getattr(self._robot, flag)
+            if active and not self._active[name]:
+                self._trigger(name, now)
+            self._active[name] = active
+        if self._stopping is not None:
+            stopped = not self._robot.is_moving
+            if stopped or now - self._detected > STOP_CONFIRM_TIMEOUT:
+                self._stopped(now)
+
+    def _trigger(self, name: str, now: float) -> None:
+        print("Safety reflex: {}".format(name))
+        self.trigger_count += 1
+        if self._back_off is not None:
+            self._back_off.cancel()
+            self._back_off = None
+        self._stop()
+        self._settled.clear()
+        self._stopping = name
+        self._detected = now
+        if self.on_reflex is not None:
+            self.on_reflex(name)
+
+    def _stopped(self, now: float) -> None:
+        name, self._stopping = self._stopping, None
+        latency = now - self._detected
+        self.latencies.append(latency)
+        self.bucket_counts[next((i for i, limit in enumerate(LATENCY_BUCKETS) if latency <= limit), len(LATENCY_BUCKETS))] += 1
+        if latency > self._config.reflex_latency_slo:
+            self.breach_count += 1
+            print("Safety reflex {} took {:.0f} ms to stop the motors, over the {:.0f} ms objective".format(
+                name, latency * 1000, self._config.reflex_latency_slo * 1000))
+            if self.on_breach is not None:
+                self.on_breach(name, latency)
+        if name == "cliff" and self._config.cliff_back_off_duration:
+            self._back_off = asyncio.ensure_future(self._back_off_async())
+        else:
+            self._settled.set()
+
+    async def _back_off_async(self) -> None:
+        speed = -abs(self._config.cliff_back_off_speed)
+        duration = self._config.cliff_back_off_duration
+        try:
+            await asyncio.wait_for(self._robot.drive_wheels(speed, speed, duration=duration), duration + self._config.action_timeout)
+        except asyncio.TimeoutError:
+            print("Backing off the cliff timed out")
+        finally:
+            if self._stopping is None:
+                # Not when cancelled by a new reflex that is still stopping the motors
+                self._settled.set()
+
+    def stats(self) -> dict:
+        buckets = {"<={:.0f}ms".format(limit * 1000): count for limit, count in zip(LATENCY_BUCKETS, self.bucket_counts)}
+        buckets[">{:.0f}ms".format(LATENCY_BUCKETS[-1] * 1000)] = self.bucket_counts[-1]
+        return {
+            "triggers": self.trigger_count,
+            "breaches": self.breach_count,
+            "latency_p50_ms": round(_percentile(self.latencies, 0.5) * 1000),
+            "latency_p95_ms": round(_percentile(self.latencies, 0.95) * 1000),
+            "latency_buckets": buckets
+        }
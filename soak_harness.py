@@ -0,0 +1,734 @@
+import argparse
+import asyncio
+import gc
+import json
+import math
+import os
+import random
+import selectors
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+# Runs CozmoMqttProgram against a scripted robot and broker on a virtual clock, e.g.
+#   py soak_harness.py --days 3
+# Needs the Cozmo SDK and Pillow installed, no robot or broker.
+
+REAL_PERF_COUNTER = time.perf_counter
+WARMUP = 2 * 3600
+STATE_UPDATE_INTERVAL = 1
+BATTERY_UPDATE_INTERVAL = 10
+FULL_VOLTAGE = 4.1
+DRAIN_PER_HOUR = 0.3
+CHARGE_PER_HOUR = 0.8
+PEOPLE = ["Anna", "Piotr", "Zosia", "Kuba", None]
+# Scripted pick ups before the random scenario starts, once per held queue policy
+HOLD_CHECK_POLICIES = ("process", "defer")
+HOLD_CHECK_HOLDS = 3
+HOLD_CHECK_SECONDS = 180
+HOLD_CHECK_SEND_AFTER = 10
+REVISIT_INTERVAL = 3600
+
+
+class VirtualClock():
+    def __init__(self, start: float = 1.6e9) -> None:
+        self._start = start
+        # Kept small, so that advancing by tiny timer differences does not get lost in rounding
+        self.elapsed = 1000.0
+
+    def time(self) -> float:
+        return self._start + self.elapsed
+
+    def monotonic(self) -> float:
+        return self.elapsed
+
+    def advance(self, seconds: float) -> None:
+        self.elapsed += max(seconds, 1e-6)
+
+
+class VirtualTime():
+    # Stands in for the time module inside the app's own modules, the standard library keeps real time
+    def __init__(self, clock: VirtualClock) -> None:
+        self.time = clock.time
+        self.monotonic = clock.monotonic
+
+    def __getattr__(self, name: str):
+        return getattr(time, name)
+
+    @classmethod
+    def install(cls, clock: VirtualClock) -> None:
+        app_dir = os.path.dirname(os.path.abspath(__file__))
+        virtual_time = cls(clock)
+        for module in list(sys.modules.values()):
+            module_time = getattr(module, "time", None)
+            if module is not sys.modules[__name__] and (module_time is time or isinstance(module_time, VirtualTime)) \
+                    and os.path.dirname(os.path.abspath(getattr(module, "__file__", None) or os.devnull)) == app_dir:
+                module.time = virtual_time
+
+
+class LatencyHistogram():
+    # Fixed size, so measuring the loop never shows up as retained memory
+    def __init__(self) -> None:
+        self.counts: Counter = Counter()
+        self.count = 0
+        self.max = 0.0
+
+    def add(self, seconds: float) -> None:
+        self.counts[int(4 * math.log2(max(seconds, 1e-6) * 1e6))] += 1
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def percentile(self, percentile: float) -> float:
+        limit = self.count * percentile
+        seen = 0
+        for bucket in sorted(self.counts):
+            seen += self.counts[bucket]
+            if seen >= limit:
+                return 2 ** ((bucket + 1) / 4) / 1e6
+        return 0.0
+
+    def summary(self) -> str:
+        return "p50 {:.2f} ms, p95 {:.2f} ms, p99 {:.2f} ms, max {:.2f} ms".format(
+            self.percentile(0.5) * 1000, self.percentile(0.95) * 1000, self.percentile(0.99) * 1000, self.max * 1000)
+
+
+class VirtualSelector(selectors.DefaultSelector):
+    # Nothing in the harness does real I/O, so waiting for a timeout just moves the clock forward
+    def __init__(self, clock: VirtualClock) -> None:
+        super().__init__()
+        self._clock = clock
+
+    def select(self, timeout: float = None):
+        events = super().select(0)
+        if events or timeout == 0:
+            return events
+        if timeout is None:
+            return super().select(None)
+        self._clock.advance(timeout)
+        return []
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock: VirtualClock) -> None:
+        super().__init__(VirtualSelector(clock))
+        self._clock = clock
+        self.window = LatencyHistogram()
+
+    def time(self) -> float:
+        return self._clock.monotonic()
+
+    def _run_once(self) -> None:
+        start = REAL_PERF_COUNTER()
+        super()._run_once()
+        self.window.add(REAL_PERF_COUNTER() - start)
+
+
+# Fake robot ----------------------------------------------------------------
+class FakeAction():
+    def __init__(self, robot: "FakeRobot", duration: float, on_complete: Callable[[], None] = None) -> None:
+        loop = asyncio.get_event_loop()
+        self._robot = robot
+        self._done = loop.create_future()
+        self._on_complete = on_complete
+        self.is_running = True
+        self.has_failed = False
+        self.failure_reason = (None, None)
+        self._handle = loop.call_later(duration, self._finish)
+        robot.actions.add(self)
+
+    def _finish(self) -> None:
+        self.is_running = False
+        self._robot.actions.discard(self)
+        if self._on_complete is not None:
+            self._on_complete()
+        if not self._done.done():
+            self._done.set_result(None)
+
+    async def wait_for_completed(self, timeout: float = None) -> None:
+        await asyncio.wait_for(asyncio.shield(self._done), timeout)
+
+    def abort(self) -> None:
+        if not self.is_running:
+            return
+        self._handle.cancel()
+        self._on_complete = None
+        self.has_failed = True
+        self.failure_reason = ("cancelled", "Action aborted")
+        self._finish()
+
+
+class FakeCamera():
+    def __init__(self) -> None:
+        self._image_stream_enabled = False
+        self._enabled_at = 0.0
+        self._streamed = 0.0
+        self.color_image_enabled = False
+
+    @property
+    def streamed_seconds(self) -> float:
+        if self._image_stream_enabled:
+            return self._streamed + asyncio.get_event_loop().time() - self._enabled_at
+        return self._streamed
+
+    @property
+    def image_stream_enabled(self) -> bool:
+        return self._image_stream_enabled
+
+    @image_stream_enabled.setter
+    def image_stream_enabled(self, enabled: bool) -> None:
+        self._streamed = self.streamed_seconds
+        self._image_stream_enabled = enabled
+        self._enabled_at = asyncio.get_event_loop().time()
+
+    def enable_auto_exposure(self, *args, **kwargs) -> None:
+        pass
+
+
+class FakeBehavior():
+    def stop(self) -> None:
+        pass
+
+
+class FakePose():
+    def __init__(self, x: float = 0, y: float = 0, angle: float = 0) -> None:
+        self.position = SimpleNamespace(x=x, y=y, z=0)
+        self.rotation = SimpleNamespace(angle_z=SimpleNamespace(radians=angle, degrees=math.degrees(angle)))
+        self.origin_id = 1
+
+    def is_comparable(self, other: "FakePose") -> bool:
+        return self.origin_id == other.origin_id
+
+    def invalidate(self) -> None:
+        pass
+
+
+class FakeFace():
+    _next_id = 1
+
+    def __init__(self, name: str) -> None:
+        self.face_id = FakeFace._next_id
+        FakeFace._next_id += 1
+        self.name = name
+        self.known_expression = random.choice(["happy", "sad", "surprised", "angry", None])
+        self.is_visible = True
+        self.pose = FakePose(300, 0)
+
+    def __repr__(self) -> str:
+        return "FakeFace({}, {})".format(self.face_id, self.name)
+
+
+class FakeCube():
+    def __init__(self, cube_id: int) -> None:
+        self.cube_id = cube_id
+        self.object_id = cube_id
+        self.is_connected = False
+        self.is_visible = False
+        self.pose = FakePose(200, 50 * cube_id)
+
+    def set_lights(self, light) -> None:
+        pass
+
+    def set_lights_off(self) -> None:
+        pass
+
+
+class FakeConnection():
+    def __init__(self, robot: "FakeRobot") -> None:
+        self._robot = robot
+        self.is_connected = True
+
+    def connection_lost(self, exc) -> None:
+        self.is_connected = False
+
+    async def wait_for_robot(self) -> "FakeRobot":
+        return self._robot
+
+    async def shutdown(self) -> None:
+        self.is_connected = False
+
+
+class FakeConnector():
+    # Every connection after the first comes back after a short outage, like a Wi-Fi blip
+    def __init__(self, robot: "FakeRobot") -> None:
+        self._robot = robot
+        self.connections = 0
+
+    async def connect(self, loop, protocol_factory, conn_check):
+        if self.connections:
+            await asyncio.sleep(random.uniform(1, 30))
+            self._robot.reconnect()
+        self.connections += 1
+        return None, self._robot.world.conn
+
+
+class FakeWorld():
+    def __init__(self, robot: "FakeRobot") -> None:
+        from PIL import Image
+        from cozmo.objects import LightCube1Id, LightCube2Id, LightCube3Id
+        self._robot = robot
+        self.conn = FakeConnection(robot)
+        self.handlers: Dict[type, List[Callable]] = dict()
+        self.faces: List[FakeFace] = []
+        self.objects: list = []
+        self.light_cubes = {cube_id: FakeCube(cube_id) for cube_id in (LightCube1Id, LightCube2Id, LightCube3Id)}
+        self.charger = SimpleNamespace(pose=FakePose(40, 0), object_id=99)
+        self.latest_image = SimpleNamespace(raw_image=Image.new("L", (320, 240), 128), image_number=0)
+
+    @property
+    def visible_faces(self):
+        return iter(self.faces)
+
+    @property
+    def visible_objects(self):
+        return iter(self.objects)
+
+    def add_event_handler(self, event: type, handler: Callable) -> None:
+        self.handlers.setdefault(event, []).append(handler)
+
+    def dispatch(self, event: type, **kwargs) -> None:
+        for handler in self.handlers.get(event, []):
+            handler(event, **kwargs)
+
+    def get_light_cube(self, cube_id: int) -> FakeCube:
+        return self.light_cubes.get(cube_id)
+
+    async def connect_to_cubes(self) -> bool:
+        await asyncio.sleep(random.uniform(1, 5))
+        for cube in self.light_cubes.values():
+            cube.is_connected = random.random() > 0.05
+        return all(cube.is_connected for cube in self.light_cubes.values())
+
+    def disconnect_from_cubes(self) -> None:
+        import cozmo
+        for cube in self.light_cubes.values():
+            if cube.is_connected:
+                cube.is_connected = False
+                self.dispatch(cozmo.objects.EvtObjectConnectChanged, obj=cube, connected=False)
+
+    async def wait_for_observed_face(self, timeout: float = None) -> FakeFace:
+        await asyncio.sleep(min(timeout or 5, 5))
+        if not self.faces:
+            raise asyncio.TimeoutError()
+        return self.faces[0]
+
+    async def wait_for_observed_charger(self, timeout: float = None, include_existing: bool = True):
+        await asyncio.sleep(1)
+        self.observe(self.charger)
+        return self.charger
+
+    def observe(self, obj) -> None:
+        # Seeing an object puts it in the robot's current origin
+        import cozmo
+        obj.pose.origin_id = self._robot.pose.origin_id
+        self.dispatch(cozmo.objects.EvtObjectObserved, obj=obj, pose=obj.pose)
+
+    async def wait_for_observed_light_cube(self, timeout: float = None):
+        await asyncio.sleep(2)
+        return next(iter(self.light_cubes.values()))
+
+    async def wait_until_observe_num_objects(self, num: int, object_type=None, timeout: float = None):
+        await asyncio.sleep(2)
+        return list(self.light_cubes.values())[:num]
+
+
+class FakeRobot():
+    # Anything not modelled here is an action that takes a moment and then succeeds
+    def __init__(self, voltage: float = 3.9) -> None:
+        self.actions = set()
+        self.handlers: List[Callable] = []
+        self.world = FakeWorld(self)
+        self.battery_voltage = voltage
+        self.is_on_charger = False
+        self.is_charging = False
+        self.is_picked_up = False
+        self.is_cliff_detected = False
+        self.is_moving = False
+        self.pose = FakePose()
+        self.pose_angle = SimpleNamespace(radians=0.0, degrees=0.0)
+        self.pose_pitch = SimpleNamespace(radians=0.0, degrees=0.0)
+        self.lift_height = SimpleNamespace(distance_mm=32)
+        self.head_angle = SimpleNamespace(degrees=44.5)
+        self.camera = FakeCamera()
+
+    def __getattr__(self, name: str):
+        def start_action(*args, **kwargs) -> FakeAction:
+            return FakeAction(self, random.uniform(0.5, 3))
+        return start_action
+
+    def add_event_handler(self, event: type, handler: Callable) -> None:
+        self.handlers.append(handler)
+
+    def reconnect(self) -> None:
+        # The SDK builds a new world for every connection, nothing stays subscribed
+        self.handlers = []
+        self.world.handlers = dict()
+        self.world.conn = FakeConnection(self)
+
+    def dispatch_state(self) -> None:
+        import cozmo
+        for handler in self.handlers:
+            handler(cozmo.robot.EvtRobotStateUpdated, robot=self)
+
+    def say_text(self, text: str, *args, **kwargs) -> FakeAction:
+        return FakeAction(self, 0.3 * len(text.split()))
+
+    def play_anim_trigger(self, trigger, *args, **kwargs) -> FakeAction:
+        return FakeAction(self, random.uniform(1, 4))
+
+    def start_behavior(self, behavior_type) -> FakeBehavior:
+        return FakeBehavior()
+
+    def drive_off_charger_contacts(self, *args, **kwargs) -> FakeAction:
+        return FakeAction(self, 2, self._left_charger)
+
+    def _left_charger(self) -> None:
+        self.is_on_charger = False
+        self.is_charging = False
+        self.dispatch_state()
+
+    async def backup_onto_charger(self, max_drive_time: float = 3) -> None:
+        await asyncio.sleep(max_drive_time)
+        self.is_on_charger = True
+        self.is_charging = self.battery_voltage < FULL_VOLTAGE
+        self.dispatch_state()
+
+    async def drive_wheels(self, left: float, right: float, duration: float = None, *args, **kwargs) -> None:
+        await asyncio.sleep(duration or 0)
+
+    def stop_all_motors(self) -> None:
+        pass
+
+    def abort_all_actions(self, log_abort_messages: bool = False) -> None:
+        for action in list(self.actions):
+            action.abort()
+
+    async def wait_for_all_actions_completed(self) -> None:
+        while self.actions:
+            await asyncio.sleep(0.1)
+
+    def set_needs_levels(self, *args, **kwargs) -> None:
+        pass
+
+
+# Fake broker ----------------------------------------------------------------
+class FakeBroker():
+    def __init__(self, on_connected: Callable[[], None]) -> None:
+        self._on_connected = on_connected
+        self.published = 0
+        self.is_connected = False
+
+    async def connect_async(self) -> None:
+        self.is_connected = True
+        self._on_connected()
+
+    async def disconnect_async(self) -> None:
+        self.is_connected = False
+
+    def set_topics(self, topics: List[str]) -> None:
+        pass
+
+    def publish(self, topic: str, payload, retain: bool = False) -> None:
+        self.published += 1
+
+
+# Scenario ----------------------------------------------------------------
+class Soak():
+    def __init__(self, args, clock: VirtualClock, loop: VirtualTimeLoop) -> None:
+        from config import Config
+        from cozmo_mqtt_program import CozmoMqttProgram
+        from home_assistant import HomeAssistantPublisher
+        self._args = args
+        self._clock = clock
+        self._loop = loop
+        self._out = sys.__stdout__
+        # Events go to a throwaway database, with a short raw retention so rollups run during the soak
+        self.config = Config(os.path.join(os.path.dirname(os.path.abspath(__file__)), "soak-harness-config.json"),
+                             {"camera_stream_port": None, "motion_detection_enabled": False, "profile_duration": None,
+                              "animation_catalog_file": None, "event_store_file": os.path.join(tempfile.mkdtemp(), "soak-events.db"),
+                              "event_raw_retention": 6 * 3600})
+        self.robot = FakeRobot()
+        self.program = CozmoMqttProgram(self.config)
+        self.broker = FakeBroker(self.program._on_mqtt_connected)
+        self.program._mqtt_client = self.broker
+        self.program._home_assistant = HomeAssistantPublisher(self.broker, self.config)
+        self._process_message_async = self.program._process_message_async
+        self.program._process_message_async = self._timed_process_message_async
+        self.queue_latency = LatencyHistogram()
+        self.held_queue_latency = LatencyHistogram()
+        self.hold_check_latency = {policy: LatencyHistogram() for policy in HOLD_CHECK_POLICIES}
+        self.notifications = 0
+        self.windows: List[str] = []
+        self.failures: List[str] = []
+
+    def report(self, message: str) -> None:
+        print(message, file=self._out, flush=True)
+
+    async def run_async(self) -> None:
+        from connection_supervisor import ConnectionSupervisor
+        self.connection = ConnectionSupervisor(self.config, FakeConnector(self.robot))
+        program_task = asyncio.ensure_future(self.program.run_async(self.connection))
+        scenario = [asyncio.ensure_future(coro) for coro in (self._state_updates_async(), self._battery_async())]
+        try:
+            await self._hold_check_async()
+            scenario += [asyncio.ensure_future(coro) for coro in (
+                self._faces_async(), self._objects_async(), self._revisits_async(), self._handling_async(),
+                self._notifications_async(), self._nights_async(), self._cube_drops_async(), self._connection_drops_async())]
+            await self._measure_async()
+        finally:
+            for task in scenario:
+                task.cancel()
+            # Stopped while connected, like Ctrl+C on the real robot, the program has to dock before it closes the
+            # connection. No timeout, virtual time would run out before the event store's thread finishes.
+            self.program.stop()
+            await asyncio.wait([program_task])
+            if not self.robot.is_on_charger:
+                self.failures.append("program stopped without docking Cozmo")
+
+    async def _hold_check_async(self) -> None:
+        # Same pick ups and messages for both policies, nothing random happens until they are done
+        from cozmo_states import CozmoStates
+        policy = self.config.held_queue_policy
+        for check_policy in HOLD_CHECK_POLICIES:
+            self.config.apply_runtime({"held_queue_policy": check_policy})
+            latency = self.hold_check_latency[check_policy]
+            for _ in range(HOLD_CHECK_HOLDS):
+                # Connecting and announcing take varying time, every pick up starts from freetime
+                while self.program.cozmo_state != CozmoStates.Freetime:
+                    await asyncio.sleep(1)
+                await asyncio.sleep(HOLD_CHECK_SEND_AFTER)
+                self.robot.is_picked_up = True
+                self.robot.dispatch_state()
+                await asyncio.sleep(HOLD_CHECK_SEND_AFTER)
+                expected = latency.count + 2
+                # Command first, a notification preempted by a command is dropped rather than replayed
+                self._send(self.config.mqtt_control_topic, {"msg": "say", "text": "Put me down", "soak_check": check_policy})
+                self._send(self.config.mqtt_weather_topic, {"msg": "It is clear", "soak_check": check_policy})
+                await asyncio.sleep(HOLD_CHECK_SECONDS - HOLD_CHECK_SEND_AFTER)
+                self.robot.pose.origin_id += 1
+                self.robot.is_picked_up = False
+                self.robot.dispatch_state()
+                for _ in range(HOLD_CHECK_SECONDS):
+                    if latency.count >= expected:
+                        break
+                    await asyncio.sleep(1)
+            self.report("Hold check with held_queue_policy {}: p95 {:.1f}s ({} of {} messages)".format(
+                check_policy, latency.percentile(0.95), latency.count, 2 * HOLD_CHECK_HOLDS))
+        self.config.apply_runtime({"held_queue_policy": policy})
+        self._check_holds()
+
+    def _check_holds(self) -> None:
+        held = HOLD_CHECK_SECONDS - HOLD_CHECK_SEND_AFTER
+        for policy, latency in self.hold_check_latency.items():
+            if latency.count < 2 * HOLD_CHECK_HOLDS:
+                self.failures.append("hold check with {}: {} of {} messages handled".format(policy, latency.count, 2 * HOLD_CHECK_HOLDS))
+                continue
+            p95 = latency.percentile(0.95)
+            # Processed while still held, or deferred until Cozmo is put down and handled soon after
+            low, high = (0, min(held, self._args.held_latency_budget)) if policy == "process" else \
+                (held, held + self._args.held_latency_budget)
+            if not low <= p95 <= high:
+                self.failures.append("hold check with {}: queue latency while held p95 {:.1f}s, expected {}s to {}s".format(
+                    policy, p95, low, high))
+
+    async def _measure_async(self) -> None:
+        await asyncio.sleep(WARMUP)
+        gc.collect()
+        tracemalloc.start(1)
+        baseline = tracemalloc.take_snapshot()
+        baseline_size = tracemalloc.get_traced_memory()[0]
+        self._loop.window = LatencyHistogram()
+        first_window: LatencyHistogram = None
+        interval = self._args.snapshot_hours * 3600
+        windows = max(int(self._args.days * 24 * 3600 / interval), 1)
+        for window in range(1, windows + 1):
+            await asyncio.sleep(interval)
+            gc.collect()
+            snapshot = tracemalloc.take_snapshot()
+            growth = (tracemalloc.get_traced_memory()[0] - baseline_size) / 1024 / 1024
+            latency, self._loop.window = self._loop.window, LatencyHistogram()
+            first_window = first_window or latency
+            self.report("After {:.1f}h: retained +{:.2f} MB, loop iterations {}, {}, queue latency p95 {:.1f}s, while held p95 {:.1f}s ({})".format(
+                window * interval / 3600, growth, latency.count, latency.summary(), self.queue_latency.percentile(0.95),
+                self.held_queue_latency.percentile(0.95), self.held_queue_latency.count))
+            for stat in snapshot.compare_to(baseline, "lineno")[:self._args.top]:
+                self.report("    {}".format(stat))
+        self._check(growth, first_window, latency)
+        tracemalloc.stop()
+
+    def _check(self, growth: float, first: LatencyHistogram, last: LatencyHistogram) -> None:
+        if growth > self._args.memory_budget:
+            self.failures.append("retained memory grew {:.2f} MB, budget {} MB".format(growth, self._args.memory_budget))
+        if last.percentile(0.99) > self._args.latency_budget / 1000:
+            self.failures.append("loop iteration p99 {:.2f} ms, budget {} ms".format(last.percentile(0.99) * 1000, self._args.latency_budget))
+        drift = last.percentile(0.95) / max(first.percentile(0.95), 1e-6)
+        if drift > self._args.latency_drift:
+            self.failures.append("loop iteration p95 drifted {:.1f}x, budget {}x".format(drift, self._args.latency_drift))
+        if self.held_queue_latency.percentile(0.95) > self._args.held_latency_budget:
+            self.failures.append("queue latency while held p95 {:.1f}s, budget {}s".format(
+                self.held_queue_latency.percentile(0.95), self._args.held_latency_budget))
+        if self.queue_latency.percentile(0.95) > self._args.queue_latency_budget:
+            self.failures.append("queue latency p95 {:.1f}s, budget {}s".format(self.queue_latency.percentile(0.95), self._args.queue_latency_budget))
+        if self.program._cozmo.spatial.searches_avoided == 0:
+            self.failures.append("no look around was avoided by remembering where a cube was")
+        illegal = self.program._state_machine.illegal_transitions
+        if illegal:
+            self.failures.append("{} illegal state transitions: {}".format(
+                sum(illegal.values()), self.program._state_machine.stats()["illegal_transitions"]))
+
+    async def _timed_process_message_async(self, topic_data_tuple: tuple) -> None:
+        sent = topic_data_tuple[1].get("soak_sent")
+        check = topic_data_tuple[1].get("soak_check")
+        if check in self.hold_check_latency:
+            self.hold_check_latency[check].add(self._clock.time() - sent)
+        elif sent is not None:
+            self.queue_latency.add(self._clock.time() - sent)
+            if topic_data_tuple[1].get("soak_held"):
+                self.held_queue_latency.add(self._clock.time() - sent)
+        await self._process_message_async(topic_data_tuple)
+
+    def _send(self, topic: str, payload: dict) -> None:
+        payload["soak_sent"] = self._clock.time()
+        self.program._on_mqtt_message(self.broker, topic, json.dumps(payload).encode("utf-8"), 0, None)
+
+    async def _state_updates_async(self) -> None:
+        while True:
+            await asyncio.sleep(STATE_UPDATE_INTERVAL)
+            self.robot.dispatch_state()
+
+    async def _battery_async(self) -> None:
+        while True:
+            await asyncio.sleep(BATTERY_UPDATE_INTERVAL)
+            hours = BATTERY_UPDATE_INTERVAL / 3600
+            if self.robot.is_charging:
+                self.robot.battery_voltage = min(self.robot.battery_voltage + CHARGE_PER_HOUR * hours, FULL_VOLTAGE)
+                if self.robot.battery_voltage >= FULL_VOLTAGE:
+                    self.robot.is_charging = False
+                    self.robot.dispatch_state()
+            elif not self.robot.is_on_charger:
+                self.robot.battery_voltage -= DRAIN_PER_HOUR * hours
+
+    async def _faces_async(self) -> None:
+        while True:
+            await asyncio.sleep(random.expovariate(1 / 600))
+            # Strangers get a new face every time, like the SDK does for faces it can't recognise
+            self.robot.world.faces = [FakeFace(random.choice(PEOPLE))]
+            await asyncio.sleep(random.uniform(5, 60))
+            self.robot.world.faces = []
+
+    async def _objects_async(self) -> None:
+        while True:
+            await asyncio.sleep(random.expovariate(1 / 900))
+            seen = random.choice(list(self.robot.world.light_cubes.values()) + [self.robot.world.charger])
+            self.robot.world.observe(seen)
+            if seen is self.robot.world.charger:
+                continue
+            cube = seen
+            self.robot.world.objects = [cube]
+            await asyncio.sleep(random.uniform(5, 120))
+            self.robot.world.objects = []
+
+    async def _revisits_async(self) -> None:
+        from behavior_priority import BehaviorPriority
+        while True:
+            await asyncio.sleep(REVISIT_INTERVAL)
+            # Sees a cube, wanders off and comes back to the same spot, where it looks for a cube to play with
+            position = self.robot.pose.position
+            home = (position.x, position.y)
+            self.robot.world.observe(random.choice(list(self.robot.world.light_cubes.values())))
+            position.x, position.y = random.uniform(-1000, 1000), random.uniform(-1000, 1000)
+            await asyncio.sleep(random.uniform(30, 300))
+            position.x, position.y = home
+            self.program._arbiter.submit("soak-find-cube", BehaviorPriority.Ambient, self.program._cozmo.try_to_find_cube_async)
+
+    async def _handling_async(self) -> None:
+        while True:
+            await asyncio.sleep(random.expovariate(1 / 3600))
+            flag = random.choice(("is_picked_up", "is_cliff_detected"))
+            setattr(self.robot, flag, True)
+            self.robot.dispatch_state()
+            hold = random.uniform(2, self._args.max_hold)
+            resting = self.program._cozmo.is_sleeping or self.program._arbiter.is_scheduled("charge")
+            if hold > 60 and flag == "is_picked_up" and not resting:
+                # Kids carry Cozmo around for minutes, messages should not wait for them to put it down
+                await asyncio.sleep(random.uniform(5, 30))
+                self._send(self.config.mqtt_weather_topic, {"msg": "It is clear", "soak_held": True})
+                self._send(self.config.mqtt_control_topic, {"msg": "say", "text": "Put me down", "soak_held": True})
+                hold -= 30
+            await asyncio.sleep(hold)
+            if flag == "is_picked_up":
+                # Put down somewhere else, whatever the robot knew about object poses is in the old origin
+                self.robot.pose.origin_id += 1
+            setattr(self.robot, flag, False)
+            self.robot.dispatch_state()
+
+    async def _notifications_async(self) -> None:
+        while True:
+            await asyncio.sleep(random.expovariate(1 / 1800))
+            self.notifications += 1
+            self._send(self.config.mqtt_weather_topic, {"msg": random.choice(["It is clear", "It is cloudy", "Rain later"])})
+
+    async def _nights_async(self) -> None:
+        while True:
+            await asyncio.sleep(16 * 3600)
+            self._send(self.config.mqtt_control_topic, {"msg": "sleep"})
+            await asyncio.sleep(8 * 3600)
+            self._send(self.config.mqtt_control_topic, {"msg": "freetime"})
+
+    async def _connection_drops_async(self) -> None:
+        while True:
+            await asyncio.sleep(random.expovariate(1 / (12 * 3600)))
+            self.robot.world.conn.connection_lost(None)
+
+    async def _cube_drops_async(self) -> None:
+        import cozmo
+        while True:
+            await asyncio.sleep(random.expovariate(1 / (4 * 3600)))
+            cube = random.choice(list(self.robot.world.light_cubes.values()))
+            if cube.is_connected:
+                cube.is_connected = False
+                self.robot.world.dispatch(cozmo.objects.EvtObjectConnectChanged, obj=cube, connected=False)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Long run memory and latency soak test on a virtual clock")
+    parser.add_argument("--days", type=float, default=1)
+    parser.add_argument("--snapshot-hours", type=float, default=6)
+    parser.add_argument("--memory-budget", type=float, default=2.0, help="Allowed retained growth in MB")
+    parser.add_argument("--latency-budget", type=float, default=50, help="Allowed p99 loop iteration in ms")
+    parser.add_argument("--latency-drift", type=float, default=2.0, help="Allowed growth of the p95 loop iteration")
+    parser.add_argument("--queue-latency-budget", type=float, default=300, help="Allowed p95 message queue latency in s")
+    parser.add_argument("--max-hold", type=float, default=300, help="Longest pick up or cliff in s")
+    parser.add_argument("--held-latency-budget", type=float, default=60,
+                        help="Allowed p95 latency in s of messages sent while Cozmo is held")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--top", type=int, default=5, help="Allocation sites to show per snapshot")
+    parser.add_argument("--verbose", action="store_true", help="Keep the program's own output")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    clock = VirtualClock()
+    loop = VirtualTimeLoop(clock)
+    asyncio.set_event_loop(loop)
+    if not args.verbose:
+        sys.stdout = open(os.devnull, "w")
+    import cozmo_mqtt_program
+    VirtualTime.install(clock)
+    soak = Soak(args, clock, loop)
+    started = REAL_PERF_COUNTER()
+    loop.run_until_complete(soak.run_async())
+    soak.report("Simulated {} days in {:.0f}s, {} notifications, {} messages published, connection {}, reflex {}, spatial {}".format(
+        args.days, REAL_PERF_COUNTER() - started, soak.notifications, soak.broker.published, soak.connection.stats(),
+        soak.program._cozmo.reflex.stats(), soak.program._cozmo.spatial.stats()))
+    if soak.failures:
+        for failure in soak.failures:
+            soak.report("FAILED: " + failure)
+        sys.exit(1)
+    soak.report("PASSED")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+import math
+import time
+from typing import Dict, Iterator, List, Set, Tuple
+import cozmo
+from cozmo.objects import Charger, CustomObject, LightCube, ObservableObject
+from cozmo.robot import Robot
+from config import Config
+
+CUBE = "cube"
+CHARGER = "charger"
+CUSTOM = "custom"
+OBJECT = "object"
+
+Cell = Tuple[int, int]
+
+
+def object_kind(obj: ObservableObject) -> str:
+    if isinstance(obj, LightCube) or hasattr(obj, "cube_id"):
+        return CUBE
+    if isinstance(obj, Charger):
+        return CHARGER
+    if isinstance(obj, CustomObject):
+        return CUSTOM
+    return OBJECT
+
+
+class Landmark():
+    __slots__ = ("obj", "kind", "x", "y", "angle_z", "origin_id", "seen")
+
+    def __init__(self, obj: ObservableObject, kind: str, pose: cozmo.util.Pose) -> None:
+        self.obj = obj
+        self.kind = kind
+        self.x = pose.position.x
+        self.y = pose.position.y
+        self.angle_z = pose.rotation.angle_z.radians
+        self.origin_id = pose.origin_id
+        self.seen = time.monotonic()
+
+    def distance_to(self, x: float, y: float) -> float:
+        return math.hypot(self.x - x, self.y - y)
+
+    def __repr__(self) -> str:
+        return "Landmark({} at {:.0f},{:.0f})".format(self.obj, self.x, self.y)
+
+
+class SpatialMemory():
+    # Last known object poses in a grid per pose origin, only the robot's current origin can be used
+    def __init__(self, config: Config) -> None:
+        self._config = config
+        self._robot: Robot = None
+        self._origin_id: int = None
+        self._landmarks: Dict[int, Landmark] = dict()
+        self._grid: Dict[Cell, Set[int]] = dict()
+        self.invalidation_count = 0
+        self.hit_count = 0
+        # Counted by the callers, only where a look around would have started otherwise
+        self.searches_avoided = 0
+
+    def attach(self, robot: Robot) -> None:
+        # Poses from an earlier connection are in an origin this one does not know about
+        self._robot = robot
+        self._clear()
+        self._origin_id = robot.pose.origin_id
+        robot.add_event_handler(cozmo.robot.EvtRobotStateUpdated, self._on_robot_state_updated)
+        robot.world.add_event_handler(cozmo.objects.EvtObjectObserved, self._on_object_observed)
+
+    def pose_of(self, obj: ObservableObject) -> Landmark:
+        landmark = self._landmarks.get(obj.object_id)
+        return self._hit(landmark if landmark is not None and self._is_reliable(landmark, time.monotonic()) else None)
+
+    def nearest(self, kind: str = None) -> Landmark:
+        if not self._grid:
+            return None
+        x, y = self._robot.pose.position.x, self._robot.pose.position.y
+        center = self._cell(x, y)
+        now = time.monotonic()
+        last_ring = max(max(abs(cell[0] - center[0]), abs(cell[1] - center[1])) for cell in self._grid)
+        best, best_distance = None, math.inf
+        for ring in range(last_ring + 1):
+            # Cells further out can not hold anything closer than what was found
+            if (ring - 1) * self._config.spatial_cell_size > best_distance:
+                break
+            for landmark in self._landmarks_in(self._ring(center, ring)):
+                if (kind is None or landmark.kind == kind) and self._is_reliable(landmark, now):
+                    distance = landmark.distance_to(x, y)
+                    if distance < best_distance:
+                        best, best_distance = landmark, distance
+        return self._hit(best)
+
+    def within(self, radius: float, kind: str = None) -> List[Landmark]:
+        x, y = self._robot.pose.position.x, self._robot.pose.position.y
+        low, high = self._cell(x - radius, y - radius), self._cell(x + radius, y + radius)
+        cells = ((cx, cy) for cx in range(low[0], high[0] + 1) for cy in range(low[1], high[1] + 1))
+        now = time.monotonic()
+        found = [landmark for landmark in self._landmarks_in(cells)
+                 if (kind is None or landmark.kind == kind) and self._is_reliable(landmark, now) and landmark.distance_to(x, y) <= radius]
+        return sorted(found, key=lambda landmark: landmark.distance_to(x, y))
+
+    def known(self, kind: str = None) -> List[Landmark]:
+        x, y = self._robot.pose.position.x, self._robot.pose.position.y
+        now = time.monotonic()
+        found = [landmark for landmark in self._landmarks.values()
+                 if (kind is None or landmark.kind == kind) and self._is_reliable(landmark, now)]
+        return sorted(found, key=lambda landmark: landmark.distance_to(x, y))
+
+    def stats(self) -> dict:
+        return {
+            "landmarks": len(self._landmarks),
+            "invalidations": self.invalidation_count,
+            "hits": self.hit_count,
+            "searches_avoided": self.searches_avoided
+        }
+
+    def _on_object_observed(self, evt, obj: ObservableObject = None, pose: cozmo.util.Pose = None, **kwargs) -> None:
+        pose = pose or getattr(obj, "pose", None)
+        if obj is None or pose is None or pose.origin_id != self._origin_id:
+            return
+        previous = self._landmarks.get(obj.object_id)
+        if previous is not None:
+            self._grid_remove(previous)
+        kind = CHARGER if obj is self._robot.world.charger else object_kind(obj)
+        landmark = self._landmarks[obj.object_id] = Landmark(obj, kind, pose)
+        self._grid.setdefault(self._cell(landmark.x, landmark.y), set()).add(obj.object_id)
+
+    def _on_robot_state_updated(self, evt, robot: Robot = None, **kwargs) -> None:
+        origin_id = self._robot.pose.origin_id
+        if origin_id != self._origin_id:
+            # Delocalized, e.g. picked up, nothing remembered lines up with the robot any more
+            if self._landmarks:
+                print("Cozmo delocalized, forgetting {} object poses".format(len(self._landmarks)))
+                self.invalidation_count += 1
+            self._clear()
+            self._origin_id = origin_id
+
+    def _hit(self, landmark: Landmark) -> Landmark:
+        if landmark is not None:
+            self.hit_count += 1
+        return landmark
+
+    def _is_reliable(self, landmark: Landmark, now: float) -> bool:
+        if landmark.origin_id != self._origin_id:
+            return False
+        max_age = None if landmark.kind == CHARGER else self._config.spatial_max_age
+        if max_age is not None and now - landmark.seen > max_age:
+            return False
+        # The SDK invalidates poses on its own too, e.g. when a cube is moved while out of view
+        pose = getattr(landmark.obj, "pose", None)
+        return pose is not None and pose.is_comparable(self._robot.pose)
+
+    def _cell(self, x: float, y: float) -> Cell:
+        size = self._config.spatial_cell_size
+        return (math.floor(x / size), math.floor(y / size))
+
+    def _ring(self, center: Cell, ring: int) -> Iterator[Cell]:
+        cx, cy = center
+        if ring == 0:
+            yield center
+            return
+        for dx in range(-ring, ring + 1):
+            yield (cx + dx, cy - ring)
+            yield (cx + dx, cy + ring)
+        for dy in range(-ring + 1, ring):
+            yield (cx - ring, cy + dy)
+            yield (cx + ring, cy + dy)
+
+    def _landmarks_in(self, cells: Iterator[Cell]) -> Iterator[Landmark]:
+        for cell in cells:
+            for object_id in self._grid.get(cell, ()):
+                yield self._landmarks[object_id]
+
+    def _grid_remove(self, landmark: Landmark) -> None:
+        cell = self._cell(landmark.x, landmark.y)
+        ids = self._grid.get(cell)
+        if ids is not None:
+            ids.discard(landmark.obj.object_id)
+            if not ids:
+                del self._grid[cell]
+
+    def _clear(self) -> None:
+        self._landmarks.clear()
+        self._grid.clear()
@@ -0,0 +1,174 @@
+import asyncio
+import sys
+import time
+from collections import deque
+from typing import Callable, Deque, List
+import cozmo
+from behavior_priority import BehaviorPriority
+
+MAX_MERGED_LENGTH = 200
+BUSY_RETRY_DELAY = 0.2
+METRICS_WINDOW = 200
+
+
+class Utterance():
+    def __init__(self, text: str, priority: BehaviorPriority) -> None:
+        self.text = text
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.done = asyncio.get_event_loop().create_future()
+
+    def finish(self, spoken: bool) -> None:
+        if not self.done.done():
+            self.done.set_result(spoken)
+
+
+def _percentile(values: Deque[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * percentile), len(ordered) - 1)]
+
+
+class SpeechQueue():
+    def __init__(self, start_say: Callable[[str], cozmo.action.Action], timeout: Callable[[], float]) -> None:
+        self._start_say = start_say
+        self._timeout = timeout
+        self._pending: List[Utterance] = []
+        self._speaking: List[Utterance] = []
+        self._action: cozmo.action.Action = None
+        self._wakeup = asyncio.Event()
+        self._worker: asyncio.Task = None
+        self._last_end: float = None
+        self.latencies: Deque[float] = deque(maxlen=METRICS_WINDOW)
+        self.gaps: Deque[float] = deque(maxlen=METRICS_WINDOW)
+        self.spoken_count = 0
+        self.merged_count = 0
+        self.deduplicated_count = 0
+        self.interrupted_count = 0
+
+    @property
+    def is_speaking(self) -> bool:
+        return bool(self._speaking)
+
+    def start(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.ensure_future(self._run_async())
+
+    def stop(self) -> None:
+        self.clear()
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    def say(self, text: str, priority: BehaviorPriority) -> Utterance:
+        for utterance in self._speaking + self._pending:
+            if utterance.text == text:
+                self.deduplicated_count += 1
+                utterance.priority = max(utterance.priority, priority)
+                return utterance
+        utterance = Utterance(text, priority)
+        self._pending.append(utterance)
+        if self._speaking and priority > self._speaking[0].priority:
+            self.interrupt()
+        self._wakeup.set()
+        return utterance
+
+    async def say_async(self, text: str, priority: BehaviorPriority) -> bool:
+        # Shielded so a cancelled caller does not cancel a line shared with other callers
+        return await asyncio.shield(self.say(text, priority).done)
+
+    def interrupt(self) -> None:
+        if self._action is not None and self._action.is_running:
+            print("Interrupting speech: {}".format(" ".join(u.text for u in self._speaking)))
+            self.interrupted_count += 1
+            self._action.abort()
+
+    def clear(self) -> None:
+        for utterance in self._pending:
+            utterance.finish(False)
+        self._pending.clear()
+
+    def stats(self) -> dict:
+        return {
+            "latency_p50": round(_percentile(self.latencies, 0.5), 3),
+            "latency_p95": round(_percentile(self.latencies, 0.95), 3),
+            "gap_p50": round(_percentile(self.gaps, 0.5), 3),
+            "spoken": self.spoken_count,
+            "merged": self.merged_count,
+            "deduplicated": self.deduplicated_count,
+            "interrupted": self.interrupted_count
+        }
+
+    def _next_batch(self) -> List[Utterance]:
+        # Highest priority first, merging the run of same priority lines queued right after it
+        top = max(utterance.priority for utterance in self._pending)
+        start = next(i for i, utterance in enumerate(self._pending) if utterance.priority == top)
+        batch = [self._pending[start]]
+        length = len(batch[0].text)
+        for utterance in self._pending[start + 1:]:
+            if utterance.priority != top or length + len(utterance.text) + 1 > MAX_MERGED_LENGTH:
+                break
+            batch.append(utterance)
+            length += len(utterance.text) + 1
+        del self._pending[start:start + len(batch)]
+        return batch
+
+    def _merge(self, batch: List[Utterance]) -> str:
+        sentences = []
+        for utterance in batch:
+            text = utterance.text.strip()
+            if text and text[-1] not in ".!?,":
+                text += "."
+            sentences.append(text)
+        return " ".join(sentences)
+
+    async def _run_async(self) -> None:
+        while True:
+            if not self._pending:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            batch = self._next_batch()
+            try:
+                spoken = await self._speak_async(batch)
+            except cozmo.RobotBusy:
+                # Keep the lines and try again shortly
+                self._pending[0:0] = batch
+                await asyncio.sleep(BUSY_RETRY_DELAY)
+                continue
+            for utterance in batch:
+                utterance.finish(spoken)
+
+    async def _speak_async(self, batch: List[Utterance]) -> bool:
+        text = self._merge(batch)
+        started = time.monotonic()
+        self._speaking = batch
+        try:
+            self._action = self._start_say(text)
+        except cozmo.RobotBusy:
+            self._speaking = []
+            raise
+        for utterance in batch:
+            self.latencies.append(started - utterance.enqueued)
+        if self._last_end is not None and batch[0].enqueued < self._last_end:
+            self.gaps.append(started - self._last_end)
+        if len(batch) > 1:
+            self.merged_count += len(batch) - 1
+        print("Cozmo will speak: " + text)
+        try:
+            await self._action.wait_for_completed(timeout=self._timeout())
+            spoken = not self._action.has_failed
+        except asyncio.TimeoutError:
+            self._action.abort()
+            spoken = False
+        except Exception:
+            print("Speech failed: {}".format(sys.exc_info()[0]))
+            spoken = False
+        finally:
+            self._action = None
+            self._speaking = []
+            self._last_end = time.monotonic()
+        if spoken:
+            self.spoken_count += len(batch)
+        return spoken
@@ -0,0 +1,96 @@
+import asyncio
+import time
+from typing import Awaitable, Dict, List
+
+WATCHDOG_INTERVAL = 10
+ORPHAN_GRACE_PERIOD = 5
+MAX_LOOP_TASKS = 200
+
+
+class SupervisedTask():
+    def __init__(self, name: str, task: asyncio.Task, max_runtime: float = None) -> None:
+        self.name = name
+        self.task = task
+        self.started = time.monotonic()
+        self.max_runtime = max_runtime
+
+    @property
+    def runtime(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def is_stuck(self) -> bool:
+        return self.max_runtime is not None and self.runtime > self.max_runtime
+
+
+class TaskSupervisor():
+    def __init__(self) -> None:
+        self._tasks: Dict[str, SupervisedTask] = dict()
+        self._orphans: List[SupervisedTask] = []
+        self._last_check = 0.0
+        self.stuck_count = 0
+        self.leaked_count = 0
+
+    @property
+    def names(self) -> List[str]:
+        return list(self._tasks.keys())
+
+    def is_running(self, name: str) -> bool:
+        return name in self._tasks
+
+    def start(self, name: str, coro: Awaitable, max_runtime: float = None) -> asyncio.Task:
+        self.cancel(name)
+        task = asyncio.ensure_future(coro)
+        if hasattr(task, "set_name"):
+            task.set_name(name)
+        supervised = SupervisedTask(name, task, max_runtime)
+        self._tasks[name] = supervised
+        task.add_done_callback(lambda t: self._on_task_done(supervised))
+        return task
+
+    def cancel(self, name: str) -> bool:
+        supervised = self._tasks.pop(name, None)
+        if supervised is None:
+            return False
+        if not supervised.task.done():
+            print("Cancelling task {}".format(name))
+            supervised.task.cancel()
+            supervised.started = time.monotonic()
+            self._orphans.append(supervised)
+        return True
+
+    def cancel_all(self) -> None:
+        for name in self.names:
+            self.cancel(name)
+
+    def check(self) -> None:
+        now = time.monotonic()
+        if now - self._last_check < WATCHDOG_INTERVAL:
+            return
+        self._last_check = now
+
+        for supervised in list(self._tasks.values()):
+            if supervised.is_stuck:
+                self.stuck_count += 1
+                print("Task {} stuck for {:.0f}s, cancelling".format(supervised.name, supervised.runtime))
+                self.cancel(supervised.name)
+
+        orphans = [orphan for orphan in self._orphans if not orphan.task.done()]
+        self._orphans = [orphan for orphan in orphans if orphan.runtime <= ORPHAN_GRACE_PERIOD]
+        for orphan in orphans:
+            if orphan.runtime > ORPHAN_GRACE_PERIOD:
+                self.leaked_count += 1
+                print("Task {} ignored cancellation for {:.0f}s".format(orphan.name, orphan.runtime))
+
+        loop_tasks = len(asyncio.all_tasks())
+        if loop_tasks > MAX_LOOP_TASKS:
+            print("Event loop has {} pending tasks, something is leaking".format(loop_tasks))
+
+    def _on_task_done(self, supervised: SupervisedTask) -> None:
+        if self._tasks.get(supervised.name) is supervised:
+            del self._tasks[supervised.name]
+        if supervised.task.cancelled():
+            return
+        exception = supervised.task.exception()
+        if exception is not None:
+            print("Task {} failed: {!r}".format(supervised.name, exception))
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import sys
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Set
+from behavior_arbiter import Behavior
+from config import Config
+
+try:
+    import websockets
+except ImportError:
+    websockets = None
+
+# Returns the behavior running the command, or None when the command is unknown
+CommandHandler = Callable[[str, dict], Behavior]
+QueryHandler = Callable[[dict], Awaitable[List[dict]]]
+# Unread replies a client may have before it is disconnected
+MAX_PENDING_RESPONSES = 1000
+
+
+class WebSocketClient():
+    def __init__(self, websocket, queue_size: int) -> None:
+        self.websocket = websocket
+        # Responses are never dropped, telemetry keeps only the newest messages for a slow client
+        self.responses: Deque[dict] = deque()
+        self.telemetry: Deque[dict] = deque(maxlen=queue_size)
+        self.pending = asyncio.Event()
+        self.completions: Set[asyncio.Future] = set()
+        self.dropped = 0
+        self.closing = False
+
+    def send(self, message: dict, reliable: bool = False) -> None:
+        if self.closing:
+            return
+        if reliable:
+            if len(self.responses) >= MAX_PENDING_RESPONSES:
+                # Replies can't be dropped, a client that never reads them has to go
+                print("WebSocket client has {} unread replies, disconnecting".format(len(self.responses)))
+                self.closing = True
+                asyncio.ensure_future(self.websocket.close(code=1008, reason="too many unread replies"))
+                return
+            self.responses.append(message)
+        else:
+            if len(self.telemetry) == self.telemetry.maxlen:
+                self.dropped += 1
+            self.telemetry.append(message)
+        self.pending.set()
+
+    def next_message(self) -> dict:
+        if self.responses:
+            return self.responses.popleft()
+        if self.telemetry:
+            return self.telemetry.popleft()
+        return None
+
+
+class WebSocketApi():
+    def __init__(self, config: Config, on_command: CommandHandler, on_query: QueryHandler = None) -> None:
+        if websockets is None:
+            sys.exit("Cannot import websockets: Do `pip3 install --user websockets` to install")
+        self._config = config
+        self._on_command = on_command
+        self._on_query = on_query
+        self._server = None
+        self._clients: Set[WebSocketClient] = set()
+        # Latest message per telemetry stream, sent to clients when they connect
+        self._latest: Dict[str, dict] = dict()
+        self.commands_received = 0
+        self.dropped_messages = 0
+
+    @property
+    def clients(self) -> int:
+        return len(self._clients)
+
+    async def start_async(self) -> None:
+        self._server = await websockets.serve(self._handle_client_async, port=self._config.websocket_port)
+        print("WebSocket API on ws://0.0.0.0:{}".format(self._config.websocket_port))
+
+    async def stop_async(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def publish(self, stream: str, payload: dict, only_changes: bool = False) -> None:
+        message = {"type": "telemetry", "stream": stream, "data": payload}
+        if only_changes and self._latest.get(stream) == message:
+            return
+        self._latest[stream] = message
+        for client in self._clients:
+            client.send(message)
+
+    async def _handle_client_async(self, websocket, path: str = None) -> None:
+        client = WebSocketClient(websocket, self._config.websocket_client_queue)
+        self._clients.add(client)
+        print("WebSocket client connected ({} connected)".format(len(self._clients)))
+        for message in self._latest.values():
+            client.send(message)
+        writer = asyncio.ensure_future(self._write_async(client))
+        try:
+            async for raw in websocket:
+                self._on_message(client, raw)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self._clients.discard(client)
+            self.dropped_messages += client.dropped
+            writer.cancel()
+            for completion in client.completions:
+                completion.cancel()
+            print("WebSocket client disconnected ({} connected)".format(len(self._clients)))
+
+    async def _write_async(self, client: WebSocketClient) -> None:
+        try:
+            while True:
+                await client.pending.wait()
+                client.pending.clear()
+                message = client.next_message()
+                while message is not None:
+                    # Waits for the socket to drain, meanwhile telemetry for this client piles up and gets dropped
+                    await client.websocket.send(json.dumps(message))
+                    message = client.next_message()
+        except websockets.ConnectionClosed:
+            pass
+
+    def _on_message(self, client: WebSocketClient, raw: str) -> None:
+        try:
+            request = json.loads(raw)
+            request_id = request.get("id")
+            if "query" in request and self._on_query is not None:
+                self._track(client, self._answer_query_async(client, request_id, dict(request["query"])))
+                return
+            command = request["command"]
+            args = request.get("args") or dict()
+        except (ValueError, KeyError, TypeError, AttributeError):
+            client.send({"type": "ack", "id": None, "accepted": False, "error": "expected {\"id\", \"command\", \"args\"}"}, True)
+            return
+        self.commands_received += 1
+        behavior = self._on_command(command, args)
+        if behavior is None:
+            client.send({"type": "ack", "id": request_id, "accepted": False, "error": "unknown command {}".format(command)}, True)
+            return
+        client.send({"type": "ack", "id": request_id, "accepted": True}, True)
+        self._track(client, self._complete_async(client, request_id, behavior))
+
+    def _track(self, client: WebSocketClient, coro: Awaitable) -> None:
+        completion = asyncio.ensure_future(coro)
+        client.completions.add(completion)
+        completion.add_done_callback(client.completions.discard)
+
+    async def _complete_async(self, client: WebSocketClient, request_id, behavior: Behavior) -> None:
+        completed = await asyncio.shield(behavior.done)
+        client.send({"type": "done", "id": request_id, "completed": completed}, True)
+
+    async def _answer_query_async(self, client: WebSocketClient, request_id, query: dict) -> None:
+        try:
+            client.send({"type": "result", "id": request_id, "rows": await self._on_query(query)}, True)
+        except Exception as e:
+            client.send({"type": "result", "id": request_id, "error": str(e)}, True)
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self._clients),
+            "commands": self.commands_received,
+            "dropped": self.dropped_messages + sum(client.dropped for client in self._clients)
+        }
@@ -0,0 +1,39 @@
+import time
+from typing import Tuple
+from cozmo.faces import Face
+from cozmo.objects import ObservableObject
+from cozmo.robot import Robot
+from cozmo.util import Pose
+
+
+class WorldSnapshot():
+    # Read once per tick, every decision in that tick uses the same view of the world
+    __slots__ = ("timestamp", "faces", "objects", "is_picked_up", "is_cliff_detected", "is_on_charger",
+                 "is_charging", "is_moving", "battery_voltage", "pose")
+
+    def __init__(self, faces: Tuple[Face, ...] = (), objects: Tuple[ObservableObject, ...] = (),
+                 is_picked_up: bool = False, is_cliff_detected: bool = False, is_on_charger: bool = False,
+                 is_charging: bool = False, is_moving: bool = False, battery_voltage: float = 0.0,
+                 pose: Pose = None) -> None:
+        values = (time.monotonic(), faces, objects, is_picked_up, is_cliff_detected, is_on_charger,
+                  is_charging, is_moving, battery_voltage, pose)
+        for name, value in zip(self.__slots__, values):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name: str, value) -> None:
+        raise AttributeError("WorldSnapshot is read only")
+
+    @classmethod
+    def capture(cls, robot: Robot) -> "WorldSnapshot":
+        world = robot.world
+        return cls(tuple(world.visible_faces), tuple(world.visible_objects),
+                   robot.is_picked_up, robot.is_cliff_detected, robot.is_on_charger,
+                   robot.is_charging, robot.is_moving, robot.battery_voltage, robot.pose)
+
+    @property
+    def face(self) -> Face:
+        return self.faces[0] if self.faces else None
+
+    @property
+    def visible_object(self) -> ObservableObject:
+        return self.objects[0] if self.objects else None